@@ -0,0 +1,198 @@
+# Copyright (c) 2010 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""asyncio support for accessibility notifications (Python 3 only).
+
+Notifications arrive on the observer hub's run loop thread and are handed
+to the event loop with call_soon_threadsafe, so a pending wait costs a
+future and a hub subscription instead of a thread:
+
+    window = await app.waitForAsync('AXWindowCreated', AXTitle='Prefs*')
+
+    async with app.notifications('AXValueChanged') as changes:
+        async for element in changes:
+            ...
+
+Neither the hub thread nor the event loop makes accessibility calls:
+criteria are matched, and subscriptions made and dropped, in the loop's
+default executor. Waits use the running event loop, or the one given with
+loop=.
+"""
+
+import asyncio
+from collections import deque
+
+from .AXQuery import Query
+from .AXObserverHub import getHub
+
+
+def _resolved(loop, result):
+    future = loop.create_future()
+    future.set_result(result)
+    return future
+
+
+def _match(loop, query, element):
+    """Return a future resolved with whether element matches query."""
+    if not query.criteria:
+        return _resolved(loop, True)
+    return loop.run_in_executor(None, query.matches, element)
+
+
+def _unsubscribe(loop, hub, subscribed):
+    """Drop the subscription once subscribed, the future of its token."""
+    def drop(future):
+        if not future.cancelled() and future.exception() is None:
+            loop.run_in_executor(None, hub.unsubscribe, future.result())
+    subscribed.add_done_callback(drop)
+
+
+def waitFor(element, notification, timeout=None, query=None, loop=None,
+            **kwargs):
+    """Return a future resolved with the first element posting notification
+    and matching the criteria, or with None after timeout seconds.
+
+    Parameters: element to register the notification on, notification name,
+                optional timeout, criteria as a Query and/or keyword args,
+                event loop (default: the running one)
+    """
+    if loop is None:
+        loop = asyncio.get_running_loop()
+    query = Query.build(query, kwargs)
+    future = loop.create_future()
+
+    def matched(found, match):
+        if not future.done() and match.exception() is None and \
+                match.result():
+            future.set_result(found)
+
+    def deliver(elementRef):
+        # On the event loop thread
+        if future.done():
+            return
+        found = element.with_ref(elementRef)
+        _match(loop, query, found).add_done_callback(
+            lambda match: matched(found, match))
+
+    def post(elementRef, notification):
+        # On the run loop thread
+        loop.call_soon_threadsafe(deliver, elementRef)
+
+    hub = getHub()
+    subscribed = loop.run_in_executor(None, hub.subscribe, element.ref,
+                                      notification, post)
+
+    def failed(f):
+        if not future.done() and f.exception() is not None:
+            future.set_exception(f.exception())
+    subscribed.add_done_callback(failed)
+    future.add_done_callback(lambda f: _unsubscribe(loop, hub, subscribed))
+    if timeout is not None:
+        timer = loop.call_later(timeout, lambda: future.done() or
+                                future.set_result(None))
+        future.add_done_callback(lambda f: timer.cancel())
+    return future
+
+
+class NotificationStream(object):
+    """Asynchronous iterator over the elements posting a notification.
+
+    Elements not matching the criteria are skipped; the others come in the
+    order of their notifications. The subscription lasts until close(), or
+    the end of the async with block.
+    """
+
+    def __init__(self, element, notification, query=None, loop=None,
+                 **kwargs):
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        self._loop = loop
+        self._element = element
+        self._query = Query.build(query, kwargs)
+        self._items = deque()
+        # (element, future of whether it matches), in notification order
+        self._matching = deque()
+        self._waiter = None
+        self._closed = False
+        self._hub = getHub()
+        self._subscribed = loop.run_in_executor(None, self._hub.subscribe,
+                                                element.ref, notification,
+                                                self._post)
+
+    def _post(self, elementRef, notification):
+        # On the run loop thread
+        self._loop.call_soon_threadsafe(self._deliver, elementRef)
+
+    def _deliver(self, elementRef):
+        if self._closed:
+            return
+        found = self._element.with_ref(elementRef)
+        match = _match(self._loop, self._query, found)
+        self._matching.append((found, match))
+        match.add_done_callback(lambda match: self._flush())
+
+    def _flush(self):
+        # Hand over the matched elements, in order
+        while self._matching and self._matching[0][1].done():
+            found, match = self._matching.popleft()
+            if self._closed or match.exception() is not None or \
+                    not match.result():
+                continue
+            if self._waiter is not None and not self._waiter.done():
+                self._waiter.set_result(found)
+                self._waiter = None
+            else:
+                self._items.append(found)
+
+    def close(self):
+        """Stop listening; a pending iteration ends the async for loop."""
+        if self._closed:
+            return
+        self._closed = True
+        _unsubscribe(self._loop, self._hub, self._subscribed)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_exception(StopAsyncIteration())
+        self._waiter = None
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        if self._items:
+            return _resolved(self._loop, self._items.popleft())
+        if self._closed:
+            future = self._loop.create_future()
+            future.set_exception(StopAsyncIteration())
+            return future
+        self._waiter = self._loop.create_future()
+        return self._waiter
+
+    def __aenter__(self):
+        # Once subscribed, so that no notification is missed
+        entered = self._loop.create_future()
+
+        def subscribed(future):
+            if future.exception() is not None:
+                entered.set_exception(future.exception())
+            else:
+                entered.set_result(self)
+        self._subscribed.add_done_callback(subscribed)
+        return entered
+
+    def __aexit__(self, *exc_info):
+        self.close()
+        return _resolved(self._loop, None)
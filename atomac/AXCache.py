@@ -0,0 +1,183 @@
+# Copyright (c) 2010 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Per-element cache of attribute values.
+
+Every attribute read is a round trip to the target application. Within a
+cached() block values read once are served from memory until they expire,
+the element is evicted, or the application posts a notification saying
+they changed:
+
+    with atomac.cached(ttl=2):
+        buttons = window.findAllR(AXRole='AXButton')
+        titles = [b.AXTitle for b in buttons]
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from . import _a11y
+from .AXObserverHub import getHub
+
+
+# Notification -> attributes it makes stale; None for the whole element
+_invalidatedBy = {
+    'AXValueChanged': ('AXValue', 'AXSelectedText', 'AXSelectedTextRange',
+                       'AXNumberOfCharacters', 'AXVisibleCharacterRange'),
+    'AXTitleChanged': ('AXTitle',),
+    'AXMoved': ('AXPosition', 'AXFrame'),
+    'AXResized': ('AXSize', 'AXFrame'),
+    'AXUIElementDestroyed': None,
+}
+
+
+class AttributeCache(object):
+    """LRU cache of converted attribute values keyed by element reference.
+
+    Parameters: ttl - seconds a value stays valid, maxElements - number of
+                elements kept before the least recently used is evicted
+    """
+
+    def __init__(self, ttl=1.0, maxElements=5000):
+        self.ttl = ttl
+        self.maxElements = maxElements
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # ref -> {attr: (value, expiry)}
+        self._elements = OrderedDict()
+        # pid -> hub tokens
+        self._watched = {}
+
+    def get(self, ref, attrs):
+        """Look up cached values.
+
+        Parameters: element reference, list of attribute names
+        Returns: dict of the attributes found; the others are misses
+        """
+        now = time.time()
+        found = {}
+        with self._lock:
+            entry = self._elements.pop(ref, None)
+            if entry is not None:
+                # Most recently used elements go last
+                self._elements[ref] = entry
+                for attr in attrs:
+                    cached = entry.get(attr)
+                    if cached is None:
+                        continue
+                    value, expiry = cached
+                    if expiry < now:
+                        del entry[attr]
+                        continue
+                    # Do not let callers mutate the cached list
+                    found[attr] = list(value) if isinstance(value, list) \
+                        else value
+            self.hits += len(found)
+            self.misses += len(attrs) - len(found)
+        return found
+
+    def put(self, ref, values, getPid=None):
+        """Store the values read for an element.
+
+        getPid returns the pid of the element's application; it is only
+        called the first time the element is stored.
+        """
+        expiry = time.time() + self.ttl
+        with self._lock:
+            entry = self._elements.pop(ref, None)
+            isNew = entry is None
+            if isNew:
+                entry = {}
+                while len(self._elements) >= self.maxElements:
+                    self._elements.popitem(last=False)
+            self._elements[ref] = entry
+            for attr, value in values.items():
+                if isinstance(value, list):
+                    value = list(value)
+                entry[attr] = (value, expiry)
+
+        if isNew and getPid is not None:
+            pid = getPid()
+            if pid is not None and pid not in self._watched:
+                self._watch(pid)
+
+    def invalidate(self, ref, attrs=None):
+        """Forget the given attributes of ref, or all of them."""
+        with self._lock:
+            if attrs is None:
+                self._elements.pop(ref, None)
+                return
+            entry = self._elements.get(ref)
+            if entry is not None:
+                for attr in attrs:
+                    entry.pop(attr, None)
+
+    def clear(self):
+        with self._lock:
+            self._elements.clear()
+
+    def close(self):
+        """Drop every value and stop listening to notifications."""
+        hub = getHub()
+        for tokens in self._watched.values():
+            for token in tokens:
+                hub.unsubscribe(token)
+        self._watched.clear()
+        self.clear()
+
+    def _watch(self, pid):
+        # Notifications registered on the application element are posted
+        # for all of its elements
+        self._watched[pid] = []
+        backend = _a11y.getBackend()
+        appRef = backend.createApplication(pid)
+        hub = getHub()
+        for notification in _invalidatedBy:
+            try:
+                token = hub.subscribe(appRef, notification, self._notified)
+            except _a11y.Error:
+                # The values then only go stale through the ttl
+                continue
+            self._watched[pid].append(token)
+
+    def _notified(self, ref, notification):
+        self.invalidate(ref, _invalidatedBy[notification])
+
+
+@contextmanager
+def cached(ttl=1.0, maxElements=5000):
+    """Cache attribute values read within the with block.
+
+    Yields the AttributeCache in use, e.g. to look at its hit counts.
+    Nested blocks reuse the outer cache. The cache only serves the thread
+    which entered the block.
+    """
+    cache = _a11y._attributeCache()
+    if cache is not None:
+        yield cache
+        return
+
+    cache = AttributeCache(ttl, maxElements)
+    _a11y._cacheState.cache = cache
+    try:
+        yield cache
+    finally:
+        _a11y._cacheState.cache = None
+        cache.close()
@@ -15,19 +15,30 @@
 # this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
 # St, Fifth Floor, Boston, MA 02110-1301 USA.
 
-import fnmatch
 import time
 from collections import deque
 
-import AppKit
-import Quartz
-from AppKit import NSURL, NSString, NSDictionary, NSArray
-from PyObjCTools import AppHelper
+try:
+    import AppKit
+    import Quartz
+    from AppKit import NSURL, NSString, NSDictionary, NSArray
+    from .Clipboard import Clipboard
+except ImportError:
+    # Without PyObjC only the parts going through the accessibility backend
+    # (element attributes, searching, actions) are usable, e.g. with
+    # atomac.FakeBackend
+    AppKit = Quartz = Clipboard = None
 
 from . import _a11y
-from . import AXKeyboard
 from . import AXCallbacks
 from . import AXKeyCodeConstants
+from . import AXEventTiming
+from . import AXKeyEncoder
+from . import AXDrag
+from .AXQuery import Query
+from .AXSnapshot import Snapshot
+from .AppRegistry import getRegistry
+from .AXObserverHub import getHub
 
 
 class BaseAXUIElement(_a11y.AXUIElement):
@@ -43,16 +54,8 @@ class BaseAXUIElement(_a11y.AXUIElement):
     @classmethod
     def _getRunningApps(cls):
         """Get a list of the running applications."""
-
-        def runLoopAndExit():
-            AppHelper.stopEventLoop()
-
-        AppHelper.callLater(1, runLoopAndExit)
-        AppHelper.runConsoleEventLoop()
-        # Get a list of running applications
-        ws = AppKit.NSWorkspace.sharedWorkspace()
-        apps = ws.runningApplications()
-        return apps
+        # Kept current by workspace notifications, no run loop to spin
+        return getRegistry().apps()
 
     @classmethod
     def getAppRefByPid(cls, pid):
@@ -65,14 +68,11 @@ class BaseAXUIElement(_a11y.AXUIElement):
         Get the top level element for the application with the specified
         bundle ID, such as com.vmware.fusion.
         """
-        ra = AppKit.NSRunningApplication
-        # return value (apps) is always an array. if there is a match it will
-        # have an item, otherwise it won't.
-        apps = ra.runningApplicationsWithBundleIdentifier_(bundleId)
-        if len(apps) == 0:
+        app = getRegistry().byBundleId(bundleId)
+        if app is None:
             raise ValueError(('Specified bundle ID not found in '
                               'running apps: %s' % bundleId))
-        pid = apps[0].processIdentifier()
+        pid = app.processIdentifier()
         return cls.getAppRefByPid(pid)
 
     @classmethod
@@ -82,13 +82,11 @@ class BaseAXUIElement(_a11y.AXUIElement):
 
         Wildcards are also allowed.
         """
-        # Refresh the runningApplications list
-        apps = cls._getRunningApps()
-        for app in apps:
-            if fnmatch.fnmatch(app.localizedName(), name):
-                pid = app.processIdentifier()
-                return cls.getAppRefByPid(pid)
-        raise ValueError('Specified application not found in running apps.')
+        app = getRegistry().byName(name)
+        if app is None:
+            raise ValueError('Specified application not found in running apps.')
+        pid = app.processIdentifier()
+        return cls.getAppRefByPid(pid)
 
     @classmethod
     def getFrontmostApp(cls):
@@ -96,11 +94,13 @@ class BaseAXUIElement(_a11y.AXUIElement):
 
         Raise a ValueError exception if no GUI applications are found.
         """
-        # Refresh the runningApplications list
-        apps = cls._getRunningApps()
-        for app in apps:
-            pid = app.processIdentifier()
-            ref = cls.getAppRefByPid(pid)
+        # Asking every running app for AXFrontmost costs a round trip each,
+        # and background helpers only answer after timing out
+        pid = getRegistry().frontmost()
+        if pid is not None:
+            return cls.getAppRefByPid(pid)
+        for app in cls._getRunningApps():
+            ref = cls.getAppRefByPid(app.processIdentifier())
             try:
                 if ref.AXFrontmost:
                     return ref
@@ -110,18 +110,37 @@ class BaseAXUIElement(_a11y.AXUIElement):
                     _a11y.ErrorNotImplemented):
                 # Some applications do not have an explicit GUI
                 # and so will not have an AXFrontmost attribute
-                # Trying to read attributes from Google Chrome Helper returns
-                # ErrorAPIDisabled for some reason - opened radar bug 12837995
                 pass
         raise ValueError('No GUI application found.')
 
+    @classmethod
+    def getFrontmostWindow(cls):
+        """Get the focused window of the frontmost application.
+
+        Falls back to its main window, then to its first window.
+        Returns: window element or None if the application has no window
+        """
+        app = cls.getFrontmostApp()
+        values = app._getMultipleAttributes(['AXFocusedWindow',
+                                             'AXMainWindow'])
+        for attr in ('AXFocusedWindow', 'AXMainWindow'):
+            window = values[attr]
+            if window is not None and not isinstance(window, _a11y.Error):
+                return window
+        try:
+            windows = app.AXWindows
+        except _a11y.Error:
+            return None
+        if windows:
+            return windows[0]
+        return None
+
     @classmethod
     def getAnyAppWithWindow(cls):
         """Get a random app that has windows.
 
         Raise a ValueError exception if no GUI applications are found.
         """
-        # Refresh the runningApplications list
         apps = cls._getRunningApps()
         for app in apps:
             pid = app.processIdentifier()
@@ -209,30 +228,67 @@ class BaseAXUIElement(_a11y.AXUIElement):
         """
         self._setTimeout(timeout)
 
-    def _postQueuedEvents(self, interval=0.01):
+    # Timing profile of this element's events, see setEventTiming()
+    _eventTiming = None
+
+    def _postQueuedEvents(self, interval=None):
         """Private method to post queued events (e.g. Quartz events).
 
-        Each event in queue is a tuple (event call, args to event call).
+        Each event in queue is a tuple (event call, args to event call,
+        settle). The pause after each event is interval seconds if given,
+        else up to the timing profile of the element, or the global one.
         """
-        while len(self.eventList) > 0:
-            (nextEvent, args) = self.eventList.popleft()
-            nextEvent(*args)
-            time.sleep(interval)
+        if not hasattr(self, 'eventList'):
+            return
+        if interval is not None:
+            profile = AXEventTiming.FixedDelay(interval)
+        else:
+            profile = self._eventTiming or AXEventTiming.getEventTiming()
+        profile.post(self, self.eventList)
 
     def _clearEventQueue(self):
         """Clear the event queue."""
         if hasattr(self, 'eventList'):
             self.eventList.clear()
 
-    def _queueEvent(self, event, args):
+    def _queueEvent(self, event, args, settle=False):
         """Private method to queue events to run.
 
-        Each event in queue is a tuple (event call, args to event call).
+        Each event in queue is a tuple (event call, args to event call,
+        settle); settle marks the events after which the application
+        should have updated, such as key releases.
         """
         if not hasattr(self, 'eventList'):
-            self.eventList = deque([(event, args)])
+            self.eventList = deque([(event, args, settle)])
             return
-        self.eventList.append((event, args))
+        self.eventList.append((event, args, settle))
+
+    def _queueKeyEvents(self, entries, globally=False):
+        """Queue encoded keyboard events (see AXKeyEncoder).
+
+        The target application is resolved once for all of them.
+
+        Parameters: list of (event, settle) entries, global or app specific
+        Returns: None
+        """
+        if globally:
+            post, target = Quartz.CGEventPost, 0
+        else:
+            post, target = Quartz.CGEventPostToPid, self._getPid()
+        for event, settle in entries:
+            self._queueEvent(post, (target, event), settle)
+
+    def _encodeKeys(self, encode, *args):
+        """Encode keyboard events, clearing the queue on error.
+
+        Parameters: AXKeyEncoder.KeyEncoder method, its arguments
+        Returns: list of entries or raise ValueError exception
+        """
+        try:
+            return encode(*args)
+        except ValueError:
+            self._clearEventQueue()
+            raise
 
     def _addKeyToQueue(self, keychr, modFlags=0, globally=False):
         """Add keypress to queue.
@@ -243,52 +299,9 @@ class BaseAXUIElement(_a11y.AXUIElement):
                     global or app specific
         Returns: None or raise ValueError exception.
         """
-        # Awkward, but makes modifier-key-only combinations possible
-        # (since sendKeyWithModifiers() calls this)
-        if not keychr:
-            return
-
-        if not hasattr(self, 'keyboard'):
-            self.keyboard = AXKeyboard.loadKeyboard()
-
-        if keychr in self.keyboard['upperSymbols'] and not modFlags:
-            self._sendKeyWithModifiers(keychr,
-                                       [AXKeyCodeConstants.SHIFT],
-                                       globally)
-            return
-
-        if keychr.isupper() and not modFlags:
-            self._sendKeyWithModifiers(
-                keychr.lower(),
-                [AXKeyCodeConstants.SHIFT],
-                globally
-            )
-            return
-
-        if keychr not in self.keyboard:
-            self._clearEventQueue()
-            raise ValueError('Key %s not found in keyboard layout' % keychr)
-
-        # Press the key
-        keyDown = Quartz.CGEventCreateKeyboardEvent(None,
-                                                    self.keyboard[keychr],
-                                                    True)
-        # Release the key
-        keyUp = Quartz.CGEventCreateKeyboardEvent(None,
-                                                  self.keyboard[keychr],
-                                                  False)
-        # Set modflags on keyDown (default None):
-        Quartz.CGEventSetFlags(keyDown, modFlags)
-        # Set modflags on keyUp:
-        Quartz.CGEventSetFlags(keyUp, modFlags)
-
-        # Post the event to the given app
-        if not globally:
-            self._queueEvent(Quartz.CGEventPostToPid, (self._getPid(), keyDown))
-            self._queueEvent(Quartz.CGEventPostToPid, (self._getPid(), keyUp))
-        else:
-            self._queueEvent(Quartz.CGEventPost, (0, keyDown))
-            self._queueEvent(Quartz.CGEventPost, (0, keyUp))
+        encoder = AXKeyEncoder.getEncoder()
+        self._queueKeyEvents(self._encodeKeys(encoder.key, keychr, modFlags),
+                             globally)
 
     def _sendKey(self, keychr, modFlags=0, globally=False):
         """Send one character with no modifiers.
@@ -299,25 +312,22 @@ class BaseAXUIElement(_a11y.AXUIElement):
                     global or app specific
         Returns: None or raise ValueError exception
         """
-        escapedChrs = {
-            '\n': AXKeyCodeConstants.RETURN,
-            '\r': AXKeyCodeConstants.RETURN,
-            '\t': AXKeyCodeConstants.TAB,
-        }
-        if keychr in escapedChrs:
-            keychr = escapedChrs[keychr]
-
         self._addKeyToQueue(keychr, modFlags, globally=globally)
         self._postQueuedEvents()
 
     def _sendKeys(self, keystr):
         """Send a series of characters with no modifiers.
 
+        The whole string is encoded first, then posted with the timing
+        profile in use; nothing is sent if a character is not in the
+        keyboard layout.
+
         Parameters: keystr
         Returns: None or raise ValueError exception
         """
-        for nextChr in keystr:
-            self._sendKey(nextChr)
+        encoder = AXKeyEncoder.getEncoder()
+        self._queueKeyEvents(self._encodeKeys(encoder.string, keystr))
+        self._postQueuedEvents()
 
     def _pressModifiers(self, modifiers, pressed=True, globally=False):
         """Press given modifiers (provided in list form).
@@ -329,33 +339,10 @@ class BaseAXUIElement(_a11y.AXUIElement):
         if not isinstance(modifiers, list):
             raise TypeError('Please provide modifiers in list form')
 
-        if not hasattr(self, 'keyboard'):
-            self.keyboard = AXKeyboard.loadKeyboard()
-
-        modFlags = 0
-
-        # Press given modifiers
-        for nextMod in modifiers:
-            if nextMod not in self.keyboard:
-                errStr = 'Key %s not found in keyboard layout'
-                self._clearEventQueue()
-                raise ValueError(errStr % self.keyboard[nextMod])
-            modEvent = Quartz.CGEventCreateKeyboardEvent(
-                Quartz.CGEventSourceCreate(0),
-                self.keyboard[nextMod],
-                pressed
-            )
-            if not pressed:
-                # Clear the modflags:
-                Quartz.CGEventSetFlags(modEvent, 0)
-            if globally:
-                self._queueEvent(Quartz.CGEventPost, (0, modEvent))
-            else:
-                self._queueEvent(Quartz.CGEventPostToPid, (self._getPid(), modEvent))
-
-            # Add the modifier flags
-            modFlags += AXKeyboard.modKeyFlagConstants[nextMod]
-
+        encoder = AXKeyEncoder.getEncoder()
+        entries, modFlags = self._encodeKeys(encoder.modifiers, modifiers,
+                                             pressed)
+        self._queueKeyEvents(entries, globally)
         return modFlags
 
     def _holdModifierKeys(self, modifiers):
@@ -408,8 +395,8 @@ class BaseAXUIElement(_a11y.AXUIElement):
         return keychr.count('<') == 1 and keychr.count('>') == 1 and \
                keychr[0] == '<' and keychr[-1] == '>'
 
-    def _sendKeyWithModifiers(self, keychr, modifiers, globally=False):
-        """Send one character with the given modifiers pressed.
+    def _queueKeyWithModifiers(self, keychr, modifiers, globally=False):
+        """Queue one character with the given modifiers pressed.
 
         Parameters: key character, list of modifiers, global or app specific
         Returns: None or raise ValueError exception
@@ -417,16 +404,18 @@ class BaseAXUIElement(_a11y.AXUIElement):
         if not self._isSingleCharacter(keychr):
             raise ValueError('Please provide only one character to send')
 
-        if not hasattr(self, 'keyboard'):
-            self.keyboard = AXKeyboard.loadKeyboard()
+        encoder = AXKeyEncoder.getEncoder()
+        self._queueKeyEvents(self._encodeKeys(encoder.keyWithModifiers,
+                                              keychr, modifiers),
+                             globally)
 
-        modFlags = self._pressModifiers(modifiers, globally=globally)
-
-        # Press the non-modifier key
-        self._sendKey(keychr, modFlags, globally=globally)
+    def _sendKeyWithModifiers(self, keychr, modifiers, globally=False):
+        """Send one character with the given modifiers pressed.
 
-        # Release the modifiers
-        self._releaseModifiers(modifiers, globally=globally)
+        Parameters: key character, list of modifiers, global or app specific
+        Returns: None or raise ValueError exception
+        """
+        self._queueKeyWithModifiers(keychr, modifiers, globally)
 
         # Post the queued keypresses:
         self._postQueuedEvents()
@@ -516,68 +505,36 @@ class BaseAXUIElement(_a11y.AXUIElement):
                   action from some special requirement
         Returns: None
         """
+        # speed used to pause 1/speed seconds after every pixel; it now
+        # scales the pause between the steps, 0 meaning no pause at all
+        interval = 0.01 / speed if speed else 0
+        self._dragMouse(stopCoord, strCoord, interval=interval)
+
+    def _dragMouse(self, stopCoord, strCoord=(0, 0), steps=20,
+                   easing='linear', interval=0.01, grabbed=None, over=None,
+                   timeout=5, recorder=None, hold=0.1):
+        """Private method to drag with the left mouse button (see AXDrag).
+
+        Parameters: stopCoord (x, y) drop point
+        Optional: strCoord (x, y) drag point, default (0, 0) gets the
+                  current mouse position; steps, easing, interval,
+                  grabbed and over conditions, timeout, recorder, hold
+        Returns: True if dropped, False if a condition timed out
+        """
         # Get current position as start point if strCoord not given
         if strCoord == (0, 0):
             loc = AppKit.NSEvent.mouseLocation()
             strCoord = (loc.x, Quartz.CGDisplayPixelsHigh(0) - loc.y)
 
-        # Press left button down
-        pressLeftButton = Quartz.CGEventCreateMouseEvent(
-            None,
-            Quartz.kCGEventLeftMouseDown,
-            strCoord,
-            Quartz.kCGMouseButtonLeft
-        )
-        # Queue the events
-        Quartz.CGEventPost(Quartz.CoreGraphics.kCGHIDEventTap, pressLeftButton)
-        # Wait for reponse of system, a fuzzy icon appears
-        time.sleep(5)
-        # Simulate mouse moving speed, k is slope
-        speed = round(1 / float(speed), 2)
-        xmoved = stopCoord[0] - strCoord[0]
-        ymoved = stopCoord[1] - strCoord[1]
-        if ymoved == 0:
-            raise ValueError('Not support horizontal moving')
-        else:
-            k = abs(ymoved / xmoved)
-
-        if xmoved != 0:
-            for xpos in range(int(abs(xmoved))):
-                if xmoved > 0 and ymoved > 0:
-                    currcoord = (strCoord[0] + xpos, strCoord[1] + xpos * k)
-                elif xmoved > 0 and ymoved < 0:
-                    currcoord = (strCoord[0] + xpos, strCoord[1] - xpos * k)
-                elif xmoved < 0 and ymoved < 0:
-                    currcoord = (strCoord[0] - xpos, strCoord[1] - xpos * k)
-                elif xmoved < 0 and ymoved > 0:
-                    currcoord = (strCoord[0] - xpos, strCoord[1] + xpos * k)
-                # Drag with left button
-                dragLeftButton = Quartz.CGEventCreateMouseEvent(
-                    None,
-                    Quartz.kCGEventLeftMouseDragged,
-                    currcoord,
-                    Quartz.kCGMouseButtonLeft
-                )
-                Quartz.CGEventPost(Quartz.CoreGraphics.kCGHIDEventTap,
-                                   dragLeftButton)
-                # Wait for reponse of system
-                time.sleep(speed)
-        else:
-            raise ValueError('Not support vertical moving')
-        upLeftButton = Quartz.CGEventCreateMouseEvent(
-            None,
-            Quartz.kCGEventLeftMouseUp,
-            stopCoord,
-            Quartz.kCGMouseButtonLeft
-        )
-        # Wait for reponse of system, a plus icon appears
-        time.sleep(5)
-        # Up left button up
-        Quartz.CGEventPost(Quartz.CoreGraphics.kCGHIDEventTap, upLeftButton)
+        drag = AXDrag.MouseDrag(strCoord, stopCoord, steps=steps,
+                                easing=easing, interval=interval,
+                                grabbed=grabbed, over=over, timeout=timeout,
+                                post=recorder, hold=hold)
+        return drag.run()
 
-    def _waitFor(self, timeout, notification, **kwargs):
-        """Wait for a particular UI event to occur; this can be built
-        upon in NativeUIElement for specific convenience methods.
+    def _waitForCallback(self, kwargs):
+        """Return the (callback, args, kwargs) a wait calls for each
+        notification, from the kwargs given to waitFor.
         """
         callback = self._matchOther
         retelem = None
@@ -618,13 +575,47 @@ class BaseAXUIElement(_a11y.AXUIElement):
                     callbackKwargs = kwargs
         else:
             callbackArgs = (retelem, )
-            # Pass the kwargs to the default callback
-            callbackKwargs = kwargs
+            # Pass the criteria, compiled once, to the default callback
+            callbackKwargs = {'query': Query.build(kwargs.pop('query', None),
+                                                   kwargs)}
+        return callback, callbackArgs, callbackKwargs
 
+    def _waitFor(self, timeout, notification, **kwargs):
+        """Wait for a particular UI event to occur; this can be built
+        upon in NativeUIElement for specific convenience methods.
+
+        The notification is subscribed to on the shared observer hub, and
+        the callback runs in the calling thread for each one received.
+        """
+        callback, callbackArgs, callbackKwargs = self._waitForCallback(kwargs)
         return self._setNotification(timeout, notification, callback,
                                      callbackArgs,
                                      callbackKwargs)
 
+    def _waitForAny(self, conditions, timeout):
+        """Wait for the first of several conditions, each given as
+        (notification, criteria) or (element, notification, criteria).
+        """
+        watches = []
+        for condition in conditions:
+            if isinstance(condition, str):
+                condition = (condition, )
+            if len(condition) == 3:
+                element, notification, criteria = condition
+            else:
+                element = self
+                notification = condition[0]
+                criteria = condition[1] if len(condition) > 1 else None
+            if isinstance(criteria, Query):
+                criteria = {'query': criteria}
+            callback, callbackArgs, callbackKwargs = \
+                element._waitForCallback(dict(criteria or {}))
+            watches.append((element, notification, callback, callbackArgs,
+                            callbackKwargs))
+
+        index, retelem, result = self._waitForNotifications(timeout, watches)
+        return index, retelem
+
     def waitForFocusToMatchCriteria(self, timeout=10, **kwargs):
         """Convenience method to wait for focused element to change
         (to element matching kwargs criteria).
@@ -635,6 +626,10 @@ class BaseAXUIElement(_a11y.AXUIElement):
         def _matchFocused(retelem, **kwargs):
           return retelem if retelem._match(**kwargs) else None
 
+        # Compile the criteria once rather than on every focus change
+        if kwargs and 'query' not in kwargs:
+            kwargs = {'query': Query(**kwargs)}
+
         retelem = None
         return self._waitFor(timeout, 'AXFocusedUIElementChanged',
                              callback=_matchFocused,
@@ -662,21 +657,88 @@ class BaseAXUIElement(_a11y.AXUIElement):
             for child in children:
                 yield child
 
-    def _generateChildrenR(self, target=None):
-        """Generator which recursively yields all AXChildren of the object."""
-        if target is None:
-            target = self
+    @staticmethod
+    def _getChildren(element, withRole=False):
+        """Return the AXChildren of element, and its AXRole if withRole.
+
+        Elements which cannot be read have no children.
+        """
+        if not withRole:
+            try:
+                return element.AXChildren or [], None
+            except _a11y.Error:
+                return [], None
         try:
-            children = target.AXChildren
+            values = element._getMultipleAttributes(['AXChildren', 'AXRole'])
         except _a11y.Error:
-            return
-        if children:
-            for child in children:
+            return [], None
+        children = values['AXChildren']
+        role = values['AXRole']
+        if not isinstance(children, list):
+            children = []
+        if isinstance(role, _a11y.Error):
+            role = None
+        return children, role
+
+    def _generateChildrenR(self, target=None, strategy='dfs', max_depth=None,
+                           prune=None, descend_roles=None):
+        """Generator which recursively yields all AXChildren of the object.
+
+        The tree is walked iteratively, so deep trees cost neither a
+        generator frame per level nor recursion depth.
+
+        Parameters: strategy - 'dfs' (depth-first, pre-order) or 'bfs'
+                    (breadth-first, shallow elements first),
+                    max_depth - levels below target to visit (1 for the
+                    direct children only), prune - callable taking an
+                    element and returning True to skip it and its subtree,
+                    descend_roles - only descend into elements with one of
+                    these roles (their children cannot match otherwise)
+        """
+        if target is None:
+            target = self
+        if strategy not in ('dfs', 'bfs'):
+            raise ValueError('Unknown search strategy: %s' % strategy)
+        if descend_roles is not None:
+            descend_roles = frozenset(descend_roles)
+        withRole = descend_roles is not None
+
+        children, _ = self._getChildren(target)
+        if strategy == 'bfs':
+            # (element, depth) waiting to be yielded
+            queue = deque((child, 1) for child in children)
+            while queue:
+                child, depth = queue.popleft()
+                if prune is not None and prune(child):
+                    continue
                 yield child
-                for c in self._generateChildrenR(child):
-                    yield c
+                if max_depth is not None and depth >= max_depth:
+                    continue
+                grandChildren, role = self._getChildren(child, withRole)
+                if withRole and role not in descend_roles:
+                    continue
+                queue.extend((c, depth + 1) for c in grandChildren)
+            return
 
-    def _match(self, **kwargs):
+        # One iterator over the remaining siblings per level being visited
+        stack = [iter(children)]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                continue
+            if prune is not None and prune(child):
+                continue
+            yield child
+            if max_depth is not None and len(stack) >= max_depth:
+                continue
+            grandChildren, role = self._getChildren(child, withRole)
+            if withRole and role not in descend_roles:
+                continue
+            if grandChildren:
+                stack.append(iter(grandChildren))
+
+    def _match(self, query=None, **kwargs):
         """Method which indicates if the object matches specified criteria.
 
         Match accepts criteria as kwargs and looks them up on attributes.
@@ -685,65 +747,66 @@ class BaseAXUIElement(_a11y.AXUIElement):
 
         obj._match(AXTitle='Terminal*')
         obj._match(AXRole='TextField', AXRoleDescription='search text field')
+
+        A compiled Query may be given instead of, or along with, the kwargs.
         """
-        for k in kwargs.keys():
-            try:
-                val = getattr(self, k)
-            except _a11y.Error:
-                return False
-            # Not all values may be strings (e.g. size, position)
-            if isinstance(val, str):
-                if not fnmatch.fnmatch(val, kwargs[k]):
-                    return False
-            else:
-                if val != kwargs[k]:
-                    return False
-        return True
+        return Query.build(query, kwargs).matches(self)
 
-    def _matchOther(self, obj, **kwargs):
+    def _matchOther(self, obj, query=None, **kwargs):
         """Perform _match but on another object, not self."""
         if obj is not None:
+            query = Query.build(query, kwargs)
             # Need to check that the returned UI element wasn't destroyed first:
-            if self._findFirstR(**kwargs):
-                return obj._match(**kwargs)
+            if self._findFirstR(query):
+                return query.matches(obj)
         return False
 
-    def _generateFind(self, **kwargs):
+    def _generateFind(self, query=None, **kwargs):
         """Generator which yields matches on AXChildren."""
+        query = Query.build(query, kwargs)
         for needle in self._generateChildren():
-            if needle._match(**kwargs):
+            if query.matches(needle):
                 yield needle
 
-    def _generateFindR(self, **kwargs):
+    # findAllR / findFirstR keyword arguments driving the traversal instead
+    # of being matched against attributes
+    _traversalOptions = ('strategy', 'max_depth', 'prune', 'descend_roles')
+
+    def _generateFindR(self, query=None, **kwargs):
         """Generator which yields matches on AXChildren and their children."""
-        for needle in self._generateChildrenR():
-            if needle._match(**kwargs):
+        options = {}
+        for option in self._traversalOptions:
+            if option in kwargs:
+                options[option] = kwargs.pop(option)
+        query = Query.build(query, kwargs)
+        for needle in self._generateChildrenR(**options):
+            if query.matches(needle):
                 yield needle
 
-    def _findAll(self, **kwargs):
+    def _findAll(self, query=None, **kwargs):
         """Return a list of all children that match the specified criteria."""
         result = []
-        for item in self._generateFind(**kwargs):
+        for item in self._generateFind(query, **kwargs):
             result.append(item)
         return result
 
-    def _findAllR(self, **kwargs):
+    def _findAllR(self, query=None, **kwargs):
         """Return a list of all children (recursively) that match the specified
         criteria.
         """
         result = []
-        for item in self._generateFindR(**kwargs):
+        for item in self._generateFindR(query, **kwargs):
             result.append(item)
         return result
 
-    def _findFirst(self, **kwargs):
+    def _findFirst(self, query=None, **kwargs):
         """Return the first object that matches the criteria."""
-        for item in self._generateFind(**kwargs):
+        for item in self._generateFind(query, **kwargs):
             return item
 
-    def _findFirstR(self, **kwargs):
+    def _findFirstR(self, query=None, **kwargs):
         """Search recursively for the first object that matches the criteria."""
-        for item in self._generateFindR(**kwargs):
+        for item in self._generateFindR(query, **kwargs):
             return item
 
     def _getApplication(self):
@@ -863,19 +926,18 @@ class BaseAXUIElement(_a11y.AXUIElement):
         role = '<No role!>'
         c = repr(self.__class__).partition('<class \'')[-1].rpartition('\'>')[0]
         try:
-            title = repr(self.AXTitle)
+            values = self._getMultipleAttributes(['AXTitle', 'AXValue',
+                                                  'AXRoleDescription',
+                                                  'AXRole'])
         except Exception:
-            try:
-                title = repr(self.AXValue)
-            except Exception:
-                try:
-                    title = repr(self.AXRoleDescription)
-                except Exception:
-                    pass
-        try:
-            role = self.AXRole
-        except Exception:
-            pass
+            values = {}
+        for attr in ('AXTitle', 'AXValue', 'AXRoleDescription'):
+            if attr in values and not isinstance(values[attr], _a11y.Error):
+                title = repr(values[attr])
+                break
+        if 'AXRole' in values and not isinstance(values['AXRole'],
+                                                 _a11y.Error):
+            role = values['AXRole']
         if len(title) > 20:
             title = title[:20] + '...\''
         return '<%s %s %s>' % (c, role, title)
@@ -886,8 +948,15 @@ class NativeUIElement(BaseAXUIElement):
     most natural way possible.
     """
 
-    def getAttributes(self):
-        """Get a list of the attributes available on the element."""
+    def getAttributes(self, names=None):
+        """Get a list of the attributes available on the element.
+
+        If a list of attribute names is given, fetch their values in a single
+        call instead and return them as a dict.  Attributes which could not
+        be read map to the corresponding atomac.Error instance.
+        """
+        if names is not None:
+            return self._getMultipleAttributes(names)
         return self._getAttributes()
 
     def getActions(self):
@@ -898,25 +967,49 @@ class NativeUIElement(BaseAXUIElement):
         """Set the specified attribute to the specified string."""
         return self._setString(attribute, string)
 
-    def findFirst(self, **kwargs):
+    def findFirst(self, query=None, **kwargs):
         """Return the first object that matches the criteria."""
-        return self._findFirst(**kwargs)
+        return self._findFirst(query, **kwargs)
 
-    def findFirstR(self, **kwargs):
+    def findFirstR(self, query=None, **kwargs):
         """Search recursively for the first object that matches the
         criteria.
+
+        Besides the criteria, the search accepts strategy ('dfs' or 'bfs'),
+        max_depth, prune (callable returning True for elements to skip
+        along with their children) and descend_roles (roles of the
+        elements worth searching below). Use strategy='bfs' to find a
+        shallow element without diving into every subtree first.
         """
-        return self._findFirstR(**kwargs)
+        return self._findFirstR(query, **kwargs)
 
-    def findAll(self, **kwargs):
-        """Return a list of all children that match the specified criteria."""
-        return self._findAll(**kwargs)
+    def findAll(self, query=None, **kwargs):
+        """Return a list of all children that match the specified criteria.
 
-    def findAllR(self, **kwargs):
+        The criteria are keyword args, a Query, or a Query refined by
+        keyword args.
+        """
+        return self._findAll(query, **kwargs)
+
+    def findAllR(self, query=None, **kwargs):
         """Return a list of all children (recursively) that match
         the specified criteria.
+
+        Accepts the same traversal options as findFirstR, e.g.:
+
+        window.findAllR(AXRole='AXButton', max_depth=3,
+                        prune=lambda e: e.AXRole == 'AXMenuBar')
         """
-        return self._findAllR(**kwargs)
+        return self._findAllR(query, **kwargs)
+
+    def snapshot(self, attributes=None, max_depth=None):
+        """Capture this element and its subtree for repeated lookups.
+
+        Parameters: attribute names to capture (Snapshot.defaultAttributes
+                    if None), levels below this element to capture
+        Returns: Snapshot answering findAll/findFirst locally
+        """
+        return Snapshot(self, attributes, max_depth)
 
     def getElementAtPosition(self, coord):
         """Return the AXUIElement at the given coordinates.
@@ -989,6 +1082,93 @@ class NativeUIElement(BaseAXUIElement):
         """Send a series of characters with no modifiers."""
         return self._sendKeys(keystr)
 
+    def sendKeysViaPaste(self, keystr, timeout=1):
+        """Enter a series of characters by pasting them.
+
+        The clipboard contents are saved, replaced by keystr, pasted with
+        command-v into the application and restored. The paste is
+        confirmed once the element's AXValue changed to contain keystr. If
+        AXValue is still readable and unchanged after timeout seconds,
+        nothing was pasted and keystr is typed with sendKeys() instead. An
+        unreadable value (e.g. of a secure text field) tells nothing, so
+        the paste is trusted.
+
+        Parameters: keystr, optional timeout
+        Returns: True if pasted or typed instead, False if the value changed
+                 without containing keystr (e.g. the application
+                 transformed it)
+        """
+        before = self._pasteValue()
+        saved = Clipboard.save()
+        try:
+            try:
+                changes = getHub().listen(self.ref, 'AXValueChanged')
+            except _a11y.Error:
+                # Not observable, poll the value instead
+                changes = None
+            try:
+                Clipboard.copy(keystr)
+                self._sendKeyWithModifiers('v', [AXKeyCodeConstants.COMMAND])
+                pasted = self._waitForPaste(keystr, before, changes, timeout)
+            finally:
+                if changes is not None:
+                    changes.close()
+        finally:
+            # Only once the application is done with the pasteboard
+            Clipboard.restore(saved)
+
+        if pasted:
+            return True
+        after = self._pasteValue()
+        if before is None or after is None:
+            # Nothing to compare, trust the paste
+            return True
+        if after != before:
+            return False
+        self._sendKeys(keystr)
+        return True
+
+    def _pasteValue(self):
+        """Return the AXValue of the element, or None if it has none."""
+        try:
+            return self._getAttribute('AXValue')
+        except _a11y.Error:
+            return None
+
+    def _waitForPaste(self, keystr, before, changes, timeout):
+        """Wait for AXValue to change from before and contain keystr.
+
+        Parameters: keystr, AXValue before pasting, Subscription to
+                    AXValueChanged or None to poll, timeout
+        Returns: True if it did within timeout seconds
+        """
+        deadline = time.time() + timeout
+        while True:
+            value = self._pasteValue()
+            try:
+                if value != before and keystr in value:
+                    return True
+            except TypeError:
+                # No text value
+                pass
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            if changes is None:
+                time.sleep(min(0.05, remaining))
+            else:
+                changes.get(remaining)
+
+    def setEventTiming(self, profile):
+        """Set the timing profile of the events posted for this element.
+
+        Parameters: an AXEventTiming profile (NoDelay(), FixedDelay(interval)
+                    or WaitForValueChange(timeout)), or None to use the
+                    global one (see atomac.setEventTiming)
+        Returns: None
+        """
+        self._eventTiming = profile
+
     def pressModifiers(self, modifiers):
         """Hold modifier keys (e.g. [Option])."""
         return self._holdModifierKeys(modifiers)
@@ -1106,6 +1286,32 @@ class NativeUIElement(BaseAXUIElement):
         """
         self._leftMouseDragged(stopCoord, strCoord, speed)
 
+    def dragMouse(self, stopCoord, strCoord=(0, 0), steps=20, easing='linear',
+                  interval=0.01, grabbed=None, over=None, timeout=5,
+                  recorder=None, hold=0.1):
+        """Drag with the left mouse button along an interpolated path.
+
+        Parameters: stopCoord, the position of dragging stopped
+        Optional: strCoord, the position of dragging started, (0, 0) gets
+                  the current position
+                  steps, number of moves to get there
+                  easing, 'linear', 'easeInOut', 'easeOut' or a function
+                  mapping [0, 1] to [0, 1]
+                  interval, seconds between two moves
+                  grabbed, callable returning true once the drag started
+                  (e.g. a drag image appeared)
+                  over, callable returning true once the drop can happen
+                  (e.g. the drop target is highlighted)
+                  timeout, seconds to wait for each condition
+                  recorder, AXDrag.DragRecorder getting the events instead
+                  of the system
+                  hold, seconds the button stays down before moving
+        Returns: True if dropped, False if a condition timed out (the
+                 drag is then cancelled)
+        """
+        return self._dragMouse(stopCoord, strCoord, steps, easing, interval,
+                               grabbed, over, timeout, recorder, hold)
+
     def doubleClickMouse(self, coord):
         """Double-click primary mouse button.
 
@@ -1162,9 +1368,32 @@ class NativeUIElement(BaseAXUIElement):
         argument if 'args' are given.  Note also that if the UI element is
         destroyed, callback should not use it, otherwise the function will
         hang.
+
+        The criteria may also be given as a compiled Query with the 'query'
+        keyword arg.
         """
         return self._waitFor(timeout, notification, **kwargs)
 
+    def waitForAny(self, conditions, timeout=10):
+        """Wait for the first of several UI events.
+
+        Each condition is a notification name, a (notification, criteria)
+        pair or an (element, notification, criteria) triple, the
+        notification being registered on this object unless an element is
+        given. Criteria are a dict of the keyword args waitFor takes
+        (including 'callback', 'args' and 'kwargs') or a Query. All the
+        conditions are waited for at once, e.g.:
+
+        index, elem = app.waitForAny([
+            ('AXSheetCreated', {'AXTitle': 'Save*'}),
+            ('AXWindowCreated', Query(AXSubrole='AXDialog')),
+        ])
+
+        Returns: (index of the condition met, element which posted the
+                 notification), or (None, None) on timeout
+        """
+        return self._waitForAny(conditions, timeout)
+
     def waitForCreation(self, timeout=10, notification='AXCreated'):
         """Convenience method to wait for creation of some UI element.
 
@@ -1234,9 +1463,11 @@ class NativeUIElement(BaseAXUIElement):
 
         Returns: Boolean
         """
-        return self.waitFor(timeout, 'AXFocusedUIElementChanged',
-                            AXRole=newFocusedElem.AXRole,
-                            AXPosition=newFocusedElem.AXPosition)
+        criteria = newFocusedElem.getAttributes(['AXRole', 'AXPosition'])
+        for value in criteria.values():
+            if isinstance(value, _a11y.Error):
+                raise value
+        return self.waitFor(timeout, 'AXFocusedUIElementChanged', **criteria)
 
     def waitForFocusedWindowToChange(self, nextWinName, timeout=10):
         """Convenience method to wait for focused window to change
@@ -1248,23 +1479,66 @@ class NativeUIElement(BaseAXUIElement):
         return self.waitFor(timeout, 'AXFocusedWindowChanged',
                             AXTitle=nextWinName)
 
-    def _convenienceMatch(self, role, attr, match):
-        """Method used by role based convenience functions to find a match"""
+    def waitForAsync(self, notification, timeout=None, **kwargs):
+        """Awaitable counterpart of waitFor (Python 3, asyncio).
+
+        Criteria are given as keyword args and/or a Query with 'query';
+        'loop' is the event loop, the running one by default.
+        Returns: future resolved with the element that posted the matching
+                 notification, or None after timeout seconds
+        """
+        from .AXAsync import waitFor
+        return waitFor(self, notification, timeout, **kwargs)
+
+    def waitForCreationAsync(self, timeout=None, notification='AXCreated'):
+        """Awaitable counterpart of waitForCreation.
+
+        Returns: future resolved with the element created, or None
+        """
+        return self.waitForAsync(notification, timeout)
+
+    def waitForFocusToChangeAsync(self, newFocusedElem, timeout=None):
+        """Awaitable counterpart of waitForFocusToChange.
+
+        Returns: future resolved with the focused element, or None
+        """
+        criteria = newFocusedElem.getAttributes(['AXRole', 'AXPosition'])
+        for value in criteria.values():
+            if isinstance(value, _a11y.Error):
+                raise value
+        return self.waitForAsync('AXFocusedUIElementChanged', timeout,
+                                 **criteria)
+
+    def notifications(self, notification, **kwargs):
+        """Asynchronous iterator over the elements posting notification
+        and matching the optional criteria (Python 3, asyncio).
+
+        Use it with async with, or close() it when done. 'loop' is the
+        event loop, the running one by default.
+        """
+        from .AXAsync import NotificationStream
+        return NotificationStream(self, notification, **kwargs)
+
+    @staticmethod
+    def _convenienceQuery(role, attr, match):
+        """Build the Query of a role based convenience function"""
+        # match may be a Query with further criteria
+        if isinstance(match, Query):
+            return match.refine(AXRole=role)
         kwargs = {}
         # If the user supplied some text to search for,
         # supply that in the kwargs
         if match:
             kwargs[attr] = match
-        return self.findAll(AXRole=role, **kwargs)
+        return Query(AXRole=role, **kwargs)
+
+    def _convenienceMatch(self, role, attr, match):
+        """Method used by role based convenience functions to find a match"""
+        return self.findAll(self._convenienceQuery(role, attr, match))
 
     def _convenienceMatchR(self, role, attr, match):
         """Method used by role based convenience functions to find a match"""
-        kwargs = {}
-        # If the user supplied some text to search for,
-        # supply that in the kwargs
-        if match:
-            kwargs[attr] = match
-        return self.findAllR(AXRole=role, **kwargs)
+        return self.findAllR(self._convenienceQuery(role, attr, match))
 
     def textAreas(self, match=None):
         """Return a list of text areas with an optional match parameter."""
@@ -0,0 +1,190 @@
+# Copyright (c) 2010 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Left mouse button drags along an interpolated path.
+
+The pointer moves from the start to the stop point in a given number of
+steps, in any direction, spaced according to an easing function. Instead
+of sleeping a fixed time, a drag can wait for readiness conditions: grabbed
+after the button went down (e.g. a drag image appeared) and over before
+releasing it (e.g. the drop target is highlighted). Conditions are
+callables, polled until they return a true value:
+
+    drag = MouseDrag((10, 10), (300, 200), steps=30, easing='easeInOut',
+                     over=lambda: target.AXSelected)
+    drag.run()
+
+The events go through post(name, point), name being 'down', 'drag' or
+'up'; a DragRecorder keeps their timeline, so drags can be checked
+without a display.
+"""
+
+import time
+
+try:
+    import Quartz
+except ImportError:
+    Quartz = None
+
+
+def linear(t):
+    return t
+
+
+def easeInOut(t):
+    return t * t * (3 - 2 * t)
+
+
+def easeOut(t):
+    return 1 - (1 - t) * (1 - t)
+
+
+# Easing functions by name; each maps [0, 1] to [0, 1]
+easings = {
+    'linear': linear,
+    'easeInOut': easeInOut,
+    'easeOut': easeOut,
+}
+
+
+def path(start, stop, steps=20, easing='linear'):
+    """Return the points of a move from start to stop.
+
+    Parameters: start and stop points (x, y), number of steps, easing
+                function or its name in easings
+    Returns: list of steps points, start excluded and stop included
+    """
+    if steps < 1:
+        raise ValueError('A drag needs at least one step')
+    if callable(easing):
+        ease = easing
+    elif easing in easings:
+        ease = easings[easing]
+    else:
+        raise ValueError('Unknown easing: %s' % (easing,))
+    dx = stop[0] - start[0]
+    dy = stop[1] - start[1]
+    points = []
+    for step in range(1, steps + 1):
+        progress = ease(float(step) / steps)
+        points.append((start[0] + dx * progress, start[1] + dy * progress))
+    return points
+
+
+def postMouseEvent(name, point):
+    """Post a left mouse button event to the system.
+
+    Parameters: 'down', 'drag' or 'up', point (x, y)
+    Returns: None
+    """
+    eventTypes = {
+        'down': Quartz.kCGEventLeftMouseDown,
+        'drag': Quartz.kCGEventLeftMouseDragged,
+        'up': Quartz.kCGEventLeftMouseUp,
+    }
+    event = Quartz.CGEventCreateMouseEvent(None, eventTypes[name], point,
+                                           Quartz.kCGMouseButtonLeft)
+    Quartz.CGEventPost(Quartz.kCGHIDEventTap, event)
+
+
+class DragRecorder(object):
+    """Timeline of the events of drags.
+
+    events is the list of (seconds since the first event, name, point);
+    events are also posted to the system if forward is True.
+    """
+
+    def __init__(self, forward=False):
+        self.forward = forward
+        self.events = []
+        self._start = None
+
+    def __call__(self, name, point):
+        now = time.time()
+        if self._start is None:
+            self._start = now
+        self.events.append((now - self._start, name, point))
+        if self.forward:
+            postMouseEvent(name, point)
+
+
+def _waitUntil(condition, timeout):
+    # Poll condition with a growing delay; return whether it became true
+    deadline = time.time() + timeout
+    delay = 0.01
+    while not condition():
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.2)
+    return True
+
+
+class MouseDrag(object):
+    """Drag with the left mouse button from start to stop.
+
+    Parameters: start and stop points (x, y)
+    Optional: steps, easing (see path()), interval in seconds between two
+              moves, grabbed and over conditions, timeout in seconds for
+              each condition, post callable (default postMouseEvent), hold
+              in seconds the button stays down before anything else
+    """
+
+    def __init__(self, start, stop, steps=20, easing='linear', interval=0.01,
+                 grabbed=None, over=None, timeout=5, post=None, hold=0.1):
+        self.start = start
+        self.stop = stop
+        self.points = path(start, stop, steps, easing)
+        self.interval = interval
+        self.hold = hold
+        self.grabbed = grabbed
+        self.over = over
+        self.timeout = timeout
+        self.post = post or postMouseEvent
+
+    def run(self):
+        """Run the drag.
+
+        If a condition is not met within the timeout, the pointer goes back
+        to the start point before the button is released, so that nothing
+        gets dropped.
+
+        Returns: True if dropped, False if cancelled
+        """
+        post = self.post
+        post('down', self.start)
+        # Applications tell a drag from a click by the button staying down
+        if self.hold:
+            time.sleep(self.hold)
+        if self.grabbed is not None and not _waitUntil(self.grabbed,
+                                                       self.timeout):
+            post('up', self.start)
+            return False
+
+        for point in self.points:
+            post('drag', point)
+            if self.interval:
+                time.sleep(self.interval)
+
+        if self.over is not None and not _waitUntil(self.over, self.timeout):
+            post('drag', self.start)
+            post('up', self.start)
+            return False
+
+        post('up', self.stop)
+        return True
@@ -0,0 +1,109 @@
+# Copyright (c) 2010 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Timing profiles for posting queued keyboard and mouse events.
+
+A profile decides how long to pause after each posted event:
+
+    NoDelay()             post as fast as possible
+    FixedDelay(0.01)      sleep after every event (the historical default)
+    WaitForValueChange()  after each key release, wait until the element
+                          reports AXValueChanged, or a short timeout
+
+Select one for every element with setEventTiming(), or for one element
+with element.setEventTiming(); events queued with an explicit interval
+(e.g. mouse drags) keep using it.
+"""
+
+import time
+
+from .AXObserverHub import getHub
+
+
+class TimingProfile(object):
+    """Base class of the timing profiles.
+
+    post() is given the element the events are posted for and the queue
+    of (event call, args, settle) entries, settle being True for the
+    events after which the target application should have updated
+    (key releases).
+    """
+
+    def post(self, element, events):
+        while events:
+            nextEvent, args, settle = events.popleft()
+            nextEvent(*args)
+            self.pause(settle)
+
+    def pause(self, settle):
+        pass
+
+
+class NoDelay(TimingProfile):
+    """Post the events back to back."""
+
+
+class FixedDelay(TimingProfile):
+    """Sleep interval seconds after every event."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+
+    def pause(self, settle):
+        time.sleep(self.interval)
+
+
+class WaitForValueChange(TimingProfile):
+    """After each key release, wait for the element's AXValueChanged.
+
+    Waits at most timeout seconds per event, for keys which do not change
+    the value; other events are posted back to back. Falls back to
+    FixedDelay(timeout) when the element cannot be observed.
+    """
+
+    def __init__(self, timeout=0.1):
+        self.timeout = timeout
+
+    def post(self, element, events):
+        try:
+            subscription = getHub().listen(element.ref, 'AXValueChanged')
+        except Exception:
+            return FixedDelay(self.timeout).post(element, events)
+        with subscription:
+            while events:
+                nextEvent, args, settle = events.popleft()
+                nextEvent(*args)
+                if settle:
+                    subscription.get(self.timeout)
+
+
+# Profile used by elements which were not given one
+_defaultProfile = FixedDelay()
+
+
+def setEventTiming(profile):
+    """Use profile to post the events of all elements without their own.
+
+    Pass None to go back to FixedDelay(0.01).
+    """
+    global _defaultProfile
+    _defaultProfile = profile if profile is not None else FixedDelay()
+
+
+def getEventTiming():
+    """Return the profile used by elements without their own."""
+    return _defaultProfile
@@ -0,0 +1,182 @@
+# Copyright (c) 2010 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Encoding of keystrokes into Quartz keyboard events.
+
+Events only differ by key code, direction and modifier flags, and Quartz
+copies an event when posting it, so each combination is created once from
+a shared event source and reused afterwards. A string is encoded into a
+flat list of (event, settle) entries before anything is posted; settle
+marks the key releases (see AXEventTiming).
+"""
+
+import threading
+
+try:
+    import Quartz
+except ImportError:
+    Quartz = None
+
+from . import AXKeyboard
+from .AXKeyCodeConstants import RETURN, TAB
+
+
+_escapedChrs = {
+    '\n': RETURN,
+    '\r': RETURN,
+    '\t': TAB,
+}
+
+
+class KeyEncoder(object):
+    """Turn characters and modifiers into reusable keyboard events.
+
+    keyboard is the AXKeyboard.KeyboardMap of the layout to type with.
+    """
+
+    def __init__(self, keyboard):
+        self.keyboard = keyboard
+        self._lock = threading.Lock()
+        self._source = None
+        # (key code, pressed, flags) -> event
+        self._events = {}
+        # (character, flags) -> entries
+        self._keys = {}
+
+    def _event(self, keycode, pressed, flags):
+        key = (keycode, pressed, flags)
+        event = self._events.get(key)
+        if event is None:
+            with self._lock:
+                if self._source is None:
+                    self._source = Quartz.CGEventSourceCreate(0)
+                event = Quartz.CGEventCreateKeyboardEvent(self._source,
+                                                          keycode, pressed)
+                Quartz.CGEventSetFlags(event, flags)
+                self._events[key] = event
+        return event
+
+    def modifiers(self, modifiers, pressed=True):
+        """Encode pressing (or releasing) modifiers, in the given order.
+
+        Parameters: modifiers list, optional keypressed state
+        Returns: (entries, flags of the modifiers) or raise ValueError
+        """
+        entries = []
+        flags = 0
+        for nextMod in modifiers:
+            if nextMod not in self.keyboard:
+                raise ValueError('Key %s not found in keyboard layout' %
+                                 nextMod)
+            flags |= AXKeyboard.modKeyFlagConstants[nextMod]
+            # The flags of a modifier press include the modifiers down so
+            # far, as for a physical keyboard
+            entries.append((self._event(self.keyboard.keycode(nextMod),
+                                        pressed, flags if pressed else 0),
+                            False))
+        return entries, flags
+
+    def _press(self, keycode, modFlags):
+        return [(self._event(keycode, True, modFlags), False),
+                (self._event(keycode, False, modFlags), True)]
+
+    def key(self, keychr, modFlags=0):
+        """Encode the keystrokes typing one character.
+
+        Without modifier flags, the modifiers the layout needs for the
+        character (e.g. shift for upper case) are pressed around it; with
+        them, only its key is pressed, with the flags set plus those of the
+        modifiers the layout needs. Characters typed through a dead key
+        cannot be combined with modifiers.
+
+        Parameters: key character or constant referring to a non-alpha-numeric
+                    key (e.g. RETURN or TAB), modifier flags
+        Returns: list of entries or raise ValueError
+        """
+        entries = self._keys.get((keychr, modFlags))
+        if entries is not None:
+            return entries
+
+        # Awkward, but makes modifier-key-only combinations possible
+        # (since sendKeyWithModifiers() calls this)
+        if not keychr:
+            return []
+
+        strokes = self.keyboard.strokes(_escapedChrs.get(keychr, keychr))
+        if strokes is None:
+            raise ValueError('Key %s not found in keyboard layout' % keychr)
+
+        if modFlags:
+            if len(strokes) > 1:
+                raise ValueError('Key %s needs a dead key and cannot be '
+                                 'sent with modifiers' % keychr)
+            keycode, modifiers = strokes[0]
+            flags = modFlags
+            for nextMod in modifiers:
+                flags |= AXKeyboard.modKeyFlagConstants[nextMod]
+            entries = self._press(keycode, flags)
+        else:
+            entries = []
+            for keycode, modifiers in strokes:
+                if not modifiers:
+                    entries.extend(self._press(keycode, 0))
+                    continue
+                pressed, flags = self.modifiers(modifiers)
+                released = self.modifiers(modifiers[::-1], pressed=False)[0]
+                entries.extend(pressed + self._press(keycode, flags) +
+                               released)
+
+        self._keys[(keychr, modFlags)] = entries
+        return entries
+
+    def keyWithModifiers(self, keychr, modifiers):
+        """Encode one key with the given modifiers held down.
+
+        Modifiers are released in reverse order from pressing them.
+
+        Parameters: key character, modifiers list
+        Returns: list of entries or raise ValueError
+        """
+        pressed, flags = self.modifiers(modifiers)
+        released = self.modifiers(modifiers[::-1], pressed=False)[0]
+        return pressed + self.key(keychr, flags) + released
+
+    def string(self, keystr):
+        """Encode a series of characters with no modifiers.
+
+        Parameters: keystr
+        Returns: list of entries or raise ValueError
+        """
+        entries = []
+        for nextChr in keystr:
+            entries.extend(self.key(nextChr))
+        return entries
+
+
+_encoderLock = threading.Lock()
+# layout id -> KeyEncoder
+_encoders = {}
+
+
+def getEncoder():
+    """Return the key encoder of the active keyboard layout."""
+    keyboard = AXKeyboard.getKeyboardMap()
+    with _encoderLock:
+        encoder = _encoders.get(keyboard.layoutId)
+        if encoder is None or encoder.keyboard is not keyboard:
+            encoder = _encoders[keyboard.layoutId] = KeyEncoder(keyboard)
+        return encoder
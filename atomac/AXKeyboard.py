@@ -15,23 +15,280 @@
 # this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
 # St, Fifth Floor, Boston, MA 02110-1301 USA.
 
-import Quartz
+import struct
+import threading
 
 from .AXKeyCodeConstants import *
 
+try:
+    import Quartz
+    kCGEventFlagMaskCommand = Quartz.kCGEventFlagMaskCommand
+    kCGEventFlagMaskShift = Quartz.kCGEventFlagMaskShift
+    kCGEventFlagMaskAlternate = Quartz.kCGEventFlagMaskAlternate
+    kCGEventFlagMaskControl = Quartz.kCGEventFlagMaskControl
+except ImportError:
+    # Values from CGEventTypes.h, so that the tables stay usable without
+    # PyObjC (e.g. with atomac.FakeBackend)
+    kCGEventFlagMaskCommand = 0x00100000
+    kCGEventFlagMaskShift = 0x00020000
+    kCGEventFlagMaskAlternate = 0x00080000
+    kCGEventFlagMaskControl = 0x00040000
+
 
 # Based on the flags provided in the Quartz documentation it does not seem
 # that we can distinguish between left and right modifier keys, even though
 # there are different virtual key codes offered between the two sets.
 # Thus for now we offer only a generic modifier key set w/o L-R distinction.
 modKeyFlagConstants = {
-    COMMAND: Quartz.kCGEventFlagMaskCommand,
-    SHIFT: Quartz.kCGEventFlagMaskShift,
-    OPTION: Quartz.kCGEventFlagMaskAlternate,
-    CONTROL: Quartz.kCGEventFlagMaskControl,
+    COMMAND: kCGEventFlagMaskCommand,
+    SHIFT: kCGEventFlagMaskShift,
+    OPTION: kCGEventFlagMaskAlternate,
+    CONTROL: kCGEventFlagMaskControl,
 }
 
 
+# Modifier state scanned for each key, as passed to UCKeyTranslate (the
+# Carbon modifier bits shifted right by 8), and the keys holding it
+_modifierStates = (
+    (0, ()),
+    (0x02, (SHIFT,)),
+    (0x08, (OPTION,)),
+    (0x0a, (SHIFT, OPTION)),
+)
+
+# Virtual key codes of the keys typing characters: the main block without
+# return and tab, plus the JIS yen and underscore keys. The numeric keypad
+# is left out so that digits map to the main row
+_characterKeyCodes = ([code for code in range(51) if code not in (36, 48)] +
+                      [93, 94])
+
+
+def _isKeyName(key):
+    return len(key) > 1 and key.startswith('<')
+
+
+# Key names (e.g. RETURN, SHIFT) -> virtual key code, the same in all layouts
+_namedKeys = dict((name, code)
+                  for name, code in list(US_keyboard.items()) +
+                  list(specialKeys.items())
+                  if isinstance(code, int) and _isKeyName(name))
+
+
+class KeyboardMap(object):
+    """Characters and key names mapped to the keystrokes typing them.
+
+    Each keystroke is a (virtual key code, modifiers) pair; characters
+    needing a dead key (e.g. option-e then e for an e with acute accent on
+    a US layout) take two keystrokes.
+    """
+
+    def __init__(self, layoutId, strokes):
+        self.layoutId = layoutId
+        # character or key name -> tuple of keystrokes
+        self._strokes = strokes
+
+    def strokes(self, key):
+        """Return the keystrokes typing key, or None if it cannot be typed.
+
+        Parameters: character or key name (e.g. RETURN)
+        Returns: tuple of (virtual key code, modifiers) pairs or None
+        """
+        return self._strokes.get(key)
+
+    def keycode(self, key):
+        """Return the virtual key code of key, raising KeyError if unknown.
+
+        Modifiers are ignored, e.g. the code of '!' is the one of '1' on a
+        US layout.
+        """
+        return self._strokes[key][-1][0]
+
+    def __contains__(self, key):
+        return key in self._strokes
+
+    def __len__(self):
+        return len(self._strokes)
+
+
+def _usKeyboardMap():
+    """Build the static US map, used when the layout cannot be read."""
+    strokes = {}
+    shifted = set(US_keyboard['upperSymbols'])
+    for key, code in US_keyboard.items():
+        if not isinstance(code, int) or _isKeyName(key):
+            continue
+        strokes[key] = ((code, (SHIFT,) if key in shifted else ()),)
+        if key.isalpha():
+            strokes[key.upper()] = ((code, (SHIFT,)),)
+    for name, code in _namedKeys.items():
+        strokes[name] = ((code, ()),)
+    return KeyboardMap('US', strokes)
+
+
+class _Carbon(object):
+    """The Text Input Source and Unicode key layout functions of Carbon."""
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        carbonPath = ctypes.util.find_library('Carbon')
+        cfPath = ctypes.util.find_library('CoreFoundation')
+        if not carbonPath or not cfPath:
+            raise OSError('Carbon is not available')
+        self.ctypes = ctypes
+        carbon = ctypes.cdll.LoadLibrary(carbonPath)
+        cf = ctypes.cdll.LoadLibrary(cfPath)
+
+        void_p = ctypes.c_void_p
+        self.currentLayout = carbon.TISCopyCurrentKeyboardLayoutInputSource
+        self.currentLayout.restype = void_p
+        self.property = carbon.TISGetInputSourceProperty
+        self.property.restype = void_p
+        self.property.argtypes = [void_p, void_p]
+        self.layoutDataKey = void_p.in_dll(
+            carbon, 'kTISPropertyUnicodeKeyLayoutData')
+        self.sourceIdKey = void_p.in_dll(carbon, 'kTISPropertyInputSourceID')
+        self.keyboardType = carbon.LMGetKbdType
+        self.keyboardType.restype = ctypes.c_uint8
+        self.translate = carbon.UCKeyTranslate
+        self.translate.restype = ctypes.c_int32
+        self.translate.argtypes = [
+            void_p, ctypes.c_uint16, ctypes.c_uint16, ctypes.c_uint32,
+            ctypes.c_uint32, ctypes.c_uint32, ctypes.POINTER(ctypes.c_uint32),
+            ctypes.c_ulong, ctypes.POINTER(ctypes.c_ulong),
+            ctypes.POINTER(ctypes.c_uint16),
+        ]
+        self.dataBytes = cf.CFDataGetBytePtr
+        self.dataBytes.restype = void_p
+        self.dataBytes.argtypes = [void_p]
+        self.stringValue = cf.CFStringGetCString
+        self.stringValue.restype = ctypes.c_bool
+        self.stringValue.argtypes = [void_p, ctypes.c_char_p, ctypes.c_long,
+                                     ctypes.c_uint32]
+        self.release = cf.CFRelease
+        self.release.argtypes = [void_p]
+
+    def layoutId(self, source):
+        """Return the identifier of the keyboard layout input source."""
+        sourceId = self.property(source, self.sourceIdKey)
+        buf = self.ctypes.create_string_buffer(256)
+        # kCFStringEncodingUTF8
+        if not sourceId or not self.stringValue(sourceId, buf, 256,
+                                                0x08000100):
+            return None
+        return buf.value.decode('utf-8')
+
+    def keyboardMap(self, source):
+        """Read the keyboard layout input source, or return None if it has
+        no Unicode key layout.
+        """
+        layoutData = self.property(source, self.layoutDataKey)
+        if not layoutData:
+            return None
+        layout = self.dataBytes(layoutData)
+        keyboardType = self.keyboardType()
+        ctypes = self.ctypes
+        state = ctypes.c_uint32()
+        length = ctypes.c_ulong()
+        chars = (ctypes.c_uint16 * 4)()
+
+        def translate(keycode, modifiers, deadState):
+            # Returns (character or None, dead key state)
+            state.value = deadState
+            err = self.translate(layout, keycode, 0, modifiers,
+                                 keyboardType, 0, ctypes.byref(state),
+                                 4, ctypes.byref(length), chars)
+            if err or length.value != 1:
+                return None, (0 if err else state.value)
+            char = struct.pack('<H', chars[0]).decode('utf-16-le')
+            if char < u' ' or char == u'\x7f':
+                return None, 0
+            return char, 0
+
+        strokes = {}
+        deadKeys = []
+        for modifiers, held in _modifierStates:
+            for keycode in _characterKeyCodes:
+                char, deadState = translate(keycode, modifiers, 0)
+                if deadState:
+                    deadKeys.append(((keycode, held), deadState))
+                elif char is not None and char not in strokes:
+                    strokes[char] = ((keycode, held),)
+        # Characters composed with a dead key come last, so that a key
+        # typing them directly wins
+        for deadStroke, deadState in deadKeys:
+            for modifiers, held in _modifierStates:
+                for keycode in _characterKeyCodes:
+                    char = translate(keycode, modifiers, deadState)[0]
+                    if char is not None and char not in strokes:
+                        strokes[char] = (deadStroke, (keycode, held))
+
+        for name, code in _namedKeys.items():
+            strokes[name] = ((code, ()),)
+        return strokes
+
+
+_lock = threading.Lock()
+_carbon = None
+# layout id -> KeyboardMap
+_maps = {}
+# (input source, its KeyboardMap) of the last call
+_current = (None, None)
+
+
+def _getCarbon():
+    # Called with _lock held; False once Carbon turned out unusable
+    global _carbon
+    if _carbon is None:
+        try:
+            _carbon = _Carbon()
+        except (ImportError, OSError, AttributeError, ValueError):
+            _carbon = False
+    return _carbon
+
+
+def getKeyboardMap():
+    """Return the map of the active keyboard layout.
+
+    Each layout is read once (with UCKeyTranslate) and then shared by the
+    whole process. Input sources are kept alive by the system, so as long
+    as the same one is selected only its reference is fetched, not its
+    identifier. The static US map is returned when the layout cannot be
+    read, e.g. without Carbon.
+    """
+    global _current
+    with _lock:
+        carbon = _getCarbon()
+        source = carbon.currentLayout() if carbon else None
+        if not source:
+            keyboard = _maps.get(None)
+            if keyboard is None:
+                keyboard = _maps[None] = _usKeyboardMap()
+            return keyboard
+        try:
+            if source == _current[0]:
+                return _current[1]
+            layoutId = carbon.layoutId(source)
+            keyboard = _maps.get(layoutId)
+            if keyboard is None:
+                strokes = None
+                if layoutId is not None:
+                    strokes = carbon.keyboardMap(source)
+                if strokes is None:
+                    keyboard = _usKeyboardMap()
+                else:
+                    keyboard = KeyboardMap(layoutId, strokes)
+                _maps[layoutId] = keyboard
+            _current = (source, keyboard)
+            return keyboard
+        finally:
+            carbon.release(source)
+
+
+_legacyKeyboard = None
+
+
 def loadKeyboard():
     """Load a given keyboard mapping (of characters to virtual key codes).
 
@@ -39,9 +296,12 @@ def loadKeyboard():
     Parameters: None (relies on the internationalization settings)
     Returns: A dictionary representing the current keyboard mapping (of
              characters to keycodes)
-    """
-    # Currently assumes US keyboard
-    keyboard_layout = DEFAULT_KEYBOARD
-    keyboard_layout.update(specialKeys)
 
-    return keyboard_layout
+    Kept for compatibility, see getKeyboardMap() for the layout in use.
+    """
+    global _legacyKeyboard
+    if _legacyKeyboard is None:
+        keyboard_layout = dict(DEFAULT_KEYBOARD)
+        keyboard_layout.update(specialKeys)
+        _legacyKeyboard = keyboard_layout
+    return _legacyKeyboard
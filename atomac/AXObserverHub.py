@@ -0,0 +1,242 @@
+# Copyright (c) 2010 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Long-lived AX observers shared by everything listening to notifications.
+
+One observer is created per application and kept scheduled on the backend's
+background run loop for as long as the hub lives, so subscribing to a
+notification costs a registration instead of an observer and a run loop of
+its own. Registrations with the
+accessibility API are reference-counted: several subscribers to the same
+element and notification share one.
+"""
+
+import time
+import itertools
+import logging
+import threading
+from collections import deque
+
+from . import _a11y
+
+
+class _Registration(object):
+    """Subscribers to one (element, notification) pair."""
+
+    def __init__(self, ref, notification):
+        self.ref = ref
+        self.notification = notification
+        # token -> callback
+        self.callbacks = {}
+
+
+class Subscription(object):
+    """Notifications queued for a thread waiting on them.
+
+    Returned by ObserverHub.listen(); the thread calling get() does the
+    work, so the run loop thread never blocks on a waiter. Several
+    (element, notification) pairs can feed the same subscription, each
+    with a tag telling them apart.
+
+    With a limit, at most limit notifications are queued: past it, the
+    queue is emptied and overflowed set until clear(), telling that
+    notifications were lost.
+    """
+
+    def __init__(self, hub, limit=None):
+        self._condition = threading.Condition()
+        self._events = deque()
+        self._hub = hub
+        self._tokens = []
+        self.limit = limit
+        self.overflowed = False
+
+    def add(self, ref, notification, tag=None):
+        """Also queue the notifications posted on ref, with tag."""
+        def post(elementRef, notification):
+            with self._condition:
+                if self.overflowed:
+                    return
+                if self.limit is not None and len(self._events) >= self.limit:
+                    self.overflowed = True
+                    self._events.clear()
+                    return
+                self._events.append((elementRef, notification, tag))
+                self._condition.notify()
+
+        self._tokens.append(self._hub.subscribe(ref, notification, post))
+
+    def get(self, timeout=None):
+        """Return the next (elementRef, notification, tag), or None if none
+        arrived within timeout seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while not self._events:
+                if deadline is None:
+                    self._condition.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            return self._events.popleft()
+
+    def clear(self):
+        """Drop the queued notifications and reset overflowed."""
+        with self._condition:
+            self._events.clear()
+            self.overflowed = False
+
+    def close(self):
+        """Stop receiving notifications."""
+        while self._tokens:
+            self._hub.unsubscribe(self._tokens.pop())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ObserverHub(object):
+    """Dispatch AX notifications to subscribed callbacks.
+
+    Callbacks are called as callback(elementRef, notification) on the
+    backend's run loop thread; they must not block.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.RLock()
+        self._tokens = itertools.count(1)
+        # pid -> observer
+        self._observers = {}
+        # (pid, ref, notification) -> _Registration
+        self._registrations = {}
+        # token -> registration key
+        self._subscriptions = {}
+
+    def _observerFor(self, pid):
+        observer = self._observers.get(pid)
+        if observer is None:
+            err, observer = self.backend.createObserver(pid, self._dispatch)
+            if err != _a11y.kAXErrorSuccess:
+                _a11y._setError(err, 'Could not create observer for notification')
+            self.backend.scheduleObserver(observer)
+            self._observers[pid] = observer
+        return observer
+
+    def subscribe(self, ref, notification, callback):
+        """Call callback for each notification posted on ref.
+
+        Parameters: element reference, notification name, callable taking
+                    (elementRef, notification)
+        Returns: token to pass to unsubscribe()
+        """
+        err, pid = self.backend.getPid(ref)
+        if err != _a11y.kAXErrorSuccess:
+            _a11y._setError(err, 'Error retrieving PID')
+
+        with self._lock:
+            key = (pid, ref, notification)
+            registration = self._registrations.get(key)
+            if registration is None:
+                observer = self._observerFor(pid)
+                registration = _Registration(ref, notification)
+                err = self.backend.addNotification(observer, ref,
+                                                   notification, registration)
+                if err not in (_a11y.kAXErrorSuccess,
+                               _a11y.kAXErrorNotificationAlreadyRegistered):
+                    _a11y._setError(err, 'Could not add notification to observer')
+                self._registrations[key] = registration
+
+            token = next(self._tokens)
+            registration.callbacks[token] = callback
+            self._subscriptions[token] = key
+        return token
+
+    def listen(self, ref=None, notification=None, limit=None):
+        """Return a Subscription queuing the notifications posted on ref,
+        or an empty one to add() them to, keeping at most limit of them.
+
+        Use it as a context manager, or close() it when done.
+        """
+        subscription = Subscription(self, limit)
+        if ref is not None:
+            try:
+                subscription.add(ref, notification)
+            except Exception:
+                subscription.close()
+                raise
+        return subscription
+
+    def unsubscribe(self, token):
+        """Stop calling the callback subscribed with token.
+
+        The AX registration is removed with its last subscriber. Unknown
+        tokens are ignored.
+        """
+        with self._lock:
+            key = self._subscriptions.pop(token, None)
+            if key is None:
+                return
+            registration = self._registrations[key]
+            del registration.callbacks[token]
+            if registration.callbacks:
+                return
+
+            del self._registrations[key]
+            # The observer itself stays, ready for the next subscriber. The
+            # element may be gone already, nothing left to remove then
+            self.backend.removeNotification(self._observers[key[0]],
+                                            registration.ref,
+                                            registration.notification)
+
+    def close(self):
+        """Remove every registration and observer."""
+        with self._lock:
+            for token in list(self._subscriptions):
+                self.unsubscribe(token)
+            for observer in self._observers.values():
+                self.backend.unscheduleObserver(observer)
+            self._observers.clear()
+
+    def _dispatch(self, observer, element, notification, registration):
+        with self._lock:
+            callbacks = list(registration.callbacks.values())
+        for callback in callbacks:
+            try:
+                callback(element, notification)
+            except Exception:
+                logging.exception('Error in %s notification callback',
+                                  notification)
+
+
+_hub = None
+_hubLock = threading.Lock()
+
+
+def getHub():
+    """Return the observer hub of the accessibility backend in use."""
+    global _hub
+    backend = _a11y.getBackend()
+    with _hubLock:
+        if _hub is None or _hub.backend is not backend:
+            _hub = ObserverHub(backend)
+        return _hub
@@ -0,0 +1,137 @@
+# Copyright (c) 2010 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Compiled search criteria.
+
+A Query holds the same criteria as the keyword arguments of findAll*, but
+compiles them once: shell-like patterns become regular expressions, plain
+strings are compared directly, and the criteria are checked cheapest
+first so that most elements are rejected after reading their role only.
+
+    buttons = window.findAllR(Query(AXRole='AXButton', AXTitle='Save*'))
+"""
+
+import re
+import fnmatch
+
+from future.utils import string_types
+
+from . import _a11y
+
+
+# Attributes which are small and quick to read; the others are read only
+# once these matched
+_cheapAttributes = ('AXRole', 'AXSubrole')
+
+# Order in which the remaining attributes are checked, others come after
+_attributeCosts = {
+    'AXRoleDescription': 1,
+    'AXIdentifier': 1,
+    'AXTitle': 2,
+    'AXDescription': 2,
+    'AXHelp': 3,
+    'AXValue': 4,
+}
+
+_globCharacters = re.compile(r'[*?[]')
+
+
+def _compile(expected):
+    """Return a predicate checking a value against one criterion."""
+    if not isinstance(expected, string_types):
+        return lambda val: val == expected
+    if not _globCharacters.search(expected):
+        # Exact match, no pattern to run
+        return lambda val: val == expected
+    matchPattern = re.compile(fnmatch.translate(expected)).match
+    # Not all values may be strings (e.g. size, position)
+    return lambda val: isinstance(val, string_types) and \
+        matchPattern(val) is not None
+
+
+class Query(object):
+    """Search criteria compiled once and matched against many elements.
+
+    Criteria are given as keyword arguments, as for findAll*: AX attribute
+    names, or other element attribute names, mapped to the expected value
+    or to a shell-like pattern for string values.
+    """
+
+    def __init__(self, **criteria):
+        self.criteria = criteria
+        cheap = []
+        batched = []
+        other = []
+        for name, expected in criteria.items():
+            predicate = (name, _compile(expected))
+            if name in _cheapAttributes:
+                cheap.append(predicate)
+            elif name.startswith('AX'):
+                batched.append(predicate)
+            else:
+                other.append(predicate)
+        batched.sort(key=lambda p: _attributeCosts.get(p[0], 5))
+        # Read in one call unless there is a cheap check to reject with first
+        if cheap and batched:
+            self._stages = [cheap, batched]
+        else:
+            self._stages = [stage for stage in (cheap + batched,) if stage]
+        self._stageNames = [[name for name, _ in stage]
+                            for stage in self._stages]
+        self._other = other
+
+    @classmethod
+    def build(cls, query=None, criteria=None):
+        """Return query, refined with criteria, or a Query of criteria."""
+        if query is None:
+            return cls(**(criteria or {}))
+        if not isinstance(query, cls):
+            raise TypeError('Expected a Query, got %r' % (query, ))
+        if criteria:
+            return query.refine(**criteria)
+        return query
+
+    def refine(self, **criteria):
+        """Return a new Query matching these criteria as well."""
+        merged = dict(self.criteria)
+        merged.update(criteria)
+        return type(self)(**merged)
+
+    def matches(self, element):
+        """Return True if element meets all the criteria."""
+        for names, stage in zip(self._stageNames, self._stages):
+            try:
+                values = element._getMultipleAttributes(names)
+            except _a11y.Error:
+                return False
+            for name, predicate in stage:
+                val = values[name]
+                if isinstance(val, _a11y.Error) or not predicate(val):
+                    return False
+        for name, predicate in self._other:
+            try:
+                val = getattr(element, name)
+            except _a11y.Error:
+                return False
+            if not predicate(val):
+                return False
+        return True
+
+    def __repr__(self):
+        criteria = ', '.join('%s=%r' % item
+                             for item in sorted(self.criteria.items()))
+        return 'Query(%s)' % criteria
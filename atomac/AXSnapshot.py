@@ -0,0 +1,155 @@
+# Copyright (c) 2010 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Frozen copy of an accessibility subtree.
+
+A Snapshot reads a subtree once, with one batched attribute call per
+element, and answers lookups from memory afterwards:
+
+    snap = window.snapshot()
+    okButton = snap.findFirst(AXRole='AXButton', AXTitle='OK')
+    okButton.Press()
+
+The values are those at capture time; take a new snapshot once the UI
+changed. Elements returned by lookups are live and can be acted upon.
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+from . import _a11y
+from .AXQuery import Query
+
+
+class _SnapshotNode(object):
+    """Stands for a captured element when matching queries."""
+
+    __slots__ = ('snapshot', 'index')
+
+    def __init__(self, snapshot, index):
+        self.snapshot = snapshot
+        self.index = index
+
+    def _getMultipleAttributes(self, attrs):
+        return dict((attr, self.snapshot.values[attr][self.index])
+                    for attr in attrs)
+
+
+class Snapshot(object):
+    """Subtree captured in one traversal, stored column-wise.
+
+    Node 0 is the element the snapshot was taken of. For node i,
+    elements[i] is the live element, parents[i] the index of its parent
+    (-1 for the root), depths[i] its depth below the root and
+    values[attr][i] the value of attr, None if it could not be read.
+    """
+
+    defaultAttributes = ('AXRole', 'AXSubrole', 'AXRoleDescription',
+                         'AXTitle', 'AXValue', 'AXDescription',
+                         'AXIdentifier', 'AXPosition', 'AXSize')
+
+    def __init__(self, root, attributes=None, max_depth=None):
+        if attributes is None:
+            attributes = self.defaultAttributes
+        self.attributes = tuple(attr for attr in attributes
+                                if attr != 'AXChildren')
+        self.elements = []
+        self.parents = []
+        self.depths = []
+        self.values = dict((attr, []) for attr in self.attributes)
+        self._capture(root, max_depth)
+
+    def _capture(self, root, max_depth):
+        names = list(self.attributes) + ['AXChildren']
+        columns = [self.values[attr] for attr in self.attributes]
+        # Breadth-first, so that each level is stored contiguously
+        queue = deque([(root, -1, 0)])
+        while queue:
+            element, parent, depth = queue.popleft()
+            try:
+                values = element._getMultipleAttributes(names)
+            except _a11y.Error:
+                # Element gone since its parent was read
+                if parent != -1:
+                    continue
+                raise
+            index = len(self.elements)
+            self.elements.append(element)
+            self.parents.append(parent)
+            self.depths.append(depth)
+            for attr, column in zip(self.attributes, columns):
+                value = values[attr]
+                column.append(None if isinstance(value, _a11y.Error)
+                              else value)
+
+            if max_depth is not None and depth >= max_depth:
+                continue
+            children = values['AXChildren']
+            if isinstance(children, list):
+                queue.extend((child, index, depth + 1) for child in children)
+
+    def __len__(self):
+        return len(self.elements)
+
+    def children(self, index):
+        """Return the indices of the children of node index."""
+        # Captured breadth-first: parents is sorted and siblings adjacent
+        return list(range(bisect_left(self.parents, index),
+                          bisect_right(self.parents, index)))
+
+    def indexOf(self, element):
+        """Return the index of element, or -1 if it was not captured."""
+        for index, captured in enumerate(self.elements):
+            if captured == element:
+                return index
+        return -1
+
+    def frame(self, index):
+        """Return the Rect of node index, or None if it has no frame."""
+        position = self.values.get('AXPosition', {index: None})[index]
+        size = self.values.get('AXSize', {index: None})[index]
+        if position is None or size is None:
+            return None
+        return _a11y.Rect(position.x, position.y, size.width, size.height)
+
+    def _checkCaptured(self, query):
+        missing = set(query.criteria) - set(self.attributes)
+        if missing:
+            raise ValueError('Attributes not in the snapshot: %s' %
+                             ', '.join(sorted(missing)))
+
+    def findIndices(self, query=None, **kwargs):
+        """Return the indices of the nodes below the root matching the
+        criteria, given as for findAll.
+        """
+        query = Query.build(query, kwargs)
+        self._checkCaptured(query)
+        return [index for index in range(1, len(self.elements))
+                if query.matches(_SnapshotNode(self, index))]
+
+    def findAll(self, query=None, **kwargs):
+        """Return the live elements below the root matching the criteria."""
+        return [self.elements[index]
+                for index in self.findIndices(query, **kwargs)]
+
+    def findFirst(self, query=None, **kwargs):
+        """Return the first (shallowest) element matching the criteria."""
+        query = Query.build(query, kwargs)
+        self._checkCaptured(query)
+        for index in range(1, len(self.elements)):
+            if query.matches(_SnapshotNode(self, index)):
+                return self.elements[index]
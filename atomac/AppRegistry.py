@@ -0,0 +1,188 @@
+# Copyright (c) 2010 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Registry of the running applications.
+
+The list of running applications is read once, then kept current by the
+workspace launch and terminate notifications. Lookups by pid, bundle ID
+and localized name are dictionary lookups. Notifications are only
+delivered while the backend processes its pending events, which it does
+when reading the list, so a miss reloads the list once.
+"""
+
+import re
+import fnmatch
+import threading
+
+from . import _a11y
+
+
+_globCharacters = re.compile(r'[*?[]')
+
+
+class AppRegistry(object):
+    """Running applications indexed by pid, bundle ID and localized name.
+
+    Applications are NSRunningApplication objects, or their equivalent
+    from the backend in use.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._started = False
+        # pid -> app, in launch order
+        self._byPid = {}
+        self._order = []
+        # bundle ID / localized name -> apps with it, in launch order
+        self._byBundleId = {}
+        self._byName = {}
+
+    def _start(self):
+        # Return whether the list was read for the first time
+        with self._lock:
+            if self._started:
+                return False
+            self._started = True
+        # Watch first, so that nothing launched while reading is missed
+        self.backend.watchApplications(self._notified)
+        self.reload()
+        return True
+
+    def reload(self):
+        """Read the list of running applications again.
+
+        The backend processes its pending events first, so that the list
+        includes the applications launched since the last reload.
+        """
+        apps = self.backend.runningApplications()
+        with self._lock:
+            self._byPid = {}
+            self._order = []
+            self._byBundleId = {}
+            self._byName = {}
+            for app in apps:
+                if not app.isTerminated():
+                    self._add(app)
+
+    def _add(self, app):
+        pid = app.processIdentifier()
+        if pid in self._byPid:
+            self._remove(pid)
+        self._byPid[pid] = app
+        self._order.append(pid)
+        bundleId = app.bundleIdentifier()
+        if bundleId is not None:
+            self._byBundleId.setdefault(bundleId, []).append(app)
+        name = app.localizedName()
+        if name is not None:
+            self._byName.setdefault(name, []).append(app)
+
+    def _remove(self, pid):
+        app = self._byPid.pop(pid, None)
+        if app is None:
+            return
+        self._order.remove(pid)
+        for index, key in ((self._byBundleId, app.bundleIdentifier()),
+                           (self._byName, app.localizedName())):
+            apps = index.get(key)
+            if apps is None:
+                continue
+            apps[:] = [a for a in apps if a is not app]
+            if not apps:
+                del index[key]
+
+    def _notified(self, event, app):
+        with self._lock:
+            if event == 'terminated':
+                self._remove(app.processIdentifier())
+                return
+            if event == 'activated' and \
+                    app.processIdentifier() in self._byPid:
+                return
+            self._add(app)
+
+    def _lookup(self, find):
+        # find runs under the lock; on a miss, reload once and retry
+        self._start()
+        with self._lock:
+            found = find()
+        if found is None:
+            self.reload()
+            with self._lock:
+                found = find()
+        return found
+
+    def frontmost(self):
+        """Return the pid of the frontmost application, or None.
+
+        Asked to the backend on every call, activations are not followed
+        as they may not be delivered.
+        """
+        return self.backend.frontmostPid()
+
+    def apps(self):
+        """Return the running applications in launch order.
+
+        The list is read again, as launches and terminations may only be
+        notified while reading it.
+        """
+        if not self._start():
+            self.reload()
+        with self._lock:
+            return [self._byPid[pid] for pid in self._order]
+
+    def byPid(self, pid):
+        """Return the application with process ID pid, or None."""
+        return self._lookup(lambda: self._byPid.get(pid))
+
+    def byBundleId(self, bundleId):
+        """Return the first launched application with this bundle ID,
+        or None.
+        """
+        return self._lookup(
+            lambda: (self._byBundleId.get(bundleId) or [None])[0])
+
+    def byName(self, name):
+        """Return the first launched application with this localized name,
+        or None. Shell-like wildcards are allowed.
+        """
+        if not _globCharacters.search(name):
+            return self._lookup(
+                lambda: (self._byName.get(name) or [None])[0])
+
+        def scan():
+            for pid in self._order:
+                app = self._byPid[pid]
+                appName = app.localizedName()
+                if appName is not None and fnmatch.fnmatch(appName, name):
+                    return app
+        return self._lookup(scan)
+
+
+_registry = None
+_registryLock = threading.Lock()
+
+
+def getRegistry():
+    """Return the application registry of the accessibility backend in use."""
+    global _registry
+    backend = _a11y.getBackend()
+    with _registryLock:
+        if _registry is None or _registry.backend is not backend:
+            _registry = AppRegistry(backend)
+        return _registry
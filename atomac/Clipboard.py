@@ -204,4 +204,42 @@ class Clipboard(object):
             logging.exception(error)
             raise
 
-        return bool(its_empty)
\ No newline at end of file
+        return bool(its_empty)
+
+    @classmethod
+    def save(cls):
+        """Save the contents of the general pasteboard, every type of every
+        item, to restore them later.
+
+        Returns: Saved contents to pass to restore()
+        """
+        pb = AppKit.NSPasteboard.generalPasteboard()
+        saved = []
+        for item in pb.pasteboardItems() or []:
+            itemData = {}
+            for datatype in item.types():
+                data = item.dataForType_(datatype)
+                if data is not None:
+                    itemData[datatype] = data
+            saved.append(itemData)
+        logging.debug('Saved %d pasteboard items' % len(saved))
+        return saved
+
+    @classmethod
+    def restore(cls, saved):
+        """Put back the contents of the general pasteboard returned by save().
+
+        Parameters: saved contents
+        Returns: True / False on successful restore
+        """
+        cls.clearAll()
+        items = []
+        for itemData in saved:
+            item = AppKit.NSPasteboardItem.alloc().init()
+            for datatype, data in itemData.items():
+                item.setData_forType_(data, datatype)
+            items.append(item)
+        if not items:
+            return True
+        pb = AppKit.NSPasteboard.generalPasteboard()
+        return bool(pb.writeObjects_(items))
@@ -0,0 +1,542 @@
+# Copyright (c) 2010 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Pure Python accessibility backend working on an in-memory element tree.
+
+It needs neither a Mac nor PyObjC, which makes it possible to profile and
+load-test the traversal, matching and LDTP appmap code anywhere:
+
+    backend = FakeBackend(latency=0.0005)
+    app = backend.buildTree(fanout=10, depth=4)
+    atomac.setBackend(backend)
+    window = atomac.getAppRefByPid(app.pid).windows()[0]
+    window.findAllR(AXRole='AXButton')
+    print(backend.calls)
+
+Every call into the backend is counted in backend.calls (by method name),
+sleeps for the configured latency and may fail with an injected error.
+"""
+
+import time
+import random
+import threading
+from collections import Counter, deque
+
+from . import _a11y
+
+
+class FakeElement(object):
+    """An element of the in-memory accessibility tree.
+
+    attributes holds the raw attribute values; AXChildren, AXParent and
+    AXWindow refer to other FakeElement objects.  errors maps an attribute
+    name to the AX error code reading it should fail with, and error (if
+    set) makes every call on the element fail with that code.
+    """
+
+    def __init__(self, pid, role, attributes=None, actions=None):
+        self.pid = pid
+        self.attributes = {
+            'AXRole': role,
+            'AXRoleDescription': role[2:].lower(),
+            'AXChildren': [],
+            'AXEnabled': True,
+        }
+        if attributes:
+            self.attributes.update(attributes)
+        self.actions = list(actions or [])
+        self.settable = set(['AXValue', 'AXFocused'])
+        self.errors = {}
+        self.error = None
+
+    @property
+    def children(self):
+        return self.attributes['AXChildren']
+
+    @property
+    def parent(self):
+        return self.attributes.get('AXParent')
+
+    def __repr__(self):
+        return '<FakeElement %s %r>' % (self.attributes['AXRole'],
+                                        self.attributes.get('AXTitle'))
+
+
+class _AXErrorValue(object):
+    """Per-attribute error of copyMultipleAttributeValues."""
+
+    def __init__(self, code):
+        self.code = code
+
+
+class FakeRunningApplication(object):
+    """Stands for the NSRunningApplication of a fake application."""
+
+    def __init__(self, pid, localizedName, bundleIdentifier=None):
+        self.pid = pid
+        self.name = localizedName
+        self.bundleId = bundleIdentifier
+        self.terminated = False
+        # NSApplicationActivationPolicyRegular, set to 1 or 2 for agents
+        self.policy = 0
+
+    def processIdentifier(self):
+        return self.pid
+
+    def activationPolicy(self):
+        return self.policy
+
+    def localizedName(self):
+        return self.name
+
+    def bundleIdentifier(self):
+        return self.bundleId
+
+    def isTerminated(self):
+        return self.terminated
+
+    def __repr__(self):
+        return '<FakeRunningApplication %s %r>' % (self.pid, self.name)
+
+
+class FakeObserver(object):
+    def __init__(self, pid, callback):
+        self.pid = pid
+        self.callback = callback
+        # (element, notification) -> refcon
+        self.registrations = {}
+        # Notifications posted but not delivered yet
+        self.pending = deque()
+        self.scheduled = False
+
+
+class FakeBackend(_a11y.Backend):
+    """Accessibility backend serving a synthetic tree of FakeElements.
+
+    Parameters: latency - seconds every call sleeps for, to stand in for
+                          the IPC round-trip into the target application
+                errorRate - probability for any call to fail with errorCode
+                errorCode - AX error code of the random failures (defaults
+                            to kAXErrorCannotComplete)
+                seed - seed of the random generator behind errorRate
+    """
+
+    # Roles handed out to the leaves built by buildTree
+    leafRoles = ['AXButton', 'AXStaticText', 'AXTextField', 'AXCheckBox',
+                 'AXRadioButton', 'AXImage']
+
+    def __init__(self, latency=0.0, errorRate=0.0,
+                 errorCode=_a11y.kAXErrorCannotComplete, seed=None):
+        self.latency = latency
+        self.errorRate = errorRate
+        self.errorCode = errorCode
+        self.calls = Counter()
+        self.apps = {}
+        # pid -> FakeRunningApplication
+        self.runningApps = {}
+        self._appWatchers = []
+        self.frontmost = None
+        self.trusted = True
+        self.systemWide = FakeElement(0, 'AXSystemWide')
+        self._random = random.Random(seed)
+        self._observers = []
+        self._condition = threading.Condition()
+        self._serviceThread = None
+
+    # Building the tree
+
+    def addApplication(self, pid, title, bundleId=None):
+        """Add a running application and return its element."""
+        app = FakeElement(pid, 'AXApplication', {'AXTitle': title,
+                                                 'AXFrontmost': False},
+                          actions=['AXRaise'])
+        self.apps[pid] = app
+        self.runningApps[pid] = FakeRunningApplication(pid, title, bundleId)
+        self._applicationEvent('launched', pid)
+        if self.frontmost is None:
+            self.setFrontmost(pid)
+        return app
+
+    def removeApplication(self, pid):
+        """Terminate a running application."""
+        app = self.apps.pop(pid)
+        for element in self.walk(app):
+            element.error = _a11y.kAXErrorInvalidUIElement
+        if self.frontmost == pid:
+            self.frontmost = None
+        self.runningApps[pid].terminated = True
+        self._applicationEvent('terminated', pid)
+        del self.runningApps[pid]
+
+    def setFrontmost(self, pid):
+        if self.frontmost is not None:
+            self.apps[self.frontmost].attributes['AXFrontmost'] = False
+        self.frontmost = pid
+        self.apps[pid].attributes['AXFrontmost'] = True
+        self.systemWide.attributes['AXFocusedApplication'] = self.apps[pid]
+        self._applicationEvent('activated', pid)
+
+    def _applicationEvent(self, event, pid):
+        for callback in list(self._appWatchers):
+            callback(event, self.runningApps[pid])
+
+    def addElement(self, parent, role, attributes=None, actions=None,
+                   notify=True):
+        """Add a new element under parent and return it.
+
+        Posts AXCreated (and AXWindowCreated for windows) unless notify is
+        False.
+        """
+        element = FakeElement(parent.pid, role, attributes, actions)
+        element.attributes['AXParent'] = parent
+        if role == 'AXWindow':
+            element.attributes['AXWindow'] = element
+            element.actions.append('AXRaise')
+            app = self.apps.get(parent.pid)
+            if app is not None:
+                app.attributes.setdefault('AXWindows', []).append(element)
+                app.attributes.setdefault('AXFocusedWindow', element)
+                app.attributes.setdefault('AXMainWindow', element)
+        else:
+            element.attributes['AXWindow'] = parent.attributes.get('AXWindow')
+        parent.children.append(element)
+        if notify:
+            self.postNotification(element, 'AXCreated')
+            if role == 'AXWindow':
+                self.postNotification(element, 'AXWindowCreated')
+        return element
+
+    def removeElement(self, element, notify=True):
+        """Remove element (and its subtree) from the tree.
+
+        Posts AXUIElementDestroyed unless notify is False.
+        """
+        if notify:
+            self.postNotification(element, 'AXUIElementDestroyed')
+        parent = element.parent
+        if parent is not None and element in parent.children:
+            parent.children.remove(element)
+        app = self.apps.get(element.pid)
+        if app is not None and element in app.attributes.get('AXWindows', []):
+            app.attributes['AXWindows'].remove(element)
+        for e in self.walk(element):
+            e.error = _a11y.kAXErrorInvalidUIElement
+
+    def buildTree(self, fanout=5, depth=3, pid=None, title=None,
+                  windowTitle='Window'):
+        """Build an application with one window holding a synthetic subtree.
+
+        Every element down to depth has fanout children; the last level is
+        made of leaves with roles taken from leafRoles, the levels above are
+        AXGroups.  Titles are numbered so that they are unique.
+        Returns: the application element
+        """
+        if pid is None:
+            pid = max([1000] + list(self.apps.keys())) + 1
+        app = self.addApplication(pid, title or 'App%d' % pid)
+        window = self.addElement(app, 'AXWindow',
+                                 {'AXTitle': windowTitle,
+                                  'AXPosition': _a11y.Point(0.0, 0.0),
+                                  'AXSize': _a11y.Size(1024.0, 768.0)},
+                                 notify=False)
+        counter = [0]
+
+        def build(parent, level):
+            for i in range(fanout):
+                counter[0] += 1
+                if level == depth:
+                    role = self.leafRoles[counter[0] % len(self.leafRoles)]
+                else:
+                    role = 'AXGroup'
+                attributes = {
+                    'AXTitle': '%s %d' % (role[2:], counter[0]),
+                    'AXPosition': _a11y.Point(float(i * 10),
+                                              float(level * 10)),
+                    'AXSize': _a11y.Size(10.0, 10.0),
+                }
+                if role in ('AXTextField', 'AXStaticText', 'AXCheckBox'):
+                    attributes['AXValue'] = ''
+                child = self.addElement(parent, role, attributes,
+                                        actions=['AXPress'], notify=False)
+                if level < depth:
+                    build(child, level + 1)
+
+        if depth > 0:
+            build(window, 1)
+        return app
+
+    def walk(self, element):
+        """Yield element and all its descendants."""
+        stack = [element]
+        while stack:
+            e = stack.pop()
+            yield e
+            stack.extend(reversed(e.children))
+
+    # Notifications
+
+    def postNotification(self, element, notification):
+        """Queue notification for observers registered on element, one of
+        its ancestors or its application.
+        """
+        targets = set()
+        e = element
+        while e is not None:
+            targets.add(id(e))
+            e = e.parent
+        app = self.apps.get(element.pid)
+        if app is not None:
+            targets.add(id(app))
+        with self._condition:
+            for observer in self._observers:
+                if observer.pid != element.pid:
+                    continue
+                for (ref, name), refcon in list(observer.registrations.items()):
+                    if name == notification and id(ref) in targets:
+                        observer.pending.append((element, name, refcon))
+            self._condition.notify_all()
+
+    def _deliver(self, observer, item):
+        element, name, refcon = item
+        observer.callback(observer, element, name, refcon)
+
+    def createObserver(self, pid, callback):
+        self._call('createObserver')
+        observer = FakeObserver(pid, callback)
+        with self._condition:
+            self._observers.append(observer)
+        return _a11y.kAXErrorSuccess, observer
+
+    def addNotification(self, observer, ref, notification, refcon):
+        err = self._call('addNotification', ref)
+        if err:
+            return err
+        with self._condition:
+            if (ref, notification) in observer.registrations:
+                return _a11y.kAXErrorNotificationAlreadyRegistered
+            observer.registrations[(ref, notification)] = refcon
+        return _a11y.kAXErrorSuccess
+
+    def removeNotification(self, observer, ref, notification):
+        self._call('removeNotification')
+        with self._condition:
+            if observer.registrations.pop((ref, notification), None) is None:
+                return _a11y.kAXErrorNotificationNotRegistered
+            if not observer.registrations and not observer.scheduled:
+                self._observers.remove(observer)
+        return _a11y.kAXErrorSuccess
+
+    def scheduleObserver(self, observer):
+        with self._condition:
+            observer.scheduled = True
+            if observer not in self._observers:
+                self._observers.append(observer)
+            if self._serviceThread is None:
+                self._serviceThread = threading.Thread(
+                    target=self._serviceScheduledObservers,
+                    name='FakeBackend observer run loop')
+                self._serviceThread.daemon = True
+                self._serviceThread.start()
+            self._condition.notify_all()
+
+    def unscheduleObserver(self, observer):
+        with self._condition:
+            observer.scheduled = False
+            observer.pending.clear()
+            if observer in self._observers:
+                self._observers.remove(observer)
+
+    def _serviceScheduledObservers(self):
+        while True:
+            with self._condition:
+                ready = None
+                while ready is None:
+                    for observer in self._observers:
+                        if observer.scheduled and observer.pending:
+                            ready = observer
+                            break
+                    else:
+                        self._condition.wait()
+                item = ready.pending.popleft()
+            self._deliver(ready, item)
+
+    # Backend interface
+
+    def _call(self, name, ref=None, attr=None):
+        """Account for one call into the backend; return the AX error code
+        it should fail with, if any.
+        """
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.errorRate and self._random.random() < self.errorRate:
+            return self.errorCode
+        if ref is not None:
+            if ref.error is not None:
+                return ref.error
+            if attr is not None and attr in ref.errors:
+                return ref.errors[attr]
+        return _a11y.kAXErrorSuccess
+
+    def _attributeValue(self, ref, attr):
+        if attr in ref.errors:
+            return ref.errors[attr], None
+        if attr not in ref.attributes:
+            return _a11y.kAXErrorAttributeUnsupported, None
+        value = ref.attributes[attr]
+        if value is None:
+            return _a11y.kAXErrorNoValue, None
+        return _a11y.kAXErrorSuccess, value
+
+    def isProcessTrusted(self):
+        self._call('isProcessTrusted')
+        return self.trusted
+
+    def frontmostPid(self):
+        self._call('frontmostPid')
+        return self.frontmost
+
+    def createApplication(self, pid):
+        if pid not in self.apps:
+            # Like AXUIElementCreateApplication, any pid gives an element;
+            # it just doesn't answer
+            app = FakeElement(pid, 'AXApplication')
+            app.error = _a11y.kAXErrorCannotComplete
+            return app
+        return self.apps[pid]
+
+    def runningApplications(self):
+        self._call('runningApplications')
+        return list(self.runningApps.values())
+
+    def watchApplications(self, callback):
+        # Events are delivered synchronously by the methods changing the
+        # set of applications
+        self._appWatchers.append(callback)
+
+    def createSystemWide(self):
+        return self.systemWide
+
+    def copyAttributeNames(self, ref):
+        err = self._call('copyAttributeNames', ref)
+        if err:
+            return err, None
+        return err, sorted(ref.attributes.keys())
+
+    def copyAttributeValue(self, ref, attr):
+        err = self._call('copyAttributeValue', ref)
+        if err:
+            return err, None
+        return self._attributeValue(ref, attr)
+
+    def copyMultipleAttributeValues(self, ref, attrs):
+        err = self._call('copyMultipleAttributeValues', ref)
+        if err:
+            return err, None
+        values = []
+        for attr in attrs:
+            err, value = self._attributeValue(ref, attr)
+            if err:
+                value = _AXErrorValue(err)
+            values.append(value)
+        return _a11y.kAXErrorSuccess, values
+
+    def toPyObject(self, element, value):
+        if isinstance(value, FakeElement):
+            return element.with_ref(value)
+        if isinstance(value, list):
+            return [self.toPyObject(element, item) for item in value]
+        if isinstance(value, _AXErrorValue):
+            if value.code == _a11y.kAXErrorNoValue:
+                return
+            return _a11y._getError(value.code, 'Error retrieving attribute')
+        return value
+
+    def isAttributeSettable(self, ref, attr):
+        err = self._call('isAttributeSettable', ref)
+        if err:
+            return err, None
+        return err, attr in ref.settable
+
+    def setAttributeValue(self, ref, attr, value):
+        err = self._call('setAttributeValue', ref, attr)
+        if err:
+            return err
+        ref.attributes[attr] = value
+        if attr == 'AXValue':
+            self.postNotification(ref, 'AXValueChanged')
+        elif attr == 'AXTitle':
+            self.postNotification(ref, 'AXTitleChanged')
+        elif attr == 'AXPosition':
+            self.postNotification(ref, 'AXMoved')
+        elif attr == 'AXSize':
+            self.postNotification(ref, 'AXResized')
+        return _a11y.kAXErrorSuccess
+
+    def copyActionNames(self, ref):
+        err = self._call('copyActionNames', ref)
+        if err:
+            return err, None
+        return err, list(ref.actions)
+
+    def performAction(self, ref, action):
+        err = self._call('performAction', ref)
+        if err:
+            return err
+        if action not in ref.actions:
+            return _a11y.kAXErrorActionUnsupported
+        return _a11y.kAXErrorSuccess
+
+    def getPid(self, ref):
+        self._call('getPid')
+        return _a11y.kAXErrorSuccess, ref.pid
+
+    def setMessagingTimeout(self, ref, timeout):
+        self._call('setMessagingTimeout')
+        if timeout < 0:
+            return _a11y.kAXErrorIllegalArgument
+        return _a11y.kAXErrorSuccess
+
+    def copyElementAtPosition(self, ref, x, y):
+        err = self._call('copyElementAtPosition', ref)
+        if err:
+            return err, None
+        if ref is self.systemWide:
+            candidates = list(self.apps.values())
+        else:
+            candidates = ref.children
+        hit = None
+        while candidates:
+            # Descend into the first child containing the point
+            for e in candidates:
+                pos = e.attributes.get('AXPosition')
+                size = e.attributes.get('AXSize')
+                if pos is None or size is None:
+                    continue
+                if pos[0] <= x < pos[0] + size[0] and \
+                        pos[1] <= y < pos[1] + size[1]:
+                    hit = e
+                    candidates = e.children
+                    break
+            else:
+                break
+        if hit is None:
+            return _a11y.kAXErrorNoValue, None
+        return _a11y.kAXErrorSuccess, hit
+
+    def equal(self, ref, other):
+        return ref is other
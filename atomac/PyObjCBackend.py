@@ -0,0 +1,295 @@
+"""
+Accessibility backend calling the AX C functions through PyObjC
+"""
+
+import threading
+import Cocoa
+from CoreFoundation import *
+from ApplicationServices import *
+
+from . import _a11y
+
+
+def _decodePoint(attrValue):
+    success, point = AXValueGetValue(attrValue, kAXValueCGPointType, None)
+    if not success:
+        raise _a11y.ErrorUnsupported('Error converting CGPoint value')
+    return _a11y.Point(point.x, point.y)
+
+
+def _decodeSize(attrValue):
+    success, size = AXValueGetValue(attrValue, kAXValueCGSizeType, None)
+    if not success:
+        raise _a11y.ErrorUnsupported('Error converting CGSize value')
+    return _a11y.Size(size.width, size.height)
+
+
+def _decodeRange(attrValue):
+    success, cfrange = AXValueGetValue(attrValue, kAXValueCFRangeType, None)
+    if not success:
+        raise _a11y.ErrorUnsupported('Error converting CFRange value')
+    return _a11y.Range(cfrange.location, cfrange.length)
+
+
+def _decodeRect(attrValue):
+    success, rect = AXValueGetValue(attrValue, kAXValueCGRectType, None)
+    if not success:
+        raise _a11y.ErrorUnsupported('Error converting CGRect value')
+    return _a11y.Rect(rect.origin.x, rect.origin.y,
+                      rect.size.width, rect.size.height)
+
+
+def _decodeError(attrValue):
+    # Per-attribute error returned by AXUIElementCopyMultipleAttributeValues
+    success, error_code = AXValueGetValue(attrValue, kAXValueAXErrorType, None)
+    if error_code == kAXErrorNoValue:
+        return
+    return _a11y._getError(error_code, 'Error retrieving attribute')
+
+
+# AXValue type -> decoder extracting the struct straight out of the AXValue
+_axValueDecoders = {
+    kAXValueCGPointType: _decodePoint,
+    kAXValueCGSizeType: _decodeSize,
+    kAXValueCFRangeType: _decodeRange,
+    kAXValueCGRectType: _decodeRect,
+    kAXValueAXErrorType: _decodeError,
+}
+
+
+def _convertString(element, stringValue):
+    return str(stringValue)
+
+
+def _convertBoolean(element, booleanValue):
+    return bool(booleanValue)
+
+
+def _convertNumber(element, numberValue):
+    success, int_value = CFNumberGetValue(numberValue, kCFNumberIntType, None)
+    if success:
+        return int(int_value)
+
+    success, float_value = CFNumberGetValue(numberValue, kCFNumberDoubleType, None)
+    if success:
+        return float(float_value)
+
+    raise _a11y.ErrorUnsupported('Error converting numeric attribute: {}'.format(numberValue))
+
+
+def _convertElement(element, elementValue):
+    return element.with_ref(elementValue)
+
+
+def _convertArray(element, arrayValue):
+    # Arrays such as AXChildren or AXRows may hold thousands of items, almost
+    # always element references: fill a list allocated once, wrapping the
+    # references directly and dispatching only the other kinds of items
+    count = len(arrayValue)
+    converted = [None] * count
+    with_ref = element.with_ref
+    for index in range(count):
+        item = arrayValue[index]
+        typeID = CFGetTypeID(item)
+        if typeID == _kAXUIElementTypeID:
+            converted[index] = with_ref(item)
+        else:
+            converted[index] = _cfConverters.get(typeID, _convertAXValue)(element, item)
+    return converted
+
+
+def _convertAXValue(element, attrValue):
+    ax_attr_type = AXValueGetType(attrValue)
+    try:
+        decoder = _axValueDecoders[ax_attr_type]
+    except KeyError:
+        raise _a11y.ErrorUnsupported('Return value not supported yet: {}'.format(ax_attr_type))
+    return decoder(attrValue)
+
+
+_kAXUIElementTypeID = AXUIElementGetTypeID()
+
+# CF type ID -> converter; anything else is expected to be an AXValue
+_cfConverters = {
+    CFStringGetTypeID(): _convertString,
+    CFBooleanGetTypeID(): _convertBoolean,
+    CFArrayGetTypeID(): _convertArray,
+    CFNumberGetTypeID(): _convertNumber,
+    _kAXUIElementTypeID: _convertElement,
+}
+
+
+def _toPyObject(element, attrValue):
+    converter = _cfConverters.get(CFGetTypeID(attrValue), _convertAXValue)
+    return converter(element, attrValue)
+
+
+class _WorkspaceObserver(Cocoa.NSObject):
+    """
+    Forwards NSWorkspace application notifications to a Python callback
+    """
+    def initWithCallback_(self, callback):
+        self = super(_WorkspaceObserver, self).init()
+        if self is None:
+            return None
+        self.callback = callback
+        return self
+
+    def _forward(self, event, notification):
+        app = notification.userInfo()[Cocoa.NSWorkspaceApplicationKey]
+        self.callback(event, app)
+
+    def applicationLaunched_(self, notification):
+        self._forward('launched', notification)
+
+    def applicationTerminated_(self, notification):
+        self._forward('terminated', notification)
+
+    def applicationActivated_(self, notification):
+        self._forward('activated', notification)
+
+
+# NSWorkspace notification -> _WorkspaceObserver selector
+_workspaceNotifications = {
+    Cocoa.NSWorkspaceDidLaunchApplicationNotification: 'applicationLaunched:',
+    Cocoa.NSWorkspaceDidTerminateApplicationNotification: 'applicationTerminated:',
+    Cocoa.NSWorkspaceDidActivateApplicationNotification: 'applicationActivated:',
+}
+
+
+class PyObjCBackend(_a11y.Backend):
+    """
+    Default backend, talking to the real accessibility API
+    """
+    def __init__(self):
+        super(PyObjCBackend, self).__init__()
+        self._runLoop = None
+        self._runLoopLock = threading.Lock()
+        self._workspaceObservers = []
+
+    def isProcessTrusted(self):
+        return AXIsProcessTrusted()
+
+    def frontmostPid(self):
+        # Asked to the accessibility API every time: NSWorkspace only
+        # updates frontmostApplication from the main run loop
+        err, app = AXUIElementCopyAttributeValue(AXUIElementCreateSystemWide(),
+                                                 'AXFocusedApplication', None)
+        if err != kAXErrorSuccess or app is None:
+            return None
+        err, pid = AXUIElementGetPid(app, None)
+        if err != kAXErrorSuccess:
+            return None
+        return pid
+
+    def runningApplications(self):
+        # NSWorkspace updates the list, and posts its notifications, from
+        # the main thread's run loop; let it process what is pending
+        CFRunLoopRunInMode(kCFRunLoopDefaultMode, 0, False)
+        return list(Cocoa.NSWorkspace.sharedWorkspace().runningApplications())
+
+    def watchApplications(self, callback):
+        observer = _WorkspaceObserver.alloc().initWithCallback_(callback)
+        # Keep the observer alive, the notification center does not retain it
+        self._workspaceObservers.append(observer)
+
+        # Notifications are posted, and delivered, on the main thread
+        # whenever its run loop runs, e.g. in runningApplications()
+        center = Cocoa.NSWorkspace.sharedWorkspace().notificationCenter()
+        for name, selector in _workspaceNotifications.items():
+            center.addObserver_selector_name_object_(observer, selector,
+                                                     name, None)
+
+    def createApplication(self, pid):
+        return AXUIElementCreateApplication(pid)
+
+    def createSystemWide(self):
+        return AXUIElementCreateSystemWide()
+
+    def copyAttributeNames(self, ref):
+        return AXUIElementCopyAttributeNames(ref, None)
+
+    def copyAttributeValue(self, ref, attr):
+        return AXUIElementCopyAttributeValue(ref, attr, None)
+
+    def copyMultipleAttributeValues(self, ref, attrs):
+        return AXUIElementCopyMultipleAttributeValues(ref, attrs, 0, None)
+
+    def toPyObject(self, element, attrValue):
+        return _toPyObject(element, attrValue)
+
+    def isAttributeSettable(self, ref, attr):
+        return AXUIElementIsAttributeSettable(ref, attr, None)
+
+    def setAttributeValue(self, ref, attr, value):
+        return AXUIElementSetAttributeValue(ref, attr, value)
+
+    def copyActionNames(self, ref):
+        return AXUIElementCopyActionNames(ref, None)
+
+    def performAction(self, ref, action):
+        return AXUIElementPerformAction(ref, action)
+
+    def getPid(self, ref):
+        return AXUIElementGetPid(ref, None)
+
+    def setMessagingTimeout(self, ref, timeout):
+        return AXUIElementSetMessagingTimeout(ref, timeout)
+
+    def copyElementAtPosition(self, ref, x, y):
+        return AXUIElementCopyElementAtPosition(ref, x, y, None)
+
+    def equal(self, ref, other):
+        return CFEqual(ref, other)
+
+    def createObserver(self, pid, callback):
+        return AXObserverCreate(pid, callback, None)
+
+    def addNotification(self, observer, ref, notification, refcon):
+        return AXObserverAddNotification(observer, ref, notification, refcon)
+
+    def removeNotification(self, observer, ref, notification):
+        return AXObserverRemoveNotification(observer, ref, notification)
+
+    def _backgroundRunLoop(self):
+        """
+        Return the run loop of the observer thread, starting it on first use
+        """
+        with self._runLoopLock:
+            if self._runLoop is None:
+                ready = threading.Event()
+
+                def run():
+                    self._runLoop = CFRunLoopGetCurrent()
+                    # A run loop without any source returns at once, so keep
+                    # a timer which never fires in it
+                    timer = CFRunLoopTimerCreate(
+                        None, CFAbsoluteTimeGetCurrent() + 1e10, 1e10, 0, 0,
+                        lambda timer, info: None, None
+                    )
+                    CFRunLoopAddTimer(self._runLoop, timer, kCFRunLoopDefaultMode)
+                    ready.set()
+                    CFRunLoopRun()
+
+                thread = threading.Thread(target=run,
+                                          name='atomac observer run loop')
+                thread.daemon = True
+                thread.start()
+                ready.wait()
+        return self._runLoop
+
+    def scheduleObserver(self, observer):
+        runLoop = self._backgroundRunLoop()
+        CFRunLoopAddSource(
+            runLoop,
+            AXObserverGetRunLoopSource(observer),
+            kCFRunLoopDefaultMode
+        )
+        CFRunLoopWakeUp(runLoop)
+
+    def unscheduleObserver(self, observer):
+        CFRunLoopRemoveSource(
+            self._backgroundRunLoop(),
+            AXObserverGetRunLoopSource(observer),
+            kCFRunLoopDefaultMode
+        )
@@ -20,10 +20,19 @@ from future import standard_library
 standard_library.install_aliases()
 
 from . import _a11y
+from . import AXEventTiming
+from . import AXDrag
 from .AXClasses import NativeUIElement
-from .Clipboard import Clipboard
-from .Prefs import Prefs
+from .AXCache import AttributeCache, cached
+from .AXQuery import Query
+from .AXSnapshot import Snapshot
 from .version import __version__
+try:
+    from .Clipboard import Clipboard
+    from .Prefs import Prefs
+except ImportError:
+    # PyObjC is not available, e.g. when running against FakeBackend
+    Clipboard = Prefs = None
 
 # Exceptions
 Error = _a11y.Error
@@ -33,6 +42,12 @@ ErrorCannotComplete = _a11y.ErrorCannotComplete
 ErrorUnsupported = _a11y.ErrorUnsupported
 ErrorNotImplemented = _a11y.ErrorNotImplemented
 
+# Decoded AXPosition / AXSize / range / rect values
+Point = _a11y.Point
+Size = _a11y.Size
+Range = _a11y.Range
+Rect = _a11y.Rect
+
 Prefs = Prefs
 __version__ = __version__
 Clipboard = Clipboard
@@ -44,4 +59,27 @@ setSystemWideTimeout = NativeUIElement.setSystemWideTimeout
 getAppRefByBundleId = NativeUIElement.getAppRefByBundleId
 launchAppByBundleId = NativeUIElement.launchAppByBundleId
 getFrontmostApp = NativeUIElement.getFrontmostApp
+getFrontmostWindow = NativeUIElement.getFrontmostWindow
 getAppRefByPid = NativeUIElement.getAppRefByPid
+
+# Accessibility backend
+setBackend = _a11y.setBackend
+getBackend = _a11y.getBackend
+
+# Attribute value caching
+AttributeCache = AttributeCache
+cached = cached
+
+# Compiled search criteria
+Query = Query
+Snapshot = Snapshot
+
+# Timing of posted keyboard and mouse events
+setEventTiming = AXEventTiming.setEventTiming
+getEventTiming = AXEventTiming.getEventTiming
+NoDelay = AXEventTiming.NoDelay
+FixedDelay = AXEventTiming.FixedDelay
+WaitForValueChange = AXEventTiming.WaitForValueChange
+
+# Recording the events of mouse drags (see NativeUIElement.dragMouse)
+DragRecorder = AXDrag.DragRecorder
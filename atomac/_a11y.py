@@ -1,66 +1,38 @@
-import objc
-import re
-import signal
-import Cocoa
-from CoreFoundation import *
-from ApplicationServices import *
-from PyObjCTools import AppHelper, MachSignals
-
 """
 Library of Apple A11y functions
-"""
-def _CFAttributeToPyObject(self, attrValue):
-    def list_helper(list_value):
-        list_builder = []
-        for item in list_value:
-            list_builder.append(_CFAttributeToPyObject(self, item))
-        return list_builder
-
-    def number_helper(number_value):
-        success, int_value = CFNumberGetValue(number_value, kCFNumberIntType, None)
-        if success:
-            return int(int_value)
-
-        success, float_value = CFNumberGetValue(number_value, kCFNumberDoubleType, None)
-        if success:
-            return float(float_value)
-
-        raise ErrorUnsupported('Error converting numeric attribute: {}'.format(number_value))
-
-    def axuielement_helper(element_value):
-        return self.with_ref(element_value)
-
-    cf_attr_type = CFGetTypeID(attrValue)
-    cf_type_mapping = {
-        CFStringGetTypeID(): str,
-        CFBooleanGetTypeID(): bool,
-        CFArrayGetTypeID(): list_helper,
-        CFNumberGetTypeID(): number_helper,
-        AXUIElementGetTypeID(): axuielement_helper,
-    }
-    try:
-        return cf_type_mapping[cf_attr_type](attrValue)
-    except KeyError:
-        # did not get a supported CF type. Move on to AX type
-        pass
-
-    ax_attr_type = AXValueGetType(attrValue)
-    ax_type_map = {
-        kAXValueCGSizeType: NSSizeFromString,
-        kAXValueCGPointType: NSPointFromString,
-        kAXValueCFRangeType: NSRangeFromString,
-    }
-    try:
-        extracted_str = re.search('{.*}', attrValue.description()).group()
-        return tuple(ax_type_map[ax_attr_type](extracted_str))
-    except KeyError:
-        raise ErrorUnsupported('Return value not supported yet: {}'.format(ax_attr_type))
 
-def _sigHandler(sig):
-    AppHelper.stopEventLoop()
-    raise KeyboardInterrupt('Keyboard interrupted Run Loop')
+The AX C functions are reached through a backend object (see Backend below)
+so that the element, search and LDTP code can also run against an in-memory
+accessibility tree. The PyObjC backend is used unless another one is set.
+"""
 
-def _setError(error_code, error_message):
+import time
+import threading
+from collections import namedtuple
+
+# AXError codes, as defined in AXError.h
+kAXErrorSuccess = 0
+kAXErrorFailure = -25200
+kAXErrorIllegalArgument = -25201
+kAXErrorInvalidUIElement = -25202
+kAXErrorInvalidUIElementObserver = -25203
+kAXErrorCannotComplete = -25204
+kAXErrorAttributeUnsupported = -25205
+kAXErrorActionUnsupported = -25206
+kAXErrorNotificationUnsupported = -25207
+kAXErrorNotImplemented = -25208
+kAXErrorNotificationAlreadyRegistered = -25209
+kAXErrorNotificationNotRegistered = -25210
+kAXErrorAPIDisabled = -25211
+kAXErrorNoValue = -25212
+kAXErrorParameterizedAttributeUnsupported = -25213
+kAXErrorNotEnoughPrecision = -25214
+
+
+def _getError(error_code, error_message):
+    """
+    Build the exception matching the given AX error code without raising it
+    """
     error_mapping = {
         kAXErrorAttributeUnsupported: ErrorUnsupported, # -25205
         kAXErrorActionUnsupported: ErrorUnsupported, # -25206
@@ -72,7 +44,10 @@ def _setError(error_code, error_message):
     }
     msg = '{} (AX Error {})'.format(error_message, error_code)
 
-    raise error_mapping[error_code](msg)
+    return error_mapping.get(error_code, Error)(msg)
+
+def _setError(error_code, error_message):
+    raise _getError(error_code, error_message)
 
 class Error(Exception):
     pass
@@ -92,6 +67,161 @@ class ErrorUnsupported(Error):
 class ErrorNotImplemented(Error):
     pass
 
+# Decoded AXValue structs
+Point = namedtuple('Point', ['x', 'y'])
+Size = namedtuple('Size', ['width', 'height'])
+Range = namedtuple('Range', ['location', 'length'])
+Rect = namedtuple('Rect', ['x', 'y', 'width', 'height'])
+
+class Backend(object):
+    """
+    Interface between AXUIElement and the accessibility API
+
+    Methods mirror the AX C function of the same name and report failures
+    the same way, as AX error codes: functions which copy something out
+    return an (error code, value) tuple. Element references are opaque to
+    AXUIElement and only ever handed back to the backend.
+    """
+    def isProcessTrusted(self):
+        raise NotImplementedError
+
+    def frontmostPid(self):
+        """
+        :return: pid of the frontmost application, read anew on every
+                 call, or None
+        """
+        raise NotImplementedError
+
+    def createApplication(self, pid):
+        """
+        :return: element reference for the application, or None
+        """
+        raise NotImplementedError
+
+    def runningApplications(self):
+        """
+        Return the running applications, as objects with the
+        processIdentifier(), bundleIdentifier(), localizedName() and
+        isTerminated() methods of NSRunningApplication
+        """
+        raise NotImplementedError
+
+    def watchApplications(self, callback):
+        """
+        Call callback(event, app) whenever an application is 'launched',
+        'terminated' or 'activated'; callbacks may only come while
+        runningApplications() is called
+        """
+        raise NotImplementedError
+
+    def createSystemWide(self):
+        """
+        :return: element reference for the system-wide object, or None
+        """
+        raise NotImplementedError
+
+    def copyAttributeNames(self, ref):
+        raise NotImplementedError
+
+    def copyAttributeValue(self, ref, attr):
+        """
+        :return: (error code, raw value); pass the value to toPyObject
+        """
+        raise NotImplementedError
+
+    def copyMultipleAttributeValues(self, ref, attrs):
+        """
+        :return: (error code, list of raw values in the order of attrs);
+                 values of attributes which could not be read convert to
+                 an Error instance (None for kAXErrorNoValue)
+        """
+        raise NotImplementedError
+
+    def toPyObject(self, element, value):
+        """
+        Convert a raw attribute value to a Python object; element
+        references are wrapped with element.with_ref
+        """
+        raise NotImplementedError
+
+    def isAttributeSettable(self, ref, attr):
+        raise NotImplementedError
+
+    def setAttributeValue(self, ref, attr, value):
+        raise NotImplementedError
+
+    def copyActionNames(self, ref):
+        raise NotImplementedError
+
+    def performAction(self, ref, action):
+        raise NotImplementedError
+
+    def getPid(self, ref):
+        raise NotImplementedError
+
+    def setMessagingTimeout(self, ref, timeout):
+        raise NotImplementedError
+
+    def copyElementAtPosition(self, ref, x, y):
+        raise NotImplementedError
+
+    def equal(self, ref, other):
+        raise NotImplementedError
+
+    def createObserver(self, pid, callback):
+        """
+        callback is called as callback(observer, element ref, notification,
+        refcon) for each notification delivered while the observer loop runs
+        :return: (error code, observer)
+        """
+        raise NotImplementedError
+
+    def addNotification(self, observer, ref, notification, refcon):
+        raise NotImplementedError
+
+    def removeNotification(self, observer, ref, notification):
+        raise NotImplementedError
+
+    def scheduleObserver(self, observer):
+        """
+        Deliver notifications to observer from now on, from a background
+        run loop thread shared by all scheduled observers
+        """
+        raise NotImplementedError
+
+    def unscheduleObserver(self, observer):
+        raise NotImplementedError
+
+_backend = None
+
+# Holds the AttributeCache consulted by the attribute reads of each thread,
+# see AXCache.cached()
+_cacheState = threading.local()
+
+
+def _attributeCache():
+    return getattr(_cacheState, 'cache', None)
+
+
+def getBackend():
+    """
+    Return the accessibility backend in use, loading the PyObjC one if no
+    other backend was set.
+    """
+    global _backend
+    if _backend is None:
+        from .PyObjCBackend import PyObjCBackend
+        _backend = PyObjCBackend()
+    return _backend
+
+def setBackend(backend):
+    """
+    Use the given Backend instance for all accessibility calls.
+    Pass None to go back to the default PyObjC backend.
+    """
+    global _backend
+    _backend = backend
+
 class AXUIElement(object):
     """
     Apple AXUIElement object
@@ -112,8 +242,8 @@ class AXUIElement(object):
         self.observerRes = observer_res
 
     def _setNotification(self, timeout=0, notificationStr=None, callbackFn=None, callbackArgs=None, callbackKwargs=None):
-        if callable(callbackFn):
-            self.callbackFn = callbackFn
+        # Nothing carries over from a previous wait on this element
+        self.callbackFn = callbackFn if callable(callbackFn) else None
 
         if isinstance(callbackArgs, tuple):
             self.callbackArgs = callbackArgs
@@ -122,53 +252,58 @@ class AXUIElement(object):
 
         if isinstance(callbackKwargs, dict):
             self.callbackKwargs = callbackKwargs
+        else:
+            self.callbackKwargs = {}
 
         self.observerRes = None
 
-        pid = self._getPid()
-        err, observer = AXObserverCreate(pid, observerCallback, None)
-        if err != kAXErrorSuccess:
-            _setError(err, 'Could not create observer for notification')
-
-        err = AXObserverAddNotification(
-            observer, self.ref,
-            notificationStr,
-            self
+        index, retElem, self.observerRes = self._waitForNotifications(
+            timeout,
+            [(self, notificationStr, self.callbackFn, self.callbackArgs,
+              self.callbackKwargs)]
         )
-
-        if err != kAXErrorSuccess:
-            _setError(err, 'Could not add notification to observer')
-
-        #Add observer source to run loop
-        CFRunLoopAddSource(
-            CFRunLoopGetCurrent(),
-            AXObserverGetRunLoopSource(observer),
-            kCFRunLoopDefaultMode
-        )
-
-        # Set the signal handlers prior to running the run loop
-        oldSigIntHandler = MachSignals.signal(signal.SIGINT, _sigHandler)
-        # If an error occurs (return value is SIG_ERR), continue as it's not fatal
-        AppHelper.runConsoleEventLoop(
-            mode=kCFRunLoopDefaultMode,
-            installInterrupt=False,
-            maxTimeout=timeout,
-        )
-        MachSignals.signal(signal.SIGINT, oldSigIntHandler)
-        err = AXObserverRemoveNotification(observer, self.ref, notificationStr)
-        if err != kAXErrorSuccess:
-            _setError(err, 'Could not remove notification from observer')
-
         return self.observerRes
-        # if timeout
-        # return False
+
+    def _waitForNotifications(self, timeout, watches):
+        """
+        Wait for the first of several notifications accepted by its callback
+        :param timeout: seconds to wait for
+        :param watches: list of (element, notification, callbackFn,
+                        callbackArgs, callbackKwargs); a None callbackFn
+                        accepts any notification
+        :return: (index of the watch, element notified, callback result) or
+                 (None, None, last callback result) after timeout
+        """
+        # Observers live in the hub and stay registered while anyone waits
+        # on the notification, so waiting only costs a subscription; all the
+        # watches are fed to a single queue
+        from .AXObserverHub import getHub
+        deadline = time.time() + (timeout or 0)
+        result = None
+        with getHub().listen() as subscription:
+            for index, watch in enumerate(watches):
+                subscription.add(watch[0].ref, watch[1], index)
+            while True:
+                event = subscription.get(max(deadline - time.time(), 0))
+                if event is None:
+                    return None, None, result
+                elementRef, notification, index = event
+                element, notification, callbackFn, callbackArgs, \
+                    callbackKwargs = watches[index]
+                retElem = self.with_ref(elementRef)
+                if callbackFn is None:
+                    return index, retElem, True
+                result = callbackFn(*_callbackArgs(retElem, callbackArgs),
+                                    **(callbackKwargs or {}))
+                if result:
+                    return index, retElem, result
 
     def _getAttributes(self):
         """
         Get a list of the actions available on the AXUIElement
         :return:
         """
-        err, attr = AXUIElementCopyAttributeNames(self.ref, None)
+        err, attr = getBackend().copyAttributeNames(self.ref)
 
         if err != kAXErrorSuccess:
             _setError(err, 'Error retrieving attribute list')
@@ -183,7 +318,7 @@ class AXUIElement(object):
         if self.ref is None:
             raise Error('Not a valid accessibility object')
 
-        err, actions = AXUIElementCopyActionNames(self.ref, None)
+        err, actions = getBackend().copyActionNames(self.ref)
         if err != kAXErrorSuccess:
             _setError(err, 'Error retrieving action names')
         else:
@@ -195,7 +330,11 @@ class AXUIElement(object):
         :param action:
         :return:
         """
-        err = AXUIElementPerformAction(self.ref, action)
+        err = getBackend().performAction(self.ref, action)
+        cache = _attributeCache()
+        if cache is not None:
+            # There is no telling what an action changes
+            cache.clear()
 
         if err != kAXErrorSuccess:
             _setError(err, 'Error performing requested action')
@@ -206,17 +345,69 @@ class AXUIElement(object):
         :param args:
         :return:
         """
-        err, attrValue = AXUIElementCopyAttributeValue(self.ref, attr, None)
+        cache = _attributeCache()
+        if cache is not None:
+            found = cache.get(self.ref, (attr,))
+            if attr in found:
+                return found[attr]
+
+        backend = getBackend()
+        err, attrValue = backend.copyAttributeValue(self.ref, attr)
         if err == kAXErrorNoValue:
-            return
-
-        if err != kAXErrorSuccess:
+            value = None
+        elif err != kAXErrorSuccess:
             if err == kAXErrorNotImplemented:
                 _setError(err, 'Attribute not implemented')
             else:
                 _setError(err, 'Error retrieving attribute')
+        else:
+            value = backend.toPyObject(self, attrValue)
+
+        if cache is not None:
+            cache.put(self.ref, {attr: value}, self._cachePid)
+        return value
+
+    def _cachePid(self):
+        err, pid = getBackend().getPid(self.ref)
+        if err != kAXErrorSuccess:
+            return None
+        return pid
+
+    def _getMultipleAttributes(self, attrs):
+        """
+        Get the values of several attributes with a single call
+        :param attrs: list of attribute names
+        :return: dict mapping each attribute name to its value; attributes
+                 which could not be read map to an Error instance instead
+        """
+        attrs = list(attrs)
+        if not attrs:
+            return {}
+
+        cache = _attributeCache()
+        values = {}
+        if cache is not None:
+            values = cache.get(self.ref, attrs)
+            attrs = [attr for attr in attrs if attr not in values]
+            if not attrs:
+                return values
+
+        backend = getBackend()
+        err, attrValues = backend.copyMultipleAttributeValues(self.ref, attrs)
+        if err != kAXErrorSuccess:
+            _setError(err, 'Error retrieving attributes')
+
+        fetched = {}
+        for attr, attrValue in zip(attrs, attrValues):
+            fetched[attr] = backend.toPyObject(self, attrValue)
 
-        return _CFAttributeToPyObject(self, attrValue)
+        if cache is not None:
+            cache.put(self.ref, dict(
+                (attr, value) for attr, value in fetched.items()
+                if not isinstance(value, Error)
+            ), self._cachePid)
+        values.update(fetched)
+        return values
 
     def _setAttribute(self, attr, val):
         """
@@ -224,19 +415,23 @@ class AXUIElement(object):
         :param args:
         :return:
         """
+        backend = getBackend()
         self._getAttribute(attr)
-        err, to_set = AXUIElementCopyAttributeValue(self.ref, attr, None)
+        err, to_set = backend.copyAttributeValue(self.ref, attr)
         if err != kAXErrorSuccess:
             _setError(err, 'Error retrieving attribute to set')
 
-        err, settable = AXUIElementIsAttributeSettable(self.ref, attr, None)
+        err, settable = backend.isAttributeSettable(self.ref, attr)
         if err != kAXErrorSuccess:
             _setError(err, 'Error querying attribute')
 
         if not settable:
             raise ErrorUnsupported('Attribute is not settable')
 
-        err = AXUIElementSetAttributeValue(self.ref, attr, val)
+        err = backend.setAttributeValue(self.ref, attr, val)
+        cache = _attributeCache()
+        if cache is not None:
+            cache.invalidate(self.ref, (attr,))
         if err != kAXErrorSuccess:
             if err == kAXErrorIllegalArgument:
                 _setError(err, 'Invalid value for element attribute')
@@ -246,7 +441,10 @@ class AXUIElement(object):
     #     pass
 
     def _setString(self, attribute, value):
-        err = AXUIElementSetAttributeValue(self.ref, attribute, str(value))
+        err = getBackend().setAttributeValue(self.ref, attribute, str(value))
+        cache = _attributeCache()
+        if cache is not None:
+            cache.invalidate(self.ref, (attribute,))
         if err != kAXErrorSuccess:
             _setError(err, 'Error setting attribute to string')
 
@@ -254,7 +452,7 @@ class AXUIElement(object):
         """
         Get the PID of the AXUIElement
         """
-        error_code, pid = AXUIElementGetPid(self.ref, None)
+        error_code, pid = getBackend().getPid(self.ref)
         if error_code != kAXErrorSuccess:
             _setError(error_code, 'Error retrieving PID')
         return pid
@@ -263,7 +461,7 @@ class AXUIElement(object):
         if self.ref is None:
             raise ErrorUnsupported('Operation not supported on null element references')
 
-        err = AXUIElementSetMessagingTimeout(self.ref, newTimeout)
+        err = getBackend().setMessagingTimeout(self.ref, newTimeout)
         if err == kAXErrorIllegalArgument:
             raise ValueError('Accessibility timeout values must be non-negative')
         if err == kAXErrorInvalidUIElement:
@@ -273,7 +471,7 @@ class AXUIElement(object):
         if self.ref is None:
             raise ErrorUnsupported('Operation not supported on null element references')
 
-        err, res = AXUIElementCopyElementAtPosition(self.ref, x, y, None)
+        err, res = getBackend().copyElementAtPosition(self.ref, x, y)
         if err == kAXErrorIllegalArgument:
             raise ValueError('Arguments must be two floats.')
 
@@ -301,7 +499,7 @@ class AXUIElement(object):
         if self.ref is None or other.ref is None:
             return False
 
-        return CFEqual(self.ref, other.ref)
+        return getBackend().equal(self.ref, other.ref)
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -315,7 +513,7 @@ def axenabled():
     Return the status of accessibility on the system.
     :return: bool
     """
-    return AXIsProcessTrusted()
+    return getBackend().isProcessTrusted()
 
 
 def getfrontmostpid():
@@ -323,16 +521,14 @@ def getfrontmostpid():
     Return the PID of the application in the foreground.
     :return: int
     """
-    frontmost_app = NSWorkspace.sharedWorkspace().frontmostApplication()
-    pid = frontmost_app.processIdentifier()
-    return pid
+    return getBackend().frontmostPid()
 
 
 def getAppRefByPid(cls, pid):
     """
         Get an AXUIElement reference to the application specified by the given PID.
     """
-    app_ref = AXUIElementCreateApplication(pid)
+    app_ref = getBackend().createApplication(pid)
 
     if app_ref is None:
         raise ErrorUnsupported('Error getting app ref')
@@ -344,7 +540,7 @@ def getSystemObject(cls):
     """
         Get an AXUIElement reference for the system accessibility object.
     """
-    app_ref = AXUIElementCreateSystemWide()
+    app_ref = getBackend().createSystemWide()
 
     if app_ref is None:
         raise ErrorUnsupported('Error getting a11y object')
@@ -354,28 +550,6 @@ def getSystemObject(cls):
 
 # callbacks
 # Callback methods for notifications
-def observerCallback(cls, element, contextData):
-    axObj = contextData
-    cb_fn = contextData.callbackFn
-    cb_args = contextData.callbackArgs
-    cb_kwargs = contextData.callbackKwargs
-    if cb_fn is not None:
-        retElem = cls.with_ref(element)
-        if retElem is None:
-            raise RuntimeError('Could not create new AX UI Element.')
-
-        cb_args = (retElem,) + cb_args
-        callbackRes = cb_fn(cb_args, cb_kwargs)
-
-        if callbackRes is None:
-            raise RuntimeError('Python callback failed.')
-
-        if callbackRes in (-1, 1):
-            AppHelper.stopEventLoop()
-
-        temp = axObj.observerRes
-        axObj.observerRes = callbackRes
-    else:
-        AppHelper.stopEventLoop()
-        temp = axObj.observerRes
-        axObj.observerRes = True
+def _callbackArgs(retElem, callbackArgs):
+    # The element the notification came from replaces the first arg
+    return (retElem,) + tuple(callbackArgs or ())[1:]
@@ -431,8 +431,11 @@ def doesrowexist(window_name, object_name, row_text, partial_match = False):
     return _remote_doesrowexist(window_name, object_name, row_text, partial_match)
 def getchild(window_name, child_name = '', role = '', parent = ''):
     return _remote_getchild(window_name, child_name, role, parent)
-def enterstring(window_name, object_name = '', data = ''):
-    return _remote_enterstring(window_name, object_name, data)
+def enterstring(window_name, object_name = '', data = '', mode = 'type'):
+    if mode == 'type':
+        # Understood by servers without the mode argument too
+        return _remote_enterstring(window_name, object_name, data)
+    return _remote_enterstring(window_name, object_name, data, mode)
 def setvalue(window_name, object_name, data):
     return _remote_setvalue(window_name, object_name, float(data))
 def grabfocus(window_name, object_name = ''):
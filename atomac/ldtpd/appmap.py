@@ -0,0 +1,577 @@
+# Copyright (c) 2012 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+#@author: Nagappan Alagappan <nagappan@gmail.com>
+#@copyright: Copyright (c) 2009-12 Nagappan Alagappan
+#http://ldtp.freedesktop.org
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+"""Window appmap indexed by LDTP name, label, object index and class."""
+
+import re
+import fnmatch
+import threading
+from multiprocessing.pool import ThreadPool
+
+_glob_characters=re.compile(r"[*?[]")
+# Stripped from names and labels before comparing them
+_strip=re.compile(r"( |:|\.|_|\n)")
+
+def strip_name(name):
+    """
+    Strip space, colon, dot, underscore and new line from name
+
+    @param name: object name or label
+    @type name: string
+
+    @return: stripped name
+    @rtype: unicode
+    """
+    if not name:
+        return u""
+    if not isinstance(name, unicode):
+        name=u"%s" % name
+    return _strip.sub(u"", name)
+
+class GlobPattern(object):
+    """
+    Name to look for, either a plain name or a Unix glob
+
+    The regular expression is compiled once; plain names are compared
+    as strings.
+    """
+    def __init__(self, name, flags=0):
+        self.name=name
+        self.is_glob=bool(_glob_characters.search(name))
+        if self.is_glob:
+            self._regex=re.compile(fnmatch.translate(name), flags)
+        else:
+            self._regex=None
+
+    def match(self, string):
+        if self._regex is None:
+            return string == self.name
+        return self._regex.match(string) is not None
+
+_patterns={}
+_patterns_lock=threading.Lock()
+
+def glob_pattern(name, flags=0):
+    """
+    Get the compiled pattern of name, compiling it on first use
+
+    @param name: object name, either a plain name or a Unix glob
+    @type name: string
+    @param flags: regular expression flags
+    @type flags: integer
+
+    @return: pattern
+    @rtype: GlobPattern
+    """
+    with _patterns_lock:
+        pattern=_patterns.get((name, flags))
+        if pattern is None:
+            if len(_patterns) >= 512:
+                _patterns.clear()
+            pattern=_patterns[(name, flags)]=GlobPattern(name, flags)
+        return pattern
+
+_class_names={}
+
+def intern_class(class_name):
+    """
+    Get the shared copy of a class name, so that objects of the same
+    class share one string
+
+    @param class_name: class, e.g. push_button
+    @type class_name: string
+
+    @return: class name
+    @rtype: string
+    """
+    return _class_names.setdefault(class_name, class_name)
+
+class AppMapNode(object):
+    """
+    Object of an appmap, or of the window list
+
+    Reads like the dictionary of object info it replaces: obj, class,
+    label, parent, children, child_index and obj_index, plus app for
+    windows. parent and children are kept as node numbers of the appmap
+    and read as LDTP names, children space separated.
+    """
+    __slots__=("obj", "class_name", "label", "parent", "children",
+               "child_index", "obj_index", "app", "id", "_names")
+
+    # Same order as the keys of the dictionary it replaces
+    _fields=("obj_index", "obj", "parent", "app", "class", "child_index",
+             "label", "children")
+    _attributes={"class" : "class_name", "obj" : "obj", "label" : "label",
+                 "child_index" : "child_index", "obj_index" : "obj_index",
+                 "app" : "app"}
+
+    def __init__(self, obj, class_name, label, child_index, obj_index):
+        self.obj=obj
+        self.class_name=intern_class(class_name)
+        self.label=label
+        # Node number of the parent, -1 at the top of the window
+        self.parent=-1
+        # Node numbers of the children, in child order
+        self.children=[]
+        self.child_index=child_index
+        self.obj_index=obj_index
+        self.app=None
+        # Node number, set by AppMap
+        self.id=None
+        # Node number -> LDTP name, shared with the appmap
+        self._names=None
+
+    def _name(self, node_id):
+        if node_id < 0 or self._names is None:
+            return ""
+        return self._names[node_id]
+
+    def __getitem__(self, field):
+        if field == "parent":
+            return self._name(self.parent)
+        if field == "children":
+            return " ".join([self._name(child) for child in self.children])
+        if field == "app" and self.app is None:
+            raise KeyError(field)
+        return getattr(self, self._attributes[field])
+
+    def __setitem__(self, field, value):
+        # parent and children are set through AppMap
+        setattr(self, self._attributes[field], value)
+
+    def __contains__(self, field):
+        return field in self._fields and (field != "app" or
+                                          self.app is not None)
+
+    def get(self, field, default=None):
+        if field in self:
+            return self[field]
+        return default
+
+    def keys(self):
+        return [field for field in self._fields if field in self]
+
+class ReadNode(object):
+    """
+    Element read by TreeReader: its title attributes and its children, as
+    (child index, ReadNode) pairs
+    """
+    def __init__(self, element):
+        self.element=element
+        self.attrs={}
+        self.children=[]
+
+class TreeReader(object):
+    """
+    Read element trees with a bounded pool of threads
+
+    The accessibility calls mostly wait on the target application, so the
+    elements of a level are read concurrently, level after level. Only
+    the reading is spread; the caller walks the result in child order, so
+    what it builds from it does not depend on the number of threads.
+    """
+    def __init__(self, workers=4):
+        self.workers=workers
+        self._pool=None
+        self._pool_size=0
+        self._lock=threading.Lock()
+
+    def map(self, function, items):
+        """
+        Call function on every item, concurrently if workers allow
+
+        @param function: callable taking one item
+        @type function: callable
+        @param items: items
+        @type items: list
+
+        @return: results, in item order
+        @rtype: list
+        """
+        if self.workers <= 1 or len(items) <= 1:
+            return [function(item) for item in items]
+        with self._lock:
+            if self._pool_size != self.workers:
+                if self._pool is not None:
+                    self._pool.close()
+                self._pool=ThreadPool(self.workers)
+                self._pool_size=self.workers
+            pool=self._pool
+        return pool.map(function, items)
+
+    def read(self, roots, read_element):
+        """
+        Read the trees under roots
+
+        @param roots: root elements
+        @type roots: list
+        @param read_element: callable returning the (title attributes,
+        children) of an element
+        @type read_element: callable
+
+        @return: read nodes of the roots
+        @rtype: list
+        """
+        nodes=[ReadNode(root) for root in roots]
+        level=nodes
+        while level:
+            results=self.map(read_element, [node.element for node in level])
+            next_level=[]
+            for node, (attrs, children) in zip(level, results):
+                node.attrs=attrs
+                index=-1
+                for child in children:
+                    index += 1
+                    if not child:
+                        continue
+                    child_node=ReadNode(child)
+                    node.children.append((index, child_node))
+                    next_level.append(child_node)
+            level=next_level
+        return nodes
+
+class AppMap(dict):
+    """
+    Objects of a window by LDTP name, as built by Utils._get_appmap
+
+    Still the dictionary of LDTP name -> object info it always was, the
+    info being an AppMapNode numbered in insertion order, plus indexes
+    kept up to date on insertion and removal: label and stripped label ->
+    LDTP names, obj_index -> LDTP name and class -> LDTP names. Plain
+    names are found with dictionary lookups; globs are matched over the
+    precomputed stripped labels only.
+
+    Objects are ordered as in the window, depth first, which is the order
+    they are inserted in when mapping the window: the first object found
+    is the one a full mapping finds first.
+
+    Once built, the map is patched from the notifications of its window
+    (see Utils._update_appmap): objects keep their LDTP name and obj_index
+    as long as they stay in place, new objects take the next free ones.
+    After patching, the order is read from the tree again.
+
+    A map can also be built lazily, depth first and only as far as a
+    lookup needs (see Utils._find_in_appmap). Objects are inserted in the
+    same order as when building the whole map, so they get the same LDTP
+    names; pending holds the objects still to insert.
+    """
+    def __init__(self, window=None):
+        dict.__init__(self)
+        # Node number -> LDTP name, None once removed
+        self._names=[]
+        # Window element the map was built from
+        self.window=window
+        # Hub subscription queuing the notifications to patch the map
+        # with, None if the window cannot be observed
+        self.subscription=None
+        # Class abbreviation -> last obj_index number given
+        self.obj_index_counters={}
+        # Objects still to insert, as (parent LDTP name, child index,
+        # element, title attributes, children), the next one last
+        self.pending=[]
+        # Element reference -> LDTP name
+        self._refs={}
+        # LDTP name -> (label, stripped label)
+        self._searchable={}
+        # Whether node numbers follow the window order, i.e. no object
+        # was inserted by patching
+        self._in_order=True
+        # Node number -> position in the window order, once patched
+        self._positions=None
+        self._labels={}
+        self._stripped_labels={}
+        self._obj_indexes={}
+        self._classes={}
+
+    def __setitem__(self, key, info):
+        if key in self:
+            del self[key]
+        dict.__setitem__(self, key, info)
+        if info.id is None:
+            self._positions=None
+            info.id=len(self._names)
+            info._names=self._names
+            self._names.append(key)
+        else:
+            # Same node, possibly renamed
+            self._names[info.id]=key
+        label=info["label"] or u""
+        if not isinstance(label, unicode):
+            label=u"%s" % label
+        stripped_label=strip_name(label)
+        self._searchable[key]=(label, stripped_label)
+        self._labels.setdefault(label, []).append(key)
+        self._stripped_labels.setdefault(stripped_label, []).append(key)
+        self._obj_indexes[info["obj_index"]]=key
+        self._classes.setdefault(info["class"], []).append(key)
+        self._refs[info["obj"].ref]=key
+
+    def __delitem__(self, key):
+        info=self[key]
+        dict.__delitem__(self, key)
+        self._names[info.id]=None
+        label, stripped_label=self._searchable.pop(key)
+        self._unindex(self._labels, label, key)
+        self._unindex(self._stripped_labels, stripped_label, key)
+        if self._obj_indexes.get(info["obj_index"]) == key:
+            del self._obj_indexes[info["obj_index"]]
+        self._unindex(self._classes, info["class"], key)
+        if self._refs.get(info["obj"].ref) == key:
+            del self._refs[info["obj"].ref]
+
+    def _unindex(self, index, value, key):
+        keys=index.get(value)
+        if keys is None:
+            return
+        keys.remove(key)
+        if not keys:
+            del index[value]
+
+    def _keys_in_order(self):
+        # LDTP names in window order
+        if self._in_order:
+            for key in self._names:
+                if key is not None:
+                    yield key
+            return
+        top=sorted((info.child_index, info.id) for info in self.itervalues()
+                   if info.parent == -1)
+        node_ids=[node_id for child_index, node_id in reversed(top)]
+        while node_ids:
+            key=self._names[node_ids.pop()]
+            if key is None:
+                continue
+            yield key
+            node_ids.extend(reversed(self[key].children))
+
+    def _position(self, key):
+        # Position of an object in window order
+        if self._in_order:
+            return self[key].id
+        if self._positions is None:
+            self._positions=dict((self[name].id, position) for position, name
+                                 in enumerate(self._keys_in_order()))
+        return self._positions[self[key].id]
+
+    def find(self, name, obj_type=None):
+        """
+        Find the first object, in window order, whose LDTP name, label or stripped
+        label matches name, or name stripped, or whose obj_index (e.g. btn#3)
+        matches name
+
+        @param name: object name, either full name, LDTP's name convention,
+        or a Unix glob
+        @type name: string
+        @param obj_type: class the object must have, None for any
+        @type obj_type: string
+
+        @return: object info, None if not found
+        @rtype: dict
+        """
+        if not isinstance(name, unicode):
+            name=u"%s" % name
+        pattern=glob_pattern(name)
+        stripped=glob_pattern(strip_name(name))
+        if not pattern.is_glob:
+            # Stripping removes no glob character, both are plain names
+            candidates=set()
+            for text in (pattern.name, stripped.name):
+                if dict.__contains__(self, text):
+                    candidates.add(text)
+                candidates.update(self._labels.get(text, ()))
+                candidates.update(self._stripped_labels.get(text, ()))
+            key=self.key_of_obj_index(pattern.name)
+            if key is not None:
+                candidates.add(key)
+            if obj_type:
+                candidates=[key for key in candidates
+                            if self[key]["class"] == obj_type]
+            if not candidates:
+                return None
+            return self[min(candidates, key=self._position)]
+        for key in self._keys_in_order():
+            label, stripped_label=self._searchable[key]
+            if obj_type and self[key]["class"] != obj_type:
+                continue
+            if pattern.match(self[key].obj_index):
+                return self[key]
+            for matcher in (pattern, stripped):
+                if matcher.match(key) or matcher.match(label) or \
+                        matcher.match(stripped_label):
+                    return self[key]
+        return None
+
+    def matches(self, key, name, obj_type=None):
+        """
+        Check whether the LDTP name, label or stripped label of an object
+        matches name, or name stripped, or its obj_index matches name, as
+        in find
+
+        @param key: LDTP name of the object
+        @type key: string
+        @param name: object name, either full name, LDTP's name convention,
+        or a Unix glob
+        @type name: string
+        @param obj_type: class the object must have, None for any
+        @type obj_type: string
+
+        @return: True if it matches
+        @rtype: boolean
+        """
+        if obj_type and self[key]["class"] != obj_type:
+            return False
+        if not isinstance(name, unicode):
+            name=u"%s" % name
+        if glob_pattern(name).match(self[key].obj_index):
+            return True
+        label, stripped_label=self._searchable[key]
+        for matcher in (glob_pattern(name), glob_pattern(strip_name(name))):
+            if matcher.match(key) or matcher.match(label) or \
+                    matcher.match(stripped_label):
+                return True
+        return False
+
+    def key_of_obj_index(self, obj_index):
+        """
+        Get the LDTP name of the object with the given obj_index
+
+        @param obj_index: object index, e.g. btn#3
+        @type obj_index: string
+
+        @return: LDTP name, None if not found
+        @rtype: string
+        """
+        return self._obj_indexes.get(obj_index)
+
+    def keys_of_class(self, class_name):
+        """
+        Get the LDTP names of the objects of a class, in window order
+
+        @param class_name: class, e.g. push_button
+        @type class_name: string
+
+        @return: LDTP names
+        @rtype: list
+        """
+        return sorted(self._classes.get(class_name, ()), key=self._position)
+
+    def key_of_ref(self, ref):
+        """
+        Get the LDTP name of an element
+
+        @param ref: element reference, as in atomac.NativeUIElement.ref
+        @type ref: object
+
+        @return: LDTP name, None if not in the map
+        @rtype: string
+        """
+        return self._refs.get(ref)
+
+    def children_of(self, key):
+        """
+        Get the LDTP names of the children of an object
+
+        @param key: LDTP name, empty string for the window itself
+        @type key: string
+
+        @return: LDTP names, in child order
+        @rtype: list
+        """
+        if key:
+            return [self._names[child] for child in self[key].children]
+        top=sorted((info.child_index, info.id) for info in self.itervalues()
+                   if info.parent == -1)
+        return [self._names[node_id] for child_index, node_id in top]
+
+    def add_child(self, parent_key, key):
+        """
+        Make an object the last child of another
+
+        @param parent_key: LDTP name of the parent, empty for the window
+        @type parent_key: string
+        @param key: LDTP name of the child
+        @type key: string
+        """
+        if not parent_key:
+            return
+        parent=self[parent_key]
+        self[key].parent=parent.id
+        parent.children.append(self[key].id)
+        self._positions=None
+
+    def set_children(self, key, child_keys):
+        """
+        Replace the children of an object
+
+        @param key: LDTP name of the object, empty for the window
+        @type key: string
+        @param child_keys: LDTP names of the children, in child order
+        @type child_keys: list
+        """
+        parent_id=self[key].id if key else -1
+        # New children may come before objects inserted earlier
+        self._in_order=False
+        self._positions=None
+        for child_key in child_keys:
+            self[child_key].parent=parent_id
+        if key:
+            self[key].children=[self[child_key].id
+                                for child_key in child_keys]
+
+    def remove(self, key):
+        """
+        Remove an object and its children
+
+        @param key: LDTP name of the object
+        @type key: string
+        """
+        info=self[key]
+        if info.parent >= 0:
+            parent_key=self._names[info.parent]
+            if parent_key is not None:
+                self[parent_key].children.remove(info.id)
+        node_ids=[info.id]
+        while node_ids:
+            key=self._names[node_ids.pop()]
+            if key is None:
+                continue
+            node_ids.extend(self[key].children)
+            del self[key]
+
+    def rename(self, key, new_key):
+        """
+        Change the LDTP name of an object
+
+        @param key: current LDTP name
+        @type key: string
+        @param new_key: new LDTP name, not in use
+        @type new_key: string
+        """
+        info=self[key]
+        del self[key]
+        self[new_key]=info
+
+    def close(self):
+        """
+        Stop receiving the notifications of the window
+        """
+        if self.subscription is not None:
+            self.subscription.close()
+            self.subscription=None
@@ -55,6 +55,31 @@ class Core(ComboBox, Menu, Mouse, PageTabList, Text, Table, Value, Generic):
             self._process_stats[key].stop()
 
     """Core LDTP class"""
+    def _dispatch(self, method, params):
+        """
+        Run an RPC command, keeping its name for the retry statistics
+        """
+        self._current_command=method
+        try:
+            # Logs the traceback of failing commands in debug mode
+            return super(Core, self)._dispatch(method, params)
+        finally:
+            self._current_command=None
+
+    def getretrystats(self, reset=False):
+        """
+        Get the number of window / object lookups, their retries and
+        remaps, the lookups which failed and the seconds spent waiting,
+        per command
+
+        @param reset: Clear the statistics after reading them
+        @type reset: boolean
+
+        @return: dictionary of command name to its statistics
+        @rtype: dict
+        """
+        return self._retry_scheduler.stats(reset)
+
     def appundertest(self, app_name):
         """
         Application under test
@@ -249,7 +274,7 @@ class Core(ComboBox, Menu, Mouse, PageTabList, Text, Table, Value, Generic):
             self._windows={}
             # Call the method again, after updating apps
             window_handle, name, app=self._get_window_handle(window_name, True)
-            object_list=self._get_appmap(window_handle, name, True)
+            object_list=self._get_appmap(window_handle, name, True, False)
         return object_list.keys()
 
     def getobjectinfo(self, window_name, object_name):
@@ -384,24 +409,29 @@ class Core(ComboBox, Menu, Mouse, PageTabList, Text, Table, Value, Generic):
             raise LdtpServerException('Unable to find window "%s"' % \
                                           window_name)
         appmap = self._get_appmap(_window_handle, _window_name)
-        for name in appmap.keys():
-            obj = appmap[name]
+        if role and not child_name:
             # When only role arg is passed
-            if role and not child_name and obj['class'] == role:
-                matches.append(name)
-            # When parent and child_name arg is passed
-            if parent and child_name and not role and \
-                    self._match_name_to_appmap(parent, obj):
-                matches.append(name)
-            # When only child_name arg is passed
-            if child_name and not role and \
-                    self._match_name_to_appmap(child_name, obj):
-                return name
-                matches.append(name)
-            # When role and child_name args are passed
-            if role and child_name and obj['class'] == role and \
-                    self._match_name_to_appmap(child_name, obj):
-                matches.append(name)
+            matches = appmap.keys_of_class(role)
+        else:
+            if role:
+                names = appmap.keys_of_class(role)
+            else:
+                names = appmap.keys()
+            for name in names:
+                obj = appmap[name]
+                # When parent and child_name arg is passed
+                if parent and child_name and not role and \
+                        self._match_name_to_appmap(parent, obj):
+                    matches.append(name)
+                # When only child_name arg is passed
+                if child_name and not role and \
+                        self._match_name_to_appmap(child_name, obj):
+                    return name
+                    matches.append(name)
+                # When role and child_name args are passed
+                if role and child_name and obj['class'] == role and \
+                        self._match_name_to_appmap(child_name, obj):
+                    matches.append(name)
 
         if not matches:
             _name = ''
@@ -563,21 +593,18 @@ class Core(ComboBox, Menu, Mouse, PageTabList, Text, Table, Value, Generic):
         @rtype: list
         """
         object_handle=self._get_object_handle(window_name, object_name)
+        # Read all the state related attributes in one call
+        attrs=self._get_attributes(object_handle, ["AXEnabled", "AXFocused",
+                                                   "AXRole", "AXValue"])
         _obj_states = []
-        if object_handle.AXEnabled:
+        if attrs.get("AXEnabled"):
             _obj_states.append("enabled")
-        if object_handle.AXFocused:
+        if attrs.get("AXFocused"):
             _obj_states.append("focused")
-        else:
-            try:
-                if object_handle.AXFocused:
-                    _obj_states.append("focusable")
-            except:
-                pass
-        if re.match("AXCheckBox", object_handle.AXRole, re.M | re.U | re.L) or \
-                re.match("AXRadioButton", object_handle.AXRole,
-                         re.M | re.U | re.L):
-            if object_handle.AXValue:
+        role=attrs.get("AXRole") or ""
+        if re.match("AXCheckBox", role, re.M | re.U | re.L) or \
+                re.match("AXRadioButton", role, re.M | re.U | re.L):
+            if attrs.get("AXValue"):
                 _obj_states.append("checked")
         return _obj_states
 
@@ -713,6 +740,37 @@ class Core(ComboBox, Menu, Mouse, PageTabList, Text, Table, Value, Generic):
       self._window_timeout=timeout
       return 1
 
+    def guipollinterval(self, interval):
+      """
+      Change how often waittillguiexist / waittillguinotexist check the GUI
+      when no window or object creation / destruction is notified,
+      default 1 second.
+
+      @param interval: interval in seconds
+      @type interval: float
+
+      @return: 1 on success.
+      @rtype: integer
+      """
+      self._gui_poll_interval=interval
+      return 1
+
+    def appmapworkers(self, workers):
+      """
+      Change how many threads read windows and their objects concurrently
+      when mapping them, default 4; 1 reads them one at a time.
+
+      @param workers: number of threads
+      @type workers: integer
+
+      @return: 1 on success.
+      @rtype: integer
+      """
+      if workers < 1:
+          raise LdtpServerException(u"At least one worker is needed")
+      self._tree_reader.workers=workers
+      return 1
+
     def objtimeout(self, timeout):
       """
       Change object timeout period, default 5 seconds.
@@ -745,15 +803,9 @@ class Core(ComboBox, Menu, Mouse, PageTabList, Text, Table, Value, Generic):
         @return: 1 if GUI was found, 0 if not.
         @rtype: integer
         """
-        timeout = 0
-        while timeout < guiTimeOut:
-            if self.guiexist(window_name, object_name):
-                return 1
-            # Wait 1 second before retrying
-            time.sleep(1)
-            timeout += 1
-        # Object and/or window doesn't appear within the timeout period
-        return 0
+        # Checked again on window / element creation and destruction
+        return self._wait_till_gui(
+            lambda: self.guiexist(window_name, object_name), guiTimeOut)
 
     def waittillguinotexist(self, window_name, object_name = '', guiTimeOut = 30):
         """
@@ -771,15 +823,9 @@ class Core(ComboBox, Menu, Mouse, PageTabList, Text, Table, Value, Generic):
         @return: 1 if GUI has gone away, 0 if not.
         @rtype: integer
         """
-        timeout = 0
-        while timeout < guiTimeOut:
-            if not self.guiexist(window_name, object_name):
-                return 1
-            # Wait 1 second before retrying
-            time.sleep(1)
-            timeout += 1
-        # Object and/or window still appears within the timeout period
-        return 0
+        # Checked again on window / element creation and destruction
+        return self._wait_till_gui(
+            lambda: not self.guiexist(window_name, object_name), guiTimeOut)
 
     def objectexist(self, window_name, object_name):
         """
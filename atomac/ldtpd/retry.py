@@ -0,0 +1,114 @@
+# Copyright (c) 2012 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+#@author: Nagappan Alagappan <nagappan@gmail.com>
+#@copyright: Copyright (c) 2009-12 Nagappan Alagappan
+#http://ldtp.freedesktop.org
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+"""Retry scheduler for window and object lookups."""
+
+import time
+import threading
+
+class RetryScheduler(object):
+    """
+    Retry a lookup with exponential backoff until a deadline.
+
+    Most windows and objects show up within a few hundred milliseconds,
+    so the first retries come quickly and slow down later on. Before an
+    expensive refresh (remap), a cheap check tells whether anything
+    changed at all; the refresh is done anyway once the delay reached its
+    maximum, in case the check missed a change.
+    """
+    def __init__(self, initial_delay=0.02, max_delay=0.5, factor=2):
+        self.initial_delay=initial_delay
+        self.max_delay=max_delay
+        self.factor=factor
+        self._lock=threading.Lock()
+        # command -> {"calls", "retries", "remaps", "failures", "waited"}
+        self._stats={}
+
+    def run(self, command, timeout, lookup, refresh, changed=None):
+        """
+        Call lookup until it returns a true value or timeout seconds passed
+
+        @param command: Name to keep the statistics under
+        @type command: string
+        @param timeout: Deadline in seconds, 0 to try only once
+        @type timeout: float
+        @param lookup: Returns the object looked for, or a false value
+        @type lookup: callable
+        @param refresh: Remaps what lookup searches
+        @type refresh: callable
+        @param changed: Cheap check, true if refresh may find something new
+        @type changed: callable
+
+        @return: lookup result, false value on timeout
+        """
+        deadline=time.time() + timeout
+        delay=self.initial_delay
+        retries=remaps=0
+        waited=0.0
+        result=None
+        try:
+            result=lookup()
+            while not result:
+                remaining=deadline - time.time()
+                if remaining <= 0:
+                    break
+                pause=min(delay, remaining)
+                time.sleep(pause)
+                waited += pause
+                retries += 1
+                if changed is None or delay >= self.max_delay or changed():
+                    refresh()
+                    remaps += 1
+                delay=min(delay * self.factor, self.max_delay)
+                result=lookup()
+            return result
+        finally:
+            self._record(command, retries, remaps, waited, not result)
+
+    def _record(self, command, retries, remaps, waited, failed):
+        with self._lock:
+            stats=self._stats.setdefault(command or "unknown",
+                                         {"calls" : 0, "retries" : 0,
+                                          "remaps" : 0, "failures" : 0,
+                                          "waited" : 0.0})
+            stats["calls"] += 1
+            stats["retries"] += retries
+            stats["remaps"] += remaps
+            stats["waited"] += waited
+            if failed:
+                stats["failures"] += 1
+
+    def stats(self, reset=False):
+        """
+        Get the retry statistics per command
+
+        @param reset: Clear the statistics after reading them
+        @type reset: boolean
+
+        @return: command -> calls, retries, remaps, failures and seconds
+        waited
+        @rtype: dict
+        """
+        with self._lock:
+            stats=dict((command, dict(values))
+                       for command, values in self._stats.items())
+            if reset:
+                self._stats={}
+        return stats
@@ -77,7 +77,7 @@ class Text(Utils):
         key_release_action = KeyReleaseAction(window, data)
         return 1
 
-    def enterstring(self, window_name, object_name='', data=''):
+    def enterstring(self, window_name, object_name='', data='', mode='type'):
         """
         Type string sequence.
         
@@ -89,10 +89,16 @@ class Text(Utils):
         @type object_name: string
         @param data: data to type.
         @type data: string
+        @param mode: 'type' to type data key by key, 'paste' to paste it
+        through the clipboard, typing it if the text value did not change;
+        fails if the text value changed without containing data
+        @type mode: string
 
         @return: 1 on success.
         @rtype: integer
         """
+        if mode not in ('type', 'paste'):
+            raise LdtpServerException(u"Unknown mode %s" % mode)
         if not object_name and not data:
             return self.generatekeyevent(window_name)
         else:
@@ -100,7 +106,12 @@ class Text(Utils):
             if not object_handle.AXEnabled:
                 raise LdtpServerException(u"Object %s state disabled" % object_name)
             self._grabfocus(object_handle)
-            object_handle.sendKeys(data)
+            if mode == 'paste':
+                if not object_handle.sendKeysViaPaste(data):
+                    raise LdtpServerException(
+                        u"Unable to paste into %s" % object_name)
+            else:
+                object_handle.sendKeys(data)
             return 1
 
     def settextvalue(self, window_name, object_name, data):
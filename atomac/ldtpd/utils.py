@@ -30,6 +30,9 @@ import threading
 import traceback
 import logging.handlers
 
+from retry import RetryScheduler
+from appmap import AppMap, AppMapNode, TreeReader, glob_pattern
+from atomac.AXObserverHub import getHub
 from constants import abbreviated_roles, ldtp_class_type
 from server_exception import LdtpServerException
 
@@ -146,14 +149,28 @@ class ProcessStats(threading.Thread):
         self._stop = True
         self.running = False
 
+# Stripped from names before matching them, for windows and other objects
+_window_strip=re.compile(r"( |\n)")
+_object_strip=re.compile(r"( |:|\.|_|\n)")
+
 class Utils(object):
     _singleton_running_apps = None
+    # Shared by all the lookups, keeps per command statistics
+    _retry_scheduler = RetryScheduler()
+    # Reads the windows and their objects, see appmapworkers
+    _tree_reader = TreeReader()
 
     def __init__(self):
         self._appmap={}
+        self._ldtpized_obj_index={}
         self._windows={}
         self._obj_timeout=5
         self._window_timeout=30
+        # Seconds between checks of the waittillgui* calls when no
+        # notification comes in
+        self._gui_poll_interval=1
+        # RPC command being run, to keep the retry statistics under
+        self._current_command=None
         self._callback_event=[]
         self._app_under_test=None
         self._custom_logger=_custom_logger
@@ -198,26 +215,32 @@ class Utils(object):
             raise
 
     def _get_front_most_window(self):
-        app=atomac.NativeUIElement.getFrontmostApp()
-        return app.windows()[0]
+        window=atomac.NativeUIElement.getFrontmostWindow()
+        if not window:
+            raise LdtpServerException(u"Unable to find front most window")
+        return window
 
     def _get_any_window(self):
         front_app=atomac.NativeUIElement.getAnyAppWithWindow()
         return front_app.windows()[0]
 
-    def _ldtpize_accessible(self, acc):
+    def _ldtpize_accessible(self, acc, attrs=None):
         """
         Get LDTP format accessibile name
 
         @param acc: Accessible handle
         @type acc: object
+        @param attrs: Attributes of acc already read by _get_title_attributes
+        @type attrs: dict
 
         @return: object type, stripped object name (associated / direct),
                         associated label
         @rtype: tuple
         """
-        actual_role=self._get_role(acc)
-        label=self._get_title(acc)
+        if attrs is None:
+            attrs=self._get_title_attributes(acc)
+        actual_role=self._get_role(acc, attrs)
+        label=self._get_title(acc, attrs)
         if re.match("AXWindow", actual_role, re.M | re.U | re.L):
             # Strip space and new line from window title
             strip=r"( |\n)"
@@ -242,8 +265,7 @@ class Utils(object):
         Match given string, by escaping regex characters
         """
         # regex flags Multi-line, Unicode, Locale
-        return bool(re.match(fnmatch.translate(pattern), string,
-                             re.M | re.U | re.L))
+        return glob_pattern(pattern, re.M | re.U | re.L).match(string)
  
     def _match_name_to_appmap(self, name, acc):
         if not name:
@@ -254,22 +276,28 @@ class Utils(object):
             return 1
         role = acc['class']
         if role == 'frame' or role == 'dialog' or role == 'window':
-            strip = '( |\n)'
+            strip = _window_strip
         else:
-            strip = '( |:|\.|_|\n)'
-        obj_name = re.sub(strip, '', name)
+            strip = _object_strip
+        obj_name = strip.sub('', name)
         if acc['label']:
-            _tmp_name = re.sub(strip, '', acc['label'])
+            _tmp_name = strip.sub('', acc['label'])
             if self._glob_match(obj_name, _tmp_name):
                 return 1
         return 0
 
-    def _insert_obj(self, obj_dict, obj, parent, child_index):
-        ldtpized_name=self._ldtpize_accessible(obj)
-        if ldtpized_name[0] in self._ldtpized_obj_index:
-            self._ldtpized_obj_index[ldtpized_name[0]] += 1
-        else:
-            self._ldtpized_obj_index[ldtpized_name[0]]=0
+    def _unique_appmap_key(self, obj_dict, ldtpized_name):
+        """
+        Get the LDTP name of an object, numbered if already in use
+
+        @param obj_dict: appmap the object goes into
+        @type obj_dict: dict
+        @param ldtpized_name: class abbreviation and label
+        @type ldtpized_name: tuple
+
+        @return: LDTP name
+        @rtype: string
+        """
         try:
             key="%s%s" % (ldtpized_name[0], ldtpized_name[1])
         except UnicodeEncodeError:
@@ -291,32 +319,39 @@ class Utils(object):
                 key="%s%s%d" % (ldtpized_name[0],
                                 ldtpized_name[1].decode("utf-8"), index)
             index += 1
+        return key
+
+    def _insert_obj(self, obj_dict, obj, parent, child_index, attrs=None):
+        if attrs is None:
+            attrs=self._get_title_attributes(obj)
+        ldtpized_name=self._ldtpize_accessible(obj, attrs)
+        # An appmap numbers its objects itself, so that patching it keeps
+        # numbering where it stopped
+        obj_index_counters=getattr(obj_dict, "obj_index_counters",
+                                   self._ldtpized_obj_index)
+        if ldtpized_name[0] in obj_index_counters:
+            obj_index_counters[ldtpized_name[0]] += 1
+        else:
+            obj_index_counters[ldtpized_name[0]]=0
+        key=self._unique_appmap_key(obj_dict, ldtpized_name)
         if ldtpized_name[0] == "frm":
             # Window
             # FIXME: As in Linux (app#index, rather than window#index)
             obj_index="%s#%d" % (ldtpized_name[0],
-                                 self._ldtpized_obj_index[ldtpized_name[0]])
+                                 obj_index_counters[ldtpized_name[0]])
         else:
             # Object inside the window
             obj_index="%s#%d" % (ldtpized_name[0],
-                                 self._ldtpized_obj_index[ldtpized_name[0]])
+                                 obj_index_counters[ldtpized_name[0]])
+        actual_role=self._get_role(obj, attrs)
+        obj_dict[key]=AppMapNode(obj,
+                                 # Use Linux based class type for compatibility
+                                 # If class type doesn't exist in list, use
+                                 # actual type
+                                 ldtp_class_type.get(actual_role, actual_role),
+                                 ldtpized_name[1], child_index, obj_index)
         if parent in obj_dict:
-            _current_children=obj_dict[parent]["children"]
-            if _current_children:
-                _current_children="%s %s" % (_current_children, key)
-            else:
-                _current_children=key
-            obj_dict[parent]["children"]=_current_children
-        actual_role=self._get_role(obj)
-        obj_dict[key]={"obj" : obj,
-                       # Use Linux based class type for compatibility
-                       # If class type doesn't exist in list, use actual type
-                       "class" : ldtp_class_type.get(actual_role, actual_role),
-                       "label" : ldtpized_name[1],
-                       "parent" : parent,
-                       "children" : "",
-                       "child_index" : child_index,
-                       "obj_index" : obj_index}
+            obj_dict.add_child(parent, key)
         return key
 
     def _get_windows(self, force_remap=False):
@@ -328,71 +363,109 @@ class Utils(object):
         self._update_apps()
         windows={}
         self._ldtpized_obj_index={}
+        guis=[]
         for gui in set(self._running_apps):
             if self._app_under_test and \
                     self._app_under_test != gui.bundleIdentifier() and \
                     self._app_under_test != gui.localizedName():
                 # Not the app under test, search next application
                 continue
-            # Get process id
-            pid=gui.processIdentifier()
-            # Get app id
-            app=atomac.getAppRefByPid(pid)
-            # Get all windows of current app
-            app_windows=app.windows()
-            try:
-                # Tested with
-                # selectmenuitem('appChickenoftheVNC', 'Connection;Open Connection...')
-                if not app_windows and app.AXRole == "AXApplication":
-                    # If app doesn't have any windows and its role is AXApplication
-                    # add to window list
-                    key=self._insert_obj(windows, app, "", -1)
-                    windows[key]["app"]=app
-                    continue
-            except (atomac._a11y.ErrorAPIDisabled, \
-                        atomac._a11y.ErrorCannotComplete, \
-                        atomac._a11y.Error, \
-                        atomac._a11y.ErrorInvalidUIElement):
-                pass
-            # Navigate all the windows
-            for window in app_windows:
-                if not window:
-                    continue
-                key=self._insert_obj(windows, window, "", -1)
+            guis.append(gui)
+        # Applications are read concurrently, their windows are named
+        # afterwards in the same order as when read one by one
+        for app, app_windows in self._tree_reader.map(self._read_app_windows,
+                                                      guis):
+            for window, attrs in app_windows:
+                key=self._insert_obj(windows, window, "", -1, attrs)
                 windows[key]["app"]=app
         # Replace existing windows list
         self._windows=windows
+        # Stop watching the windows gone
+        for window_name in self._appmap.keys():
+            if window_name not in windows:
+                self._appmap.pop(window_name).close()
         return windows
 
-    def _get_title(self, obj):
-        title=""
-        role=""
+    def _read_app_windows(self, gui):
+        """
+        Read the windows of a running application
+
+        @param gui: running application
+        @type gui: NSRunningApplication
+
+        @return: application element and its windows, as (window, title
+        attributes) pairs; the application itself if it has no window
+        @rtype: tuple
+        """
+        # Get process id
+        pid=gui.processIdentifier()
+        # Get app id
+        app=atomac.getAppRefByPid(pid)
+        # Get all windows of current app
+        app_windows=app.windows()
         try:
-            role=obj.AXRole
-            desc=obj.AXRoleDescription
-            if re.match("(AXStaticText|AXRadioButton|AXButton)",
-                        role, re.M | re.U | re.L) and \
-                    (desc == "text" or desc == "radio button" or \
-                         desc == "button") and obj.AXValue:
-                return obj.AXValue
-        except:
+            # Tested with
+            # selectmenuitem('appChickenoftheVNC', 'Connection;Open Connection...')
+            if not app_windows and app.AXRole == "AXApplication":
+                # If app doesn't have any windows and its role is AXApplication
+                # add to window list
+                return app, [(app, self._get_title_attributes(app))]
+        except (atomac._a11y.ErrorAPIDisabled, \
+                    atomac._a11y.ErrorCannotComplete, \
+                    atomac._a11y.Error, \
+                    atomac._a11y.ErrorInvalidUIElement):
             pass
+        # Navigate all the windows
+        return app, [(window, self._get_title_attributes(window))
+                     for window in app_windows if window]
+
+    # Attributes _get_title may need, fetched together in one call
+    _title_attributes=["AXRole", "AXRoleDescription", "AXValue", "AXTitle",
+                       "AXHelp", "AXFilename", "AXDescription"]
+
+    def _get_attributes(self, obj, names):
+        """
+        Get the given attributes of obj in one round-trip
+
+        @return: dictionary of attribute name to value, the attributes that
+        could not be read are left out
+        @rtype: dict
+        """
+        values=obj.getAttributes(names)
+        return dict((name, value) for name, value in values.items()
+                    if not isinstance(value, atomac._a11y.Error))
+
+    def _get_title_attributes(self, obj):
         try:
-            checkBox=re.match("AXCheckBox", role, re.M | re.U | re.L)
-            if checkBox:
-                # Instruments doesn't have AXTitle, AXValue for AXCheckBox
-                try:
-                    title=obj.AXHelp
-                except (atomac._a11y.ErrorUnsupported, atomac._a11y.Error):
-                    pass
-            if not title:
-                title=obj.AXTitle
-        except (atomac._a11y.ErrorUnsupported, atomac._a11y.Error):
-            try:
+            return self._get_attributes(obj, self._title_attributes)
+        except atomac._a11y.Error:
+            return {}
+
+    def _get_title(self, obj, attrs=None):
+        if attrs is None:
+            attrs=self._get_title_attributes(obj)
+        title=""
+        role=attrs.get("AXRole") or ""
+        desc=attrs.get("AXRoleDescription")
+        if re.match("(AXStaticText|AXRadioButton|AXButton)",
+                    role, re.M | re.U | re.L) and \
+                (desc == "text" or desc == "radio button" or \
+                     desc == "button") and attrs.get("AXValue"):
+            return attrs["AXValue"]
+        checkBox=re.match("AXCheckBox", role, re.M | re.U | re.L)
+        if checkBox:
+            # Instruments doesn't have AXTitle, AXValue for AXCheckBox
+            title=attrs.get("AXHelp")
+        if not title:
+            if "AXTitle" in attrs:
+                title=attrs["AXTitle"]
+            else:
+                found=True
                 text=re.match("(AXTextField|AXTextArea)", role,
-                                re.M | re.U | re.L)
+                              re.M | re.U | re.L)
                 if text:
-                    title=obj.AXFilename
+                    found="AXFilename" in attrs
+                    title=attrs.get("AXFilename", title)
                 else:
                     if not re.match("(AXTabGroup)", role,
                                     re.M | re.U | re.L):
@@ -408,47 +481,40 @@ class Utils(object):
                             # scbr1 (Horizontal)
                             title=""
                         else:
-                            title=obj.AXValue
-            except (atomac._a11y.ErrorUnsupported, atomac._a11y.Error):
-                if re.match("AXButton", role,
-                            re.M | re.U | re.L):
-                    try:
-                        title=obj.AXDescription
+                            found="AXValue" in attrs
+                            title=attrs.get("AXValue", title)
+                if not found:
+                    if re.match("AXButton", role,
+                                re.M | re.U | re.L) and \
+                            "AXDescription" in attrs:
+                        title=attrs["AXDescription"]
                         if title:
                             return title
-                    except (atomac._a11y.ErrorUnsupported, atomac._a11y.Error):
-                        pass
-                try:
                     if not re.match("(AXList|AXTable)", role,
-                                    re.M | re.U | re.L):
+                                    re.M | re.U | re.L) and \
+                            "AXRoleDescription" in attrs:
                         # List have description as list
                         # So skip it
-                        title=obj.AXRoleDescription
-                except (atomac._a11y.ErrorUnsupported, atomac._a11y.Error):
-                    pass
+                        title=attrs["AXRoleDescription"]
         if not title:
             if re.match("(AXButton|AXCheckBox)", role,
                         re.M | re.U | re.L):
-                try:
-                    title=obj.AXRoleDescription
-                    if title:
-                       return title
-                except (atomac._a11y.ErrorUnsupported, atomac._a11y.Error):
-                    pass
+                title=attrs.get("AXRoleDescription")
+                if title:
+                   return title
             elif re.match("(AXStaticText)", role,
                           re.M | re.U | re.L):
-                try:
-                    title=obj.AXValue
-                    if title:
-                       return title
-                except (atomac._a11y.ErrorUnsupported, atomac._a11y.Error):
-                    pass
+                title=attrs.get("AXValue")
+                if title:
+                   return title
             # Noticed that some of the above one assigns title as None
             # in that case return empty string
             return ""
         return title
 
-    def _get_role(self, obj):
+    def _get_role(self, obj, attrs=None):
+        if attrs is not None:
+            return attrs.get("AXRole", "")
         role=""
         try:
             role=obj.AXRole
@@ -456,6 +522,76 @@ class Utils(object):
             pass
         return role
 
+    # Notifications after which a window or object may have appeared
+    # or disappeared
+    _gui_change_notifications=["AXWindowCreated", "AXUIElementDestroyed",
+                               "AXCreated"]
+    # NSApplicationActivationPolicyRegular, applications in the Dock
+    _regular_activation_policy=0
+
+    def _watch_gui_changes(self, subscription, watched):
+        """
+        Subscribe to the GUI change notifications of the applications not
+        watched yet: the application under test, else the regular
+        applications only. Agents and background helpers seldom open a
+        window, the periodic poll covers them without an observer each.
+
+        @param subscription: hub subscription receiving the notifications
+        @type subscription: atomac.AXObserverHub.Subscription
+        @param watched: pids already subscribed to, updated in place
+        @type watched: set
+        """
+        for gui in self._running_apps:
+            if self._app_under_test:
+                if self._app_under_test != gui.bundleIdentifier() and \
+                        self._app_under_test != gui.localizedName():
+                    continue
+            elif gui.activationPolicy() != \
+                    self._regular_activation_policy:
+                continue
+            pid=gui.processIdentifier()
+            if pid in watched:
+                continue
+            watched.add(pid)
+            app=atomac.getAppRefByPid(pid)
+            for notification in self._gui_change_notifications:
+                try:
+                    subscription.add(app.ref, notification)
+                except atomac._a11y.Error:
+                    # Background helpers may not accept observers,
+                    # the fallback poll covers them
+                    pass
+
+    def _wait_till_gui(self, check, timeout):
+        """
+        Call check until it returns true, again on each GUI change
+        notification and at least every _gui_poll_interval seconds
+
+        @param check: function without arguments
+        @type check: callable
+        @param timeout: Wait timeout in seconds
+        @type timeout: integer
+
+        @return: 1 if check succeeded, 0 on timeout.
+        @rtype: integer
+        """
+        deadline=time.time() + timeout
+        watched=set()
+        with getHub().listen() as subscription:
+            while True:
+                # Subscribe first, so that no change goes unnoticed
+                self._update_apps()
+                self._watch_gui_changes(subscription, watched)
+                if check():
+                    return 1
+                remaining=deadline - time.time()
+                if remaining <= 0:
+                    return 0
+                if subscription.get(min(remaining, self._gui_poll_interval)):
+                    # Check once for a burst of notifications
+                    while subscription.get(0):
+                        pass
+
     def _update_apps(self):
         # Current opened applications list will be updated
         self._running_apps=atomac.NativeUIElement._getRunningApps()
@@ -492,8 +628,12 @@ class Utils(object):
     def _getobjectsize(self, handle):
         if not handle:
             raise LdtpServerException("Invalid handle")
-        x, y=handle.AXPosition
-        width, height=handle.AXSize
+        attrs=handle.getAttributes(["AXPosition", "AXSize"])
+        for value in attrs.values():
+            if isinstance(value, atomac._a11y.Error):
+                raise value
+        x, y=attrs["AXPosition"]
+        width, height=attrs["AXSize"]
         return x, y, width, height
 
     def _get_window_handle(self, window_name, wait_for_window=True):
@@ -533,22 +673,54 @@ class Utils(object):
             window_timeout=self._obj_timeout
         else:
             # don't wait for the window 
-            window_timeout=1
-        for retry in range(0, window_timeout):
-            window_obj=_internal_get_window_handle(windows)
-            if window_obj[0]:
-                # If window object found, return immediately
-                return window_obj
-            if window_timeout <= 1:
-                # Don't wait for the window
-                break
-            time.sleep(1)
-            windows=self._get_windows(True)
-        if not window_obj[0]:
+            window_timeout=0
+        state={"windows" : windows, "signature" : None}
+        def _lookup():
+            window_obj=_internal_get_window_handle(state["windows"])
+            return window_obj if window_obj[0] else None
+        def _remap():
+            state["windows"]=self._get_windows(True)
+        def _changed():
+            # Titles of the windows of each application, much cheaper
+            # than a remap. Read only once the lookup missed, the first
+            # miss remaps since the cached windows may be stale
+            signature=self._get_windows_signature()
+            changed=state["signature"] is None or \
+                signature != state["signature"]
+            state["signature"]=signature
+            return changed
+        window_obj=self._retry_scheduler.run(self._current_command,
+                                             window_timeout, _lookup,
+                                             _remap, _changed)
+        if not window_obj:
             raise LdtpServerException('Unable to find window "%s"' % \
                                           orig_window_name)
         return window_obj
 
+    def _get_windows_signature(self):
+        """
+        Get the pid and window titles of the applications whose windows
+        are looked up
+
+        @return: signature changing along with the window list
+        @rtype: tuple
+        """
+        signature=[]
+        self._update_apps()
+        for gui in self._running_apps:
+            if self._app_under_test and \
+                    self._app_under_test != gui.bundleIdentifier() and \
+                    self._app_under_test != gui.localizedName():
+                continue
+            app=atomac.getAppRefByPid(gui.processIdentifier())
+            try:
+                titles=tuple(self._get_title(window)
+                             for window in app.AXWindows or [])
+            except atomac._a11y.Error:
+                titles=None
+            signature.append((gui.processIdentifier(), titles))
+        return tuple(signature)
+
     def _get_object_handle(self, window_name, obj_name, obj_type=None,
                            wait_for_object=True, force_remap=False):
         try:
@@ -559,6 +731,7 @@ class Utils(object):
             # During the test, when the window closed and reopened
             # ErrorInvalidUIElement exception will be thrown
             self._windows={}
+            self._forget_appmaps()
             # Call the method again, after updating apps
             return self._internal_get_object_handle(window_name, obj_name,
                                                     obj_type, wait_for_object)
@@ -580,6 +753,8 @@ class Utils(object):
             # During the test, when the window closed and reopened
             # ErrorCannotComplete exception will be thrown
             self._windows={}
+            # The appmap missed the change, build it again
+            self._forget_appmaps()
             # Call the method again, after updating apps
             obj=self._get_object_map(window_name, obj_name, obj_type,
                                      wait_for_object, True)
@@ -596,88 +771,412 @@ class Utils(object):
                                                                      wait_for_object)
         if not window_handle:
             raise LdtpServerException("Unable to find window %s" % window_name)
-        strip=r"( |:|\.|_|\n)"
         if not isinstance(obj_name, unicode):
             # Convert to unicode string
             obj_name=u"%s" % obj_name
-        stripped_obj_name=re.sub(strip, u"", obj_name)
-        obj_name=fnmatch.translate(obj_name)
-        stripped_obj_name=fnmatch.translate(stripped_obj_name)
-        object_list=self._get_appmap(window_handle, ldtp_window_name, force_remap)
+        # Map only as much of the window as the lookup needs
+        object_list=self._get_appmap(window_handle, ldtp_window_name,
+                                     force_remap, lazy=True)
         def _internal_get_object_handle(object_list):
             # To handle retry this function has been introduced
-            for obj in object_list:
-                if obj_type and object_list[obj]["class"] != obj_type:
-                    # If object type is provided and doesn't match
-                    # don't proceed further, just continue searching
-                    # next element, even though the label matches
-                    continue
-                label=object_list[obj]["label"]
-                strip=r"( |:|\.|_|\n)"
-                if not isinstance(label, unicode):
-                    # Convert to unicode string
-                    label=u"%s" % label
-                stripped_label=re.sub(strip, u"", label)
-                # FIXME: Find object name in LDTP format
-                if re.match(obj_name, obj) or re.match(obj_name, label) or \
-                        re.match(obj_name, stripped_label) or \
-                        re.match(stripped_obj_name, obj) or \
-                        re.match(stripped_obj_name, label) or \
-                        re.match(stripped_obj_name, stripped_label):
-                    # Return object map
-                    return object_list[obj]
+            # FIXME: Find object name in LDTP format
+            return self._find_in_appmap(object_list, obj_name, obj_type)
         if wait_for_object:
             obj_timeout=self._obj_timeout
         else:
             # don't wait for the object 
-            obj_timeout=1
-        for retry in range(0, obj_timeout):
-            obj=_internal_get_object_handle(object_list)
-            if obj:
-                # If object found, return immediately
-                return obj
-            if obj_timeout <= 1:
-                # Don't wait for the object
-                break
-            time.sleep(1)
-            # Force remap
-            object_list=self._get_appmap(window_handle,
-                                         ldtp_window_name, True)
-            # print(object_list)
+            obj_timeout=0
+        state={"object_list" : object_list, "changed" : False}
+        def _lookup():
+            return _internal_get_object_handle(state["object_list"])
+        def _remap():
+            # Force remap, patching the appmap if the application notified
+            # changes, rebuilding it in case a change went unnoticed
+            state["object_list"]=self._get_appmap(window_handle,
+                                                  ldtp_window_name, True,
+                                                  state["changed"], True)
+            state["changed"]=False
+        with getHub().listen() as subscription:
+            if obj_timeout:
+                # Remap only after the application notified a change
+                self._watch_object_changes(subscription, app)
+            def _changed():
+                while subscription.get(0):
+                    state["changed"]=True
+                return state["changed"]
+            obj=self._retry_scheduler.run(self._current_command, obj_timeout,
+                                          _lookup, _remap, _changed)
+        if obj:
+            return obj
         raise LdtpServerException("Unable to find object %s" % obj_name)
 
-    def _populate_appmap(self, obj_dict, obj, parent, child_index):
-        index=-1
-        if obj:
-            if child_index != -1:
-                parent=self._insert_obj(obj_dict, obj, parent, child_index)
+    # Notifications after which an object may have appeared in a window
+    _object_change_notifications=["AXCreated", "AXUIElementDestroyed",
+                                  "AXTitleChanged", "AXValueChanged"]
+
+    # Notifications an appmap queues before it is rebuilt instead of
+    # patched
+    _appmap_event_limit=256
+
+    def _watch_object_changes(self, subscription, app, strict=False):
+        """
+        Subscribe to the notifications of app telling that a window
+        content changed
+
+        @param subscription: hub subscription receiving the notifications
+        @type subscription: atomac.AXObserverHub.Subscription
+        @param app: application element, or a window to watch that window
+        only
+        @type app: atomac.NativeUIElement
+        @param strict: raise if a notification cannot be subscribed to
+        @type strict: boolean
+        """
+        if not app:
+            return
+        for notification in self._object_change_notifications:
             try:
-                if not obj.AXChildren:
-                    return
+                subscription.add(app.ref, notification)
             except atomac._a11y.Error:
-                return
-            for child in obj.AXChildren:
+                if strict:
+                    raise
+                # Remapped at the longest retry delay instead
+                pass
+
+    def _read_appmap_element(self, obj):
+        """
+        Read what the appmap needs of an element
+
+        @param obj: element
+        @type obj: atomac.NativeUIElement
+
+        @return: title attributes and children
+        @rtype: tuple
+        """
+        return self._get_title_attributes(obj), self._read_children(obj)
+
+    def _read_children(self, obj):
+        try:
+            return obj.AXChildren or []
+        except atomac._a11y.Error:
+            return []
+
+    def _populate_appmap(self, obj_dict, obj, parent, child_index):
+        if not obj:
+            return
+        # Sibling subtrees are read concurrently, then inserted depth
+        # first, so that LDTP names do not depend on the reading order
+        node=self._tree_reader.read([obj], self._read_appmap_element)[0]
+        self._insert_read_node(obj_dict, node, parent, child_index)
+
+    def _insert_read_node(self, obj_dict, node, parent, child_index):
+        if child_index != -1:
+            parent=self._insert_obj(obj_dict, node.element, parent,
+                                    child_index, node.attrs)
+        for index, child in node.children:
+            self._insert_read_node(obj_dict, child, parent, index)
+
+    def _find_in_appmap(self, obj_dict, obj_name, obj_type=None):
+        """
+        Find an object in an appmap, mapping the window further until found
+        if the appmap is lazy
+
+        Objects are mapped depth first, in the order of a full mapping, so
+        the first one matching is the one a full appmap would give.
+
+        @param obj_dict: appmap
+        @type obj_dict: AppMap
+        @param obj_name: object name, either full name, LDTP's name
+        convention, or a Unix glob
+        @type obj_name: string
+        @param obj_type: class the object must have, None for any
+        @type obj_type: string
+
+        @return: object info, None if not found
+        @rtype: dict
+        """
+        obj=obj_dict.find(obj_name, obj_type)
+        while obj is None and obj_dict.pending:
+            key=self._expand_appmap(obj_dict)
+            if key and obj_dict.matches(key, obj_name, obj_type):
+                obj=obj_dict[key]
+        if obj is not None:
+            # Map what is under the object, so that its children are
+            # known; still depth first, so names do not change
+            key=obj_dict.key_of_ref(obj["obj"].ref)
+            while obj_dict.pending and \
+                    self._is_under(obj_dict, obj_dict.pending[-1][0], key):
+                self._expand_appmap(obj_dict)
+        return obj
+
+    def _is_under(self, obj_dict, key, ancestor):
+        # Whether the object key is ancestor or one of its descendants
+        while key:
+            if key == ancestor:
+                return True
+            key=obj_dict[key]["parent"]
+        return False
+
+    def _expand_appmap(self, obj_dict):
+        """
+        Insert the next pending object of a lazy appmap, its children
+        becoming pending
+
+        @param obj_dict: appmap
+        @type obj_dict: AppMap
+
+        @return: LDTP name of the object, empty for the window
+        @rtype: string
+        """
+        parent, child_index, obj, attrs, children=obj_dict.pending.pop()
+        if child_index == -1:
+            key=parent
+        else:
+            key=self._insert_obj(obj_dict, obj, parent, child_index, attrs)
+        if children is None:
+            children=self._read_children(obj)
+        indexes=[index for index in range(len(children)) if children[index]]
+        # Siblings are read together, then pushed so that the first child
+        # comes out next
+        results=self._tree_reader.map(self._read_appmap_element,
+                                      [children[index] for index in indexes])
+        for index, (child_attrs, grandchildren) in reversed(zip(indexes,
+                                                                results)):
+            obj_dict.pending.append((key, index, children[index], child_attrs,
+                                     grandchildren))
+        return key
+
+    def _complete_appmap(self, obj_dict):
+        """
+        Map the rest of the window of a lazy appmap
+
+        @param obj_dict: appmap
+        @type obj_dict: AppMap
+        """
+        while obj_dict.pending:
+            # Children of the next pending object, read all at once
+            # through _populate_appmap
+            parent, child_index, obj, attrs, children=obj_dict.pending.pop()
+            if child_index == -1:
+                key=parent
+            else:
+                key=self._insert_obj(obj_dict, obj, parent, child_index,
+                                     attrs)
+            if children is None:
+                children=self._read_children(obj)
+            roots=[child for child in children if child]
+            nodes=self._tree_reader.read(roots, self._read_appmap_element)
+            index=-1
+            for child in children:
                 index += 1
                 if not child:
                     continue
-                self._populate_appmap(obj_dict, child, parent, index)
+                self._insert_read_node(obj_dict, nodes.pop(0), key, index)
+
+    def _get_appmap(self, window_handle, window_name, force_remap=False,
+                    patch=True, lazy=False):
+        """
+        Get the appmap of a window, building it on first use
 
-    def _get_appmap(self, window_handle, window_name, force_remap=False):
+        @param window_handle: window element
+        @type window_handle: atomac.NativeUIElement
+        @param window_name: LDTP name of the window
+        @type window_name: string
+        @param force_remap: bring the appmap up to date with the window
+        @type force_remap: boolean
+        @param patch: when remapping, only patch the objects the window
+        notified changes of, if it could be observed
+        @type patch: boolean
+        @param lazy: map the window only as lookups need, see
+        _find_in_appmap; otherwise the whole window is mapped
+        @type lazy: boolean
+
+        @return: appmap
+        @rtype: AppMap
+        """
         if not window_handle or not window_name:
             # If invalid argument return empty dict
-            return {}
-        if not force_remap and self._appmap.has_key(window_name):
-            # If available in cache then use that
-            # unless remap is forced
-            return self._appmap[window_name]
-        obj_dict={}
-        self._ldtpized_obj_index={}
-        # Populate the appmap and cache it
-        self._populate_appmap(obj_dict, window_handle, "", -1)
+            return AppMap()
+        obj_dict=self._appmap.get(window_name)
+        if obj_dict is not None and obj_dict.window == window_handle:
+            if not force_remap or (patch and self._update_appmap(obj_dict)):
+                # If available in cache then use that
+                # unless remap is forced
+                if not lazy:
+                    self._complete_appmap(obj_dict)
+                return obj_dict
+        if obj_dict is not None:
+            obj_dict.close()
+        obj_dict=AppMap(window_handle)
+        # Watch first, so that no change made while populating is missed
+        obj_dict.subscription=self._watch_appmap(window_handle)
+        if lazy:
+            # Mapped as lookups go
+            obj_dict.pending.append(("", -1, window_handle, None, None))
+        else:
+            # Populate the appmap and cache it
+            self._populate_appmap(obj_dict, window_handle, "", -1)
         # Cache the object dictionary
         self._appmap[window_name]=obj_dict
         return obj_dict
 
+    def _forget_appmaps(self):
+        """
+        Drop all the appmaps, rebuilt on next use
+        """
+        for obj_dict in self._appmap.values():
+            obj_dict.close()
+        self._appmap={}
+
+    def _watch_appmap(self, window_handle):
+        """
+        Subscribe to the notifications telling that the content of a window
+        changed
+
+        @param window_handle: window element
+        @type window_handle: atomac.NativeUIElement
+
+        @return: hub subscription, None if the window cannot be observed
+        @rtype: atomac.AXObserverHub.Subscription
+        """
+        # Bounded, an appmap only used from its cache would otherwise
+        # queue notifications forever
+        subscription=getHub().listen(limit=self._appmap_event_limit)
+        try:
+            self._watch_object_changes(subscription, window_handle,
+                                       strict=True)
+        except atomac._a11y.Error:
+            subscription.close()
+            return None
+        return subscription
+
+    def _update_appmap(self, obj_dict):
+        """
+        Patch an appmap with the notifications received since last update
+
+        @param obj_dict: appmap
+        @type obj_dict: AppMap
+
+        @return: True if patched, False if it needs to be rebuilt
+        @rtype: boolean
+        """
+        if obj_dict.subscription is None or obj_dict.subscription.overflowed:
+            # Changes were lost
+            return False
+        try:
+            while True:
+                event=obj_dict.subscription.get(0)
+                if event is None:
+                    return True
+                if obj_dict.pending:
+                    # The window changed where it is not mapped yet, map
+                    # it again as lookups need
+                    return False
+                element_ref, notification, tag=event
+                self._patch_appmap(obj_dict, element_ref, notification)
+        except atomac._a11y.Error:
+            return False
+
+    def _patch_appmap(self, obj_dict, element_ref, notification):
+        """
+        Apply one notification to an appmap
+
+        @param obj_dict: appmap
+        @type obj_dict: AppMap
+        @param element_ref: notified element reference
+        @type element_ref: object
+        @param notification: notification name
+        @type notification: string
+        """
+        key=obj_dict.key_of_ref(element_ref)
+        if notification == "AXUIElementDestroyed":
+            if key is not None:
+                obj_dict.remove(key)
+            return
+        element=atomac.NativeUIElement(element_ref)
+        if notification != "AXCreated":
+            # Title or value changed, the label may have
+            if key is not None:
+                self._relabel_in_appmap(obj_dict, key, element)
+            return
+        if key is not None:
+            # Already mapped
+            return
+        # Map the children of the closest mapped ancestor again, so that
+        # the new object lands at its place
+        node=element
+        while True:
+            parent=node.AXParent
+            if not parent:
+                # Not in this window
+                return
+            if parent == obj_dict.window:
+                parent_key=""
+                break
+            parent_key=obj_dict.key_of_ref(parent.ref)
+            if parent_key is not None:
+                break
+            node=parent
+        self._sync_appmap_children(obj_dict, parent_key, parent)
+
+    def _sync_appmap_children(self, obj_dict, parent_key, parent):
+        """
+        Map the children of an object again; children already mapped keep
+        their LDTP name, without being read again
+
+        @param obj_dict: appmap
+        @type obj_dict: AppMap
+        @param parent_key: LDTP name of the object, empty for the window
+        @type parent_key: string
+        @param parent: the object
+        @type parent: atomac.NativeUIElement
+        """
+        old_keys=obj_dict.children_of(parent_key)
+        new_keys=[]
+        index=-1
+        for child in parent.AXChildren or []:
+            index += 1
+            if not child:
+                continue
+            key=obj_dict.key_of_ref(child.ref)
+            if key is not None and obj_dict[key]["parent"] != parent_key:
+                # Moved from another place
+                obj_dict.remove(key)
+                key=None
+            if key is None:
+                self._populate_appmap(obj_dict, child, parent_key, index)
+                key=obj_dict.key_of_ref(child.ref)
+            else:
+                obj_dict[key]["child_index"]=index
+            new_keys.append(key)
+        for key in old_keys:
+            if key not in new_keys and key in obj_dict:
+                obj_dict.remove(key)
+        obj_dict.set_children(parent_key, new_keys)
+
+    def _relabel_in_appmap(self, obj_dict, key, element):
+        """
+        Update the label of an object, and its LDTP name with it
+
+        @param obj_dict: appmap
+        @type obj_dict: AppMap
+        @param key: LDTP name of the object
+        @type key: string
+        @param element: the object
+        @type element: atomac.NativeUIElement
+        """
+        ldtpized_name=self._ldtpize_accessible(element)
+        info=obj_dict[key]
+        if ldtpized_name[1] == info["label"]:
+            return
+        # Numbered as if the object was not there, so that it may keep
+        # its name
+        del obj_dict[key]
+        new_key=self._unique_appmap_key(obj_dict, ldtpized_name)
+        info["label"]=ldtpized_name[1]
+        obj_dict[key]=info
+        if new_key != key:
+            obj_dict.rename(key, new_key)
+
     def _get_menu_handle(self, window_name, object_name,
                          wait_for_window=True):
         window_handle, name, app=self._get_window_handle(window_name,
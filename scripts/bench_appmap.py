@@ -0,0 +1,89 @@
+# Copyright (c) 2010 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Time to list the windows and map one of them versus reader threads.
+
+Runs the LDTP window listing and appmap population on FakeBackend
+applications whose every call sleeps for --latency seconds, standing in
+for the round trip to the target application, and checks that each
+thread count gives the same LDTP names. No Mac is needed; like the LDTP
+server, it runs on Python 2:
+
+    PYTHONPATH=. python scripts/bench_appmap.py --threads 1 2 4 8 16
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+
+import atomac
+from atomac.FakeBackend import FakeBackend
+
+# Import the LDTP utils on their own, the server package also loads the
+# modules needing AppKit
+sys.path.insert(0, os.path.join(os.path.dirname(atomac.__file__), 'ldtpd'))
+from utils import Utils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--apps', type=int, default=4)
+    parser.add_argument('--fanout', type=int, default=6)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.001)
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    backend = FakeBackend(latency=args.latency)
+    for index in range(args.apps):
+        backend.buildTree(fanout=args.fanout, depth=args.depth,
+                          title='App%d' % index)
+    atomac.setBackend(backend)
+
+    utils = Utils()
+    reference = None
+    print('%7s %8s %10s %8s %10s %8s %6s' % ('threads', 'windows', 'seconds',
+                                            'objects', 'seconds', 'speedup',
+                                            'same'))
+    for workers in args.threads:
+        Utils._tree_reader.workers = workers
+        start = time.time()
+        windows = utils._get_windows(True)
+        windowsTime = time.time() - start
+        window_name = sorted(windows)[0]
+        window_handle, window_name = \
+            utils._get_window_handle(window_name)[:2]
+        start = time.time()
+        appmap = utils._get_appmap(window_handle, window_name, True, False)
+        appmapTime = time.time() - start
+        names = (sorted(windows), sorted(
+            (key, node['obj_index'], node['parent'], node['children'])
+            for key, node in appmap.items()))
+        if reference is None:
+            reference = (names, windowsTime + appmapTime)
+        print('%7d %8d %10.3f %8d %10.3f %7.1fx %6s' % (
+            workers, len(windows), windowsTime, len(appmap), appmapTime,
+            reference[1] / (windowsTime + appmapTime),
+            names == reference[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# Copyright (c) 2010 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Per-call cost of decoding AXPosition / AXSize / AXRange values.
+
+Compares the former decoding (parsing the description of the AXValue with a
+regular expression and NSPointFromString & co.) with the struct extraction
+of the PyObjC backend. Needs PyObjC, i.e. a Mac:
+
+    PYTHONPATH=. python scripts/bench_axvalue.py -n 100000
+"""
+
+from __future__ import print_function
+
+import re
+import sys
+import timeit
+import argparse
+
+try:
+    from ApplicationServices import (AXValueCreate, AXValueGetType,
+                                     kAXValueCGPointType, kAXValueCGSizeType,
+                                     kAXValueCFRangeType)
+    from Foundation import (NSPointFromString, NSSizeFromString,
+                            NSRangeFromString)
+except ImportError:
+    sys.exit('PyObjC is needed to create AXValues')
+
+from atomac import PyObjCBackend
+
+
+def legacyDecode(attrValue):
+    """The description parsing used before direct extraction."""
+    ax_type_map = {
+        kAXValueCGSizeType: NSSizeFromString,
+        kAXValueCGPointType: NSPointFromString,
+        kAXValueCFRangeType: NSRangeFromString,
+    }
+    ax_attr_type = AXValueGetType(attrValue)
+    extracted_str = re.search('{.*}', attrValue.description()).group()
+    return tuple(ax_type_map[ax_attr_type](extracted_str))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--number', type=int, default=100000,
+                        help='decodes per value type')
+    args = parser.parse_args()
+
+    values = [
+        ('CGPoint', AXValueCreate(kAXValueCGPointType, (120.0, 340.0))),
+        ('CGSize', AXValueCreate(kAXValueCGSizeType, (800.0, 600.0))),
+        ('CFRange', AXValueCreate(kAXValueCFRangeType, (5, 12))),
+    ]
+    print('%-8s %12s %12s %8s' % ('type', 'before (us)', 'after (us)',
+                                  'speedup'))
+    for name, value in values:
+        before = timeit.timeit(lambda: legacyDecode(value),
+                               number=args.number)
+        after = timeit.timeit(lambda: PyObjCBackend._convertAXValue(None,
+                                                                   value),
+                              number=args.number)
+        print('%-8s %12.2f %12.2f %7.1fx' % (
+            name, before * 1e6 / args.number, after * 1e6 / args.number,
+            before / after))
+
+
+if __name__ == '__main__':
+    main()
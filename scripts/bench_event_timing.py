@@ -0,0 +1,86 @@
+# Copyright (c) 2010 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Characters per second typed under each event timing profile.
+
+Key presses and releases are queued for a text field of the FakeBackend,
+which appends the character and posts AXValueChanged a little while after
+each release, as an application would. The events stand in for the Quartz
+ones, so no Mac is needed:
+
+    PYTHONPATH=. python scripts/bench_event_timing.py --chars 200
+"""
+
+from __future__ import print_function
+
+import time
+import argparse
+import threading
+
+import atomac
+from atomac.FakeBackend import FakeBackend
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chars', type=int, default=200,
+                        help='length of the string typed')
+    parser.add_argument('--reaction', type=float, default=0.002,
+                        help='seconds the application takes to update')
+    args = parser.parse_args()
+
+    backend = FakeBackend()
+    app = backend.buildTree(fanout=1, depth=1)
+    field = backend.addElement(app.attributes['AXWindows'][0],
+                               'AXTextField', {'AXValue': ''})
+    atomac.setBackend(backend)
+    element = atomac.NativeUIElement(field)
+
+    def update(keychr):
+        field.attributes['AXValue'] += keychr
+        backend.postNotification(field, 'AXValueChanged')
+
+    def keyDown(keychr):
+        pass
+
+    def keyUp(keychr):
+        threading.Timer(args.reaction, update, (keychr,)).start()
+
+    text = ('The quick brown fox jumps over the lazy dog. ' *
+            (args.chars // 45 + 1))[:args.chars]
+    profiles = [
+        ('FixedDelay(0.01)', atomac.AXEventTiming.FixedDelay(0.01)),
+        ('NoDelay()', atomac.AXEventTiming.NoDelay()),
+        ('WaitForValueChange()', atomac.AXEventTiming.WaitForValueChange()),
+    ]
+    for name, profile in profiles:
+        element.setEventTiming(profile)
+        field.attributes['AXValue'] = ''
+        for keychr in text:
+            element._queueEvent(keyDown, (keychr,))
+            element._queueEvent(keyUp, (keychr,), settle=True)
+        start = time.time()
+        element._postQueuedEvents()
+        elapsed = time.time() - start
+        # Let the last updates land before comparing
+        time.sleep(args.reaction * 5)
+        print('%-22s %9.0f chars/s  value complete: %s' % (
+            name, len(text) / elapsed, field.attributes['AXValue'] == text))
+
+
+if __name__ == '__main__':
+    main()
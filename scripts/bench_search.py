@@ -0,0 +1,88 @@
+# Copyright (c) 2010 VMware, Inc. All Rights Reserved.
+
+# This file is part of ATOMac.
+
+# ATOMac is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation version 2 and no later version.
+
+# ATOMac is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License version 2
+# for more details.
+
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51 Franklin
+# St, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Recursive search on a synthetic tree of about 50k elements.
+
+Compares the former recursive generator with the iterative traversal of
+findAllR / findFirstR (depth-first and breadth-first), then finds a button
+placed right below the window after all the groups, which a depth-first
+search only reaches last. Runs on the FakeBackend, no Mac needed:
+
+    PYTHONPATH=. python scripts/bench_search.py --fanout 6 --depth 6
+"""
+
+from __future__ import print_function
+
+import time
+import argparse
+
+import atomac
+from atomac import _a11y
+from atomac.FakeBackend import FakeBackend
+
+
+def legacyChildrenR(target):
+    """The recursive generator used before the iterative traversal."""
+    try:
+        children = target.AXChildren
+    except _a11y.Error:
+        return
+    if children:
+        for child in children:
+            yield child
+            for c in legacyChildrenR(child):
+                yield c
+
+
+def timed(label, function):
+    start = time.time()
+    result = function()
+    print('%-28s %8.3f s  %s' % (label, time.time() - start, result))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fanout', type=int, default=6)
+    parser.add_argument('--depth', type=int, default=6)
+    args = parser.parse_args()
+
+    backend = FakeBackend()
+    app = backend.buildTree(fanout=args.fanout, depth=args.depth)
+    backend.addElement(app.attributes['AXWindows'][0], 'AXButton',
+                       {'AXTitle': 'Shallow'}, notify=False)
+    atomac.setBackend(backend)
+    window = atomac.getAppRefByPid(app.pid).windows()[0]
+
+    timed('legacy generator', lambda: sum(1 for _ in legacyChildrenR(window)))
+    timed('iterative dfs',
+          lambda: sum(1 for _ in window._generateChildrenR()))
+    timed('iterative bfs',
+          lambda: sum(1 for _ in window._generateChildrenR(strategy='bfs')))
+    timed('findAllR buttons',
+          lambda: len(window.findAllR(AXRole='AXButton')))
+    timed('findAllR buttons, depth 2',
+          lambda: len(window.findAllR(AXRole='AXButton', max_depth=2)))
+    timed('findFirstR shallow, dfs',
+          lambda: window.findFirstR(AXTitle='Shallow') is not None)
+    timed('findFirstR shallow, bfs',
+          lambda: window.findFirstR(AXTitle='Shallow',
+                                    strategy='bfs') is not None)
+
+
+if __name__ == '__main__':
+    main()